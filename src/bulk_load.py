@@ -0,0 +1,45 @@
+"""bulk_load.py
+
+"""
+import argparse
+import logging
+from exception.exceptions import BaseError
+from data_provider import intrinio_bulk_loader
+from support.financial_cache import cache
+
+#
+# Main script
+#
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+
+description = """ Loads a local dump of financial statements, metrics and prices
+                  into the financial cache, so that valuations can run without
+                  calling the Intrinio APIs.
+
+                  The dump directory may contain a 'statements.jsonl', 'metrics.csv'
+                  and 'prices.csv' file. See data_provider/intrinio_bulk_loader.py
+                  for the format of each file.
+              """
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("dump_directory", help="Directory containing the files to load", type=str)
+
+log = logging.getLogger()
+
+args = parser.parse_args()
+
+try:
+    loaded_rows = intrinio_bulk_loader.load_directory(args.dump_directory)
+
+    if len(loaded_rows) == 0:
+        log.info("No files were found in %s" % args.dump_directory)
+
+    for (file_name, rows) in loaded_rows.items():
+        log.info("Loaded %d rows from %s" % (rows, file_name))
+except BaseError as be:
+    print("Could not load %s because: %s" % (args.dump_directory, str(be)))
+    exit(-1)
+finally:
+    # close the financial cache
+    cache.close()
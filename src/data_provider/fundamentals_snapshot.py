@@ -0,0 +1,329 @@
+"""Author: Mark Hanegraaff -- 2019
+
+This module exports a subset of the cached fundamentals (a few tags, for
+every ticker and year) into a read-only columnar snapshot, that can be
+memory mapped and used for universe wide screens without reading and
+decoding the cache one value at a time.
+
+A snapshot is a directory containing one or more versions of the snapshot,
+each in its own subdirectory, and a pointer to the current one:
+
+  current
+    The name of the subdirectory holding the current version. Exports write
+    a new subdirectory and then atomically replace this file, so readers
+    always see the index and values of the same export.
+
+  <version>/index.json
+    The layout of the snapshot: the list of tickers, the range of years
+    and the list of tags, e.g.
+    {"version": 1, "tickers": ["AAPL", ...], "year_from": 2009, "year_to": 2018,
+     "tags": ["totalrevenue", "netincome", ...]}
+
+  <version>/values.f64
+    A C ordered float64 array of shape (tickers, years, tags).
+    Missing values are NaN.
+"""
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from data_provider import intrinio_data
+from exception.exceptions import DataError, FileSystemError, ValidationError
+
+SNAPSHOT_VERSION = 1
+
+CURRENT_FILE_NAME = 'current'
+INDEX_FILE_NAME = 'index.json'
+VALUES_FILE_NAME = 'values.f64'
+
+# the prefix of the subdirectories holding the versions of a snapshot
+VERSION_DIR_PREFIX = 'snapshot-'
+
+# the default tags of a snapshot, as a list of (tag, source) tuples,
+# where the source is the name of the financial statement containing
+# the tag, or 'metric' for metrics
+DEFAULT_SNAPSHOT_TAGS = [
+    ('totalrevenue', 'metric'),
+    ('netincome', 'cash_flow_statement'),
+    ('netcashfromcontinuingoperatingactivities', 'cash_flow_statement'),
+    ('purchaseofplantpropertyandequipment', 'cash_flow_statement')
+]
+
+
+def list_cached_tickers():
+    """
+      Returns the sorted list of tickers with statements or metrics in the cache
+    """
+    tickers = set()
+    statement_prefix = "%s-%s-%s-" % (intrinio_data.INTRINIO_CACHE_PREFIX, "statement", intrinio_data.STATEMENT_CACHE_VERSION)
+    metric_prefix = "%s-%s-%s-" % (intrinio_data.INTRINIO_CACHE_PREFIX, "metric", intrinio_data.METRIC_CACHE_VERSION)
+
+    for key in intrinio_data.cache.iterkeys():
+        # both keys end with 3 segments after the ticker, which may contain
+        # hyphens (e.g. intrinio-metric-v2-BRK-B-yearly-totalrevenue-2018)
+        if key.startswith(statement_prefix) or key.startswith(metric_prefix):
+            tickers.add(key.split('-', 3)[3].rsplit('-', 3)[0])
+
+    return sorted(tickers)
+
+
+def export_snapshot(path : str, ticker_list : list, year_from : int, year_to : int, tags : list = None):
+    """
+      Exports the supplied tags from the financial cache into a snapshot.
+      Only cached data is exported, the Intrinio APIs are never called.
+
+      The snapshot is written to a new subdirectory, which becomes the
+      current one once complete, so readers never see a partial snapshot
+      or the index of one export with the values of another. The previous
+      version is kept for readers that are still opening it, while older
+      ones are removed.
+
+      Parameters
+      ----------
+      path : str
+        The directory of the snapshot
+      ticker_list : list
+        The tickers to export
+      year_from : int
+        The first year to export
+      year_to : int
+        The last year to export
+      tags : list
+        (optional) a list of (tag, source) tuples. See DEFAULT_SNAPSHOT_TAGS
+
+      Raises
+      -------
+      ValidationError in case of an invalid range of years
+      FileSystemError in case the snapshot cannot be written
+
+      Returns
+      -------
+      The number of values that were exported (i.e. that are not NaN)
+    """
+    if year_from > year_to:
+        raise ValidationError("Invalid snapshot years: %d - %d" % (year_from, year_to), None)
+
+    tags = tags if tags != None else DEFAULT_SNAPSHOT_TAGS
+    ticker_list = [ticker.upper() for ticker in ticker_list]
+    years = range(year_from, year_to + 1)
+
+    values = np.full((len(ticker_list), len(years), len(tags)), np.nan, dtype=np.float64)
+
+    for (t, ticker) in enumerate(ticker_list):
+        for (c, (tag, source)) in enumerate(tags):
+            if source == 'metric':
+                keys = [intrinio_data.__metric_cache_key__(ticker, 'yearly', tag, year) for year in years]
+            else:
+                keys = [intrinio_data.__statement_cache_key__(ticker, source, 'FY', year) for year in years]
+
+            cached_values = intrinio_data.cache.read_many(keys)
+
+            for (y, key) in enumerate(keys):
+                value = cached_values[key]
+
+                if isinstance(value, dict):
+                    value = value.get(tag)
+
+                if isinstance(value, (int, float)):
+                    values[t, y, c] = value
+
+    index = {
+        'version': SNAPSHOT_VERSION,
+        'tickers': ticker_list,
+        'year_from': year_from,
+        'year_to': year_to,
+        'tags': [tag for (tag, source) in tags]
+    }
+
+    version_dir = None
+
+    try:
+        os.makedirs(path, exist_ok=True)
+
+        # mkdtemp creates private directories, while snapshots
+        # are shared with readers running as other users
+        version_dir = tempfile.mkdtemp(prefix=VERSION_DIR_PREFIX, dir=path)
+        os.chmod(version_dir, 0o755)
+
+        values.tofile(os.path.join(version_dir, VALUES_FILE_NAME))
+        with open(os.path.join(version_dir, INDEX_FILE_NAME), 'w') as f:
+            json.dump(index, f)
+
+        previous_dir = __read_current__(path)
+
+        current_file = os.path.join(path, CURRENT_FILE_NAME)
+        current_tmp_file = "%s.%s.tmp" % (current_file, os.path.basename(version_dir))
+        with open(current_tmp_file, 'w') as f:
+            f.write(os.path.basename(version_dir))
+        os.replace(current_tmp_file, current_file)
+    except Exception as e:
+        if version_dir != None:
+            shutil.rmtree(version_dir, ignore_errors=True)
+        raise FileSystemError("Can't write snapshot: %s" % path, e)
+
+    for name in os.listdir(path):
+        if name.startswith(VERSION_DIR_PREFIX) and name not in (os.path.basename(version_dir), previous_dir):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    return int(np.count_nonzero(~np.isnan(values)))
+
+
+def __read_current__(path : str):
+    """
+      Returns the name of the current version of a snapshot, or None if
+      the snapshot doesn't exist
+    """
+    try:
+        with open(os.path.join(path, CURRENT_FILE_NAME)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class FundamentalsSnapshot():
+    """
+        A read-only, memory mapped fundamentals snapshot.
+        Values are read directly from the mapped file, so opening
+        a snapshot is independent of its size.
+
+        Attributes:
+            tickers : list
+                The tickers of the snapshot
+            years : list
+                The years of the snapshot
+            tags : list
+                The tags of the snapshot
+            values : numpy.ndarray
+                The (read-only) array of shape (tickers, years, tags)
+    """
+
+    def __init__(self, path : str):
+        '''
+            Opens a snapshot
+
+            Parameters
+            ----------
+            path : str
+            The directory of the snapshot
+
+            Raises
+            ------
+            FileSystemError : in case the snapshot cannot be read
+            DataError : in case of an unsupported snapshot version
+        '''
+        try:
+            current = __read_current__(path)
+            if current == None:
+                raise FileNotFoundError(os.path.join(path, CURRENT_FILE_NAME))
+
+            path = os.path.join(path, current)
+
+            with open(os.path.join(path, INDEX_FILE_NAME)) as f:
+                index = json.load(f)
+        except Exception as e:
+            raise FileSystemError("Can't read snapshot index: %s" % path, e)
+
+        if index.get('version') != SNAPSHOT_VERSION:
+            raise DataError("Unsupported snapshot version: %s" % str(index.get('version')), None)
+
+        self.tickers = index['tickers']
+        self.years = list(range(index['year_from'], index['year_to'] + 1))
+        self.tags = index['tags']
+
+        self.ticker_index = {ticker: i for (i, ticker) in enumerate(self.tickers)}
+        self.tag_index = {tag: i for (i, tag) in enumerate(self.tags)}
+
+        shape = (len(self.tickers), len(self.years), len(self.tags))
+
+        try:
+            if 0 in shape:
+                self.values = np.empty(shape, dtype=np.float64)
+            else:
+                self.values = np.memmap(os.path.join(path, VALUES_FILE_NAME), dtype=np.float64, mode='r', shape=shape)
+        except Exception as e:
+            raise FileSystemError("Can't read snapshot values: %s" % path, e)
+
+    def get_column(self, tag : str, year : int):
+        """
+            Returns the values of a tag for all tickers in a single year,
+            as an array ordered like the tickers attribute.
+
+            Raises
+            ------
+            DataError : in case the tag or year are not part of the snapshot
+        """
+        return self.values[:, self.__year__(year), self.__tag__(tag)]
+
+    def get_value(self, ticker : str, tag : str, year : int):
+        """
+            Returns the value of a tag for a ticker and year, or NaN if it's missing
+
+            Raises
+            ------
+            DataError : in case the ticker, tag or year are not part of the snapshot
+        """
+        return float(self.values[self.__ticker__(ticker), self.__year__(year), self.__tag__(tag)])
+
+    def get_series(self, ticker : str, tag : str, year_from : int, year_to : int):
+        """
+            Returns the values of a tag for a ticker and range of years,
+            in the same format as intrinio_data (e.g. get_historical_revenue).
+            Missing years are omitted, e.g.
+
+            {
+                2017: 229234000000.0,
+                2018: 265595000000.0
+            }
+
+            Raises
+            ------
+            DataError : in case the ticker or tag are not part of the snapshot,
+            or the range is not fully covered
+        """
+        (start, end) = (self.__year__(year_from), self.__year__(year_to))
+        series = self.values[self.__ticker__(ticker), start:end + 1, self.__tag__(tag)]
+
+        return {year: float(value) for (year, value) in zip(range(year_from, year_to + 1), series)
+                if not np.isnan(value)}
+
+    def get_statements(self, ticker : str, year_from : int, year_to : int, tags : list):
+        """
+            Returns the values of several tags for a ticker and range of years,
+            in the same format as intrinio_data.get_historical_cashflow_stmt,
+            so that they can be used by the calculator, e.g.
+
+            {
+                2017: {'netincome': 48351000000.0, ...},
+                2018: {'netincome': 59531000000.0, ...}
+            }
+
+            Raises
+            ------
+            DataError : in case the ticker or tags are not part of the snapshot,
+            or the range is not fully covered
+        """
+        statements = {year: {} for year in range(year_from, year_to + 1)}
+
+        for tag in tags:
+            for (year, value) in self.get_series(ticker, tag, year_from, year_to).items():
+                statements[year][tag] = value
+
+        return statements
+
+    def __ticker__(self, ticker : str):
+        try:
+            return self.ticker_index[ticker.upper()]
+        except KeyError:
+            raise DataError("Ticker is not part of the snapshot: %s" % ticker, None)
+
+    def __tag__(self, tag : str):
+        try:
+            return self.tag_index[tag]
+        except KeyError:
+            raise DataError("Tag is not part of the snapshot: %s" % tag, None)
+
+    def __year__(self, year : int):
+        if year not in self.years:
+            raise DataError("Year is not part of the snapshot: %d" % year, None)
+        return year - self.years[0]
@@ -0,0 +1,246 @@
+"""Author: Mark Hanegraaff -- 2019
+
+This module loads a local dump of Intrinio financial data into the
+financial cache, using the same cache keys read by intrinio_data, so
+that valuations can run without calling the Intrinio APIs.
+
+The dump is a directory containing any of the following files:
+
+  statements.jsonl
+    One normalized financial statement per line, for example:
+    {"ticker": "AAPL", "statement": "cash_flow_statement", "year": 2018, "tags": {"netincome": 59531000000.0}}
+
+  metrics.csv
+    One metric datapoint per row, with a header row:
+    ticker,tag,year,value
+
+  prices.csv
+    One daily closing price per row, with a header row:
+    ticker,date,close
+
+  Dates are formatted as YYYY-MM-DD. The prices of each ticker must cover
+  every trading day between its first and last date.
+"""
+import csv
+import json
+import os
+import time
+import logging
+from data_provider import intrinio_data
+from exception.exceptions import DataError, FileSystemError
+
+log = logging.getLogger()
+
+# number of rows written to the cache in a single transaction
+ROWS_PER_TRANSACTION = 10000
+
+# number of rows after which progress is reported
+ROWS_PER_PROGRESS_REPORT = 100000
+
+
+def load_directory(path : str):
+    """
+      Loads all the files of a dump directory into the financial cache.
+      See the module documentation for the expected layout.
+
+      Parameters
+      ----------
+      path : str
+        The path of the dump directory
+
+      Raises
+      -------
+      FileSystemError in case the directory or its files cannot be read
+      DataError in case of a malformed row
+
+      Returns
+      -------
+      A dictionary of file name=>number of rows loaded
+    """
+    if not os.path.isdir(path):
+        raise FileSystemError("Can't read bulk load directory: %s" % path, None)
+
+    loaders = [
+        ('statements.jsonl', load_statements),
+        ('metrics.csv', load_metrics),
+        ('prices.csv', load_prices)
+    ]
+
+    loaded_rows = {}
+
+    for (file_name, loader) in loaders:
+        file_path = os.path.join(path, file_name)
+        if os.path.isfile(file_path):
+            loaded_rows[file_name] = loader(file_path)
+
+    return loaded_rows
+
+
+def load_statements(file_path : str):
+    """
+      Loads a JSONL file of normalized financial statements into the financial cache
+
+      Parameters
+      ----------
+      file_path : str
+        The path of the statements file
+
+      Returns
+      -------
+      The number of statements loaded
+    """
+
+    def parse(line : str):
+        statement = json.loads(line)
+
+        return (intrinio_data.__statement_cache_key__(
+                    statement['ticker'], statement['statement'], 'FY', int(statement['year'])),
+                {tag: float(value) for (tag, value) in statement['tags'].items()})
+
+    with __open_file__(file_path) as f:
+        return __load_rows__(file_path, (line for line in f if line.strip() != ""), parse)
+
+
+def load_metrics(file_path : str):
+    """
+      Loads a CSV file of yearly metric datapoints into the financial cache
+
+      Parameters
+      ----------
+      file_path : str
+        The path of the metrics file
+
+      Returns
+      -------
+      The number of datapoints loaded
+    """
+
+    def parse(row : dict):
+        return (intrinio_data.__metric_cache_key__(
+                    row['ticker'], 'yearly', row['tag'], int(row['year'])),
+                float(row['value']))
+
+    with __open_file__(file_path) as f:
+        return __load_rows__(file_path, csv.DictReader(f), parse)
+
+
+def load_prices(file_path : str):
+    """
+      Loads a CSV file of daily closing prices into the financial cache, and
+      updates the price index of each ticker so that only the prices
+      after the last loaded date are fetched from the API.
+
+      Parameters
+      ----------
+      file_path : str
+        The path of the prices file
+
+      Returns
+      -------
+      The number of prices loaded
+    """
+    # the dates loaded for each price index key
+    price_dates = {}
+
+    def parse(row : dict):
+        index_key = intrinio_data.__price_index_cache_key__(row['ticker'])
+        date = row['date']
+
+        if index_key not in price_dates:
+            price_dates[index_key] = set()
+        price_dates[index_key].add(date)
+
+        return (intrinio_data.__price_cache_key__(row['ticker'], date), float(row['close']))
+
+    with __open_file__(file_path) as f:
+        loaded_rows = __load_rows__(file_path, csv.DictReader(f), parse)
+
+    with intrinio_data.cache.transaction(keys=price_dates.keys()):
+        for (index_key, dates) in price_dates.items():
+            price_index = intrinio_data.cache.read(index_key)
+
+            if price_index != None:
+                dates = dates.union(price_index['dates'])
+
+            dates = sorted(dates)
+
+            intrinio_data.cache.write(index_key, {
+                'start_date': min(dates[0], price_index['start_date']) if price_index != None else dates[0],
+                'end_date': max(dates[-1], price_index['end_date']) if price_index != None else dates[-1],
+                'dates': dates
+            }, data_class=intrinio_data.PRICE_INDEX_DATA_CLASS)
+
+    return loaded_rows
+
+
+def __open_file__(file_path : str):
+    """
+      Helper function that opens a dump file for reading
+    """
+    try:
+        return open(file_path, newline='')
+    except Exception as e:
+        raise FileSystemError("Can't read bulk load file: %s" % file_path, e)
+
+
+def __load_rows__(file_path : str, rows : object, parse_fn : object):
+    """
+      Helper function that streams rows into the financial cache, writing
+      ROWS_PER_TRANSACTION rows at a time in a single transaction.
+
+      Parameters
+      ----------
+      file_path : str
+        The path of the file, used for reporting
+      rows : object
+        An iterator of rows
+      parse_fn : object
+        A function that converts a row into a (cache key, value) tuple
+
+      Raises
+      -------
+      DataError in case a row cannot be parsed
+
+      Returns
+      -------
+      The number of rows loaded
+    """
+    start_time = time.monotonic()
+    loaded_rows = 0
+    rows = iter(rows)
+
+    while True:
+        # rows are parsed before the transaction is opened, so that it only
+        # locks the shards of the keys that are written
+        batch = []
+
+        for row in rows:
+            try:
+                batch.append(parse_fn(row))
+            except Exception as e:
+                raise DataError("Could not parse row %d of %s" % (loaded_rows + 1, file_path), e)
+
+            loaded_rows += 1
+
+            if loaded_rows % ROWS_PER_PROGRESS_REPORT == 0:
+                __report_progress__(file_path, loaded_rows, start_time)
+
+            if len(batch) == ROWS_PER_TRANSACTION:
+                break
+
+        intrinio_data.cache.write_many(dict(batch))
+
+        if len(batch) < ROWS_PER_TRANSACTION:
+            break
+
+    __report_progress__(file_path, loaded_rows, start_time)
+
+    return loaded_rows
+
+
+def __report_progress__(file_path : str, loaded_rows : int, start_time : float):
+    """
+      Helper function that logs the number of rows loaded and the load rate
+    """
+    elapsed = max(time.monotonic() - start_time, 1e-6)
+    log.info("%s: %d rows loaded (%.0f rows/s)" % (file_path, loaded_rows, loaded_rows / elapsed))
@@ -0,0 +1,250 @@
+"""Author: Mark Hanegraaff -- 2019
+
+This module warms the financial cache ahead of a valuation run, by fetching
+every statement, metric and price that the valuation will read, so that
+the run itself never calls the Intrinio APIs.
+
+The data is described by a list of requests (see plan_valuation_data), like:
+
+  {'type': 'statement', 'ticker': 'AAPL', 'name': 'cash_flow_statement', 'years': [2014, ..., 2018]}
+  {'type': 'metric', 'ticker': 'AAPL', 'name': 'totalrevenue', 'years': [2014, ..., 2018]}
+  {'type': 'price', 'ticker': 'AAPL', 'start_date': date(2019, 10, 1), 'end_date': date(2019, 10, 6)}
+
+Each year of a statement or metric, and each price range, is an item. Items
+that are already cached, including those known to have no data, are skipped.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from data_provider import intrinio_data
+from data_provider import intrinio_util
+from exception.exceptions import BaseError
+
+log = logging.getLogger()
+
+# minimum number of seconds between progress reports
+PROGRESS_REPORT_SECONDS = 5
+
+# the cash flow statement read by JimmyValuationModel
+VALUATION_STATEMENTS = ['cash_flow_statement']
+
+# the metrics read by JimmyValuationModel over its history years
+VALUATION_HISTORICAL_METRICS = ['totalrevenue']
+
+# the metrics read for the fiscal year only, by JimmyValuationModel
+# (outstanding shares) and calculator.calc_graham_number (eps and book value)
+VALUATION_METRICS = ['weightedavedilutedsharesos', 'adjdilutedeps', 'bookvaluepershare']
+
+
+def plan_valuation_data(ticker_list : list, year_from : int, year_to : int, history_years : int,
+                        price_start_date : object, price_end_date : object):
+    """
+      Returns the requests describing all the data read when valuating
+      the supplied tickers for each fiscal year in the supplied range.
+
+      Parameters
+      ----------
+      ticker_list : list
+        A list of ticker symbols
+      year_from : int
+        The first fiscal year that will be valued
+      year_to : int
+        The last fiscal year that will be valued
+      history_years : int
+        The number of years of history read before each fiscal year
+      price_start_date : object
+        The first date of the prices that will be read, as a python date
+      price_end_date : object
+        The last date of the prices that will be read, as a python date
+
+      Returns
+      -------
+      A list of requests. See the module documentation for their format
+    """
+    history = list(range(year_from - history_years, year_to + 1))
+    fiscal_years = list(range(year_from, year_to + 1))
+
+    requests = []
+
+    for ticker in ticker_list:
+        for statement_name in VALUATION_STATEMENTS:
+            requests.append({'type': 'statement', 'ticker': ticker, 'name': statement_name, 'years': history})
+
+        for tag in VALUATION_HISTORICAL_METRICS:
+            requests.append({'type': 'metric', 'ticker': ticker, 'name': tag, 'years': history})
+
+        for tag in VALUATION_METRICS:
+            requests.append({'type': 'metric', 'ticker': ticker, 'name': tag, 'years': fiscal_years})
+
+        requests.append({'type': 'price', 'ticker': ticker,
+                         'start_date': price_start_date, 'end_date': price_end_date})
+
+    return requests
+
+
+def count_items(request : dict):
+    """
+      Returns the number of items described by a request
+    """
+    return 1 if request['type'] == 'price' else len(request['years'])
+
+
+def get_missing_items(request : dict):
+    """
+      Returns the items of a request that are not cached, as a list of years
+      for statements and metrics, and as a list containing the date range
+      for prices
+    """
+    cache = intrinio_data.cache
+    ticker = request['ticker']
+
+    if request['type'] == 'price':
+        # the same ranges that get_daily_stock_close_prices would fetch
+        (price_index, fetch_ranges, cached_prices) = intrinio_data.__plan_price_fetch__(
+            ticker, intrinio_util.date_to_string(request['start_date']), intrinio_util.date_to_string(request['end_date']))
+
+        return [] if len(fetch_ranges) == 0 else [(request['start_date'], request['end_date'])]
+
+    if request['type'] == 'statement':
+        cache_key_fn = lambda year: intrinio_data.__statement_cache_key__(ticker, request['name'], 'FY', year)
+    else:
+        cache_key_fn = lambda year: intrinio_data.__metric_cache_key__(ticker, 'yearly', request['name'], year)
+
+    cached_values = cache.read_many([cache_key_fn(year) for year in request['years']])
+
+    return [year for year in request['years'] if cached_values[cache_key_fn(year)] == None]
+
+
+def fetch_missing_items(request : dict, missing_items : list):
+    """
+      Fetches the missing items of a request, which are written to the cache.
+
+      Statements are fetched one year at a time, so that a missing year
+      does not prevent the others from being cached, while metrics are
+      fetched using a single call for the whole range of missing years.
+
+      Raises
+      -------
+      DataError in case the data cannot be read from Intrinio
+      ValidationError in case of an unknown exception
+    """
+    ticker = request['ticker']
+
+    if request['type'] == 'price':
+        for (start_date, end_date) in missing_items:
+            intrinio_data.get_daily_stock_close_prices(ticker, start_date, end_date)
+    elif request['type'] == 'statement':
+        error = None
+
+        for year in missing_items:
+            try:
+                intrinio_data.__read_historical_financial_statement__(ticker, request['name'], year, year, None)
+            except BaseError as be:
+                error = error or be
+
+        if error != None:
+            raise error
+    else:
+        intrinio_data.__read_financial_metrics__(ticker, missing_items[0], missing_items[-1], request['name'])
+
+
+def warm(requests : list, workers : int):
+    """
+      Fetches all the items of the supplied requests that are not cached,
+      processing up to 'workers' requests concurrently. All API calls share
+      the intrinio_data rate limiter, so the request rate never exceeds its budget.
+
+      Progress is logged every PROGRESS_REPORT_SECONDS.
+
+      Parameters
+      ----------
+      requests : list
+        The list of requests, see plan_valuation_data
+      workers : int
+        The number of requests processed concurrently
+
+      Returns
+      -------
+      A dictionary with the following statistics:
+
+      {
+        'requests': 100,         # number of requests
+        'items': 900,            # number of items
+        'cached_items': 300,     # number of items that were already cached
+        'fetched_items': 590,    # number of items that were fetched
+        'failed_items': 10,      # number of items that could not be fetched
+        'coverage': 0.98,        # fraction of items now cached
+        'api_requests': 120,     # number of API requests
+        'elapsed_seconds': 10.0,
+        'items_per_second': 59.0
+      }
+    """
+    start_time = time.monotonic()
+    start_api_requests = intrinio_data.get_api_stats()['requests']
+
+    stats = {
+        'requests': len(requests),
+        'items': sum(count_items(request) for request in requests),
+        'cached_items': 0,
+        'fetched_items': 0,
+        'failed_items': 0
+    }
+
+    def process(request : dict):
+        missing_items = get_missing_items(request)
+        cached_items = count_items(request) - len(missing_items)
+
+        if len(missing_items) == 0:
+            return (cached_items, 0, None)
+
+        try:
+            fetch_missing_items(request, missing_items)
+        except BaseError as be:
+            # some of the items may have been fetched regardless
+            return (cached_items, len(missing_items), str(be))
+
+        return (cached_items, len(missing_items), None)
+
+    last_report = start_time
+    completed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process, request): request for request in requests}
+
+        for future in as_completed(futures):
+            request = futures[future]
+            (cached_items, missing_items, error) = future.result()
+
+            stats['cached_items'] += cached_items
+            if error == None:
+                stats['fetched_items'] += missing_items
+            else:
+                stats['failed_items'] += missing_items
+                log.warning("Could not warm %s %s for %s: %s" %
+                            (request['type'], request.get('name', ''), request['ticker'], error))
+
+            completed += 1
+
+            if time.monotonic() - last_report >= PROGRESS_REPORT_SECONDS:
+                last_report = time.monotonic()
+                __report_progress__(completed, stats, start_time)
+
+    elapsed = max(time.monotonic() - start_time, 1e-6)
+
+    stats['coverage'] = sum(count_items(request) - len(get_missing_items(request))
+                            for request in requests) / max(stats['items'], 1)
+    stats['api_requests'] = intrinio_data.get_api_stats()['requests'] - start_api_requests
+    stats['elapsed_seconds'] = elapsed
+    stats['items_per_second'] = (stats['fetched_items'] + stats['failed_items']) / elapsed
+
+    return stats
+
+
+def __report_progress__(completed : int, stats : dict, start_time : float):
+    """
+      Helper function that logs the progress of a warm up
+    """
+    elapsed = max(time.monotonic() - start_time, 1e-6)
+    log.info("%d/%d requests completed, %d items cached, %d fetched, %d failed (%.1f items/s)" %
+             (completed, stats['requests'], stats['cached_items'], stats['fetched_items'],
+              stats['failed_items'], (stats['fetched_items'] + stats['failed_items']) / elapsed))
@@ -1,11 +1,17 @@
 import datetime
-import intrinio_sdk
-from intrinio_sdk.rest import ApiException
+from types import SimpleNamespace
 import os
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from exception.exceptions import DataError, ValidationError
 from data_provider import intrinio_util
 from support.financial_cache import cache
+from support.single_flight import SingleFlight
+from support.lazy_object import LazyObject
+from support import financial_cache
+from support.rate_limiter import RateLimiter
+from support import instrumentation
 import logging
 
 """
@@ -14,24 +20,255 @@ and implements a number of functions to read current and historical
 financial statements
 """
 
-API_KEY = os.environ['INTRINIO_API_KEY']
+log = logging.getLogger()
 
-intrinio_sdk.ApiClient().configuration.api_key['api_key'] = API_KEY
 
-fundamentals_api = intrinio_sdk.FundamentalsApi()
-company_api = intrinio_sdk.CompanyApi()
-security_api = intrinio_sdk.SecurityApi()
+class ApiException(Exception):
+    """
+      Placeholder for intrinio_sdk.rest.ApiException, which replaces it once
+      the SDK is loaded. Until then no Intrinio API can be called, so no
+      ApiException can be raised.
+    """
+    pass
+
+
+sdk_lock = threading.Lock()
+sdk_loaded = False
+
+
+def __load_sdk__():
+    """
+      Helper function that imports the Intrinio SDK and configures its API key
+      (INTRINIO_API_KEY environment variable) when a client is first used,
+      so that importing this module is fast and reading from the cache does
+      not require a key.
+
+      Raises
+      -------
+      ValidationError in case the API key is not set
+
+      Returns
+      -------
+      The intrinio_sdk module
+    """
+    global ApiException, sdk_loaded
+
+    with sdk_lock:
+        import intrinio_sdk
+        import intrinio_sdk.rest
+
+        if not sdk_loaded:
+            api_key = os.environ.get('INTRINIO_API_KEY')
+            if api_key == None:
+                raise ValidationError("The INTRINIO_API_KEY environment variable is not set", None)
+
+            intrinio_sdk.ApiClient().configuration.api_key['api_key'] = api_key
+            ApiException = intrinio_sdk.rest.ApiException
+            sdk_loaded = True
+
+        return intrinio_sdk
+
+
+fundamentals_api = LazyObject(lambda: __load_sdk__().FundamentalsApi())
+company_api = LazyObject(lambda: __load_sdk__().CompanyApi())
+security_api = LazyObject(lambda: __load_sdk__().SecurityApi())
 
 
 INTRINIO_CACHE_PREFIX = 'intrinio'
 
+# maximum number of fiscal years that are fetched concurrently when
+# reading historical financial statements. Set to 1 to fetch serially
+STATEMENT_FETCH_WORKERS = 5
+
+# version of the cached financial statement format. Statements are
+# cached as normalized dictionaries of tag=>value
+STATEMENT_CACHE_VERSION = 'v2'
+
+# version of the cached financial metric format. Metrics are
+# cached as individual datapoints, one per year
+METRIC_CACHE_VERSION = 'v2'
+
+# version of the cached stock price format. Prices are cached
+# as individual closing prices, one per trading day
+PRICE_CACHE_VERSION = 'v1'
+
+# number of prices requested from the API for each page
+PRICE_PAGE_SIZE = 1000
+
+# the cache data class of the price index, which never expires
+PRICE_INDEX_DATA_CLASS = 'intrinio-price-index'
+
+# per ticker locks used to serialize updates to the price index
+price_index_locks = {}
+price_index_locks_lock = threading.Lock()
+
+# coalesces concurrent API calls for the same cache key
+single_flight = SingleFlight()
+
+
+def __classify_api_error__(e : Exception):
+    """
+      Helper function that determines whether an Intrinio API error
+      can be retried. See RateLimiter for details.
+    """
+    if not isinstance(e, ApiException) or not isinstance(e.status, int):
+        return None
+    if e.status == 429:
+        return RateLimiter.THROTTLED
+    if e.status >= 500:
+        return RateLimiter.TRANSIENT
+    return None
+
+
+def __load_settings__():
+    """
+      Helper function that reads the settings of this module from the environment
+      when they are first used, so that importing this module has no side effects:
+
+      requests_per_second (INTRINIO_REQUESTS_PER_SECOND)
+        the request budget shared by all the calls made to the Intrinio APIs
+      no_data_cache_ttl_seconds (INTRINIO_NO_DATA_CACHE_TTL_SECONDS)
+        time to live of the cache entries recording that the API has no data for
+        a statement or metric, after which the API is called again
+      recent_prices_ttl_seconds (INTRINIO_RECENT_PRICES_TTL_SECONDS)
+        number of seconds during which the prices of the current day (which are not
+        part of the price index, since they may not be published yet) are not fetched again
+
+      Raises
+      -------
+      ValidationError in case a setting is not a valid number
+    """
+    try:
+        return SimpleNamespace(
+            requests_per_second=float(os.environ.get('INTRINIO_REQUESTS_PER_SECOND', 10)),
+            no_data_cache_ttl_seconds=int(os.environ.get('INTRINIO_NO_DATA_CACHE_TTL_SECONDS', 24 * 60 * 60)),
+            recent_prices_ttl_seconds=int(os.environ.get('INTRINIO_RECENT_PRICES_TTL_SECONDS', 60 * 60))
+        )
+    except ValueError as e:
+        raise ValidationError("Invalid Intrinio settings", e)
+
+
+settings = LazyObject(__load_settings__)
+
+# all the calls made to the Intrinio APIs share the same request budget
+rate_limiter = LazyObject(lambda: RateLimiter(settings.requests_per_second, __classify_api_error__))
+
+no_data_stats_lock = threading.Lock()
+no_data_stats = {
+    'no_data_cache_hits': 0
+}
+
+
+# the API statuses meaning that there is no data for a request. Other errors
+# (e.g. 401 Unauthorized because of an invalid API key) are never cached
+NO_DATA_API_STATUSES = [404]
+
+
+class NoData():
+    """
+      A negative cache entry, recording that the API returned no data
+      (or a 'Not Found' error) for a cache key.
+
+      Attributes:
+        cause : str
+          The error returned by the API, or None if the API returned no data
+    """
+    def __init__(self, cause : str):
+        self.cause = cause
+
+
+def __write_no_data__(cache_keys : list, error : Exception):
+    """
+      Helper function that caches a NoData entry for each of the supplied keys, when
+      the API returned no data (error is None) or a 'Not Found' error. Other errors,
+      like throttling or authorization errors, may not happen again and are not cached.
+    """
+    if error != None and getattr(error, 'status', None) not in NO_DATA_API_STATUSES:
+        return
+
+    no_data = NoData(str(error) if error != None else None)
+    cache.write_many({cache_key: no_data for cache_key in cache_keys}, expire=settings.no_data_cache_ttl_seconds)
+
+
+def __count_no_data_hit__():
+    """
+      Helper function that counts an API call skipped because of a NoData entry
+    """
+    with no_data_stats_lock:
+        no_data_stats['no_data_cache_hits'] += 1
+
+
+def __call_api__(fn : object, *args, **kwargs):
+    """
+      Helper function that calls an Intrinio API method through the rate limiter
+      and records its latency, including retries, in the 'api_call.<method name>' histogram
+    """
+    with instrumentation.timer("api_call.%s" % getattr(fn, '__name__', 'unknown')):
+        return rate_limiter.call(fn, *args, **kwargs)
+
+
+def get_api_stats():
+    """
+      Returns the counters of the calls made to the Intrinio APIs, as a dictionary
+      of 'requests', 'throttles', 'retries' and 'rate_limited_waits', as well as the
+      calls that were skipped because the API is known to have no data ('no_data_cache_hits')
+    """
+    stats = rate_limiter.get_stats()
+
+    with no_data_stats_lock:
+        stats.update(no_data_stats)
+
+    return stats
+
+
+def __fetch_once__(cache_key : str, fetch_fn : object):
+    """
+      Helper function that reads a value from the cache, or fetches it from
+      the API using the supplied function and writes it to the cache.
+
+      Concurrent callers that miss the cache on the same key are coalesced,
+      so that only one of them calls the API, while the others wait for its
+      result, or its exception.
+
+      Parameters
+      ----------
+      cache_key : str
+        The cache key of the value
+      fetch_fn : object
+        A function, taking no parameters, that fetches the value from the API
+
+      Returns
+      -------
+      The cached or fetched value
+    """
+
+    def fetch():
+        # check the cache again, since another caller may have
+        # just completed the same call
+        value = cache.read(cache_key)
+
+        if value == None:
+            value = fetch_fn()
+            cache.write(cache_key, value)
+
+        return value
+
+    return single_flight.do(cache_key, fetch)
+
 
 def get_daily_stock_close_prices(ticker : str, start_date : object, end_date : object):
       """
         Returns a list of historical daily stock prices given a ticker symbol and
         a range of dates.
 
-        Currently only returns one page of 100 results
+        Prices are cached one trading day at a time, along with an index of the
+        dates that were already fetched for the ticker, so that the API is only
+        called for the dates that are not already cached. All the pages returned
+        by the API are read.
+
+        The prices of the current day may not be published yet, so they are not
+        part of the index, and are fetched again once recent_prices_ttl_seconds
+        (see __load_settings__) have passed since they were last fetched.
 
         Parameters
         ----------
@@ -61,32 +298,185 @@ def get_daily_stock_close_prices(ticker : str, start_date : object, end_date : o
       start_date_str = intrinio_util.date_to_string(start_date)
       end_date_str = intrinio_util.date_to_string(end_date)
 
+      def fetch_prices(fetch_start_date : str, fetch_end_date : str):
+        fetched_prices = {}
+        next_page = ''
+
+        while True:
+          api_response = __call_api__(security_api.get_security_stock_prices,
+              ticker, start_date=fetch_start_date, end_date=fetch_end_date, frequency='daily',
+              page_size=PRICE_PAGE_SIZE, next_page=next_page)
+
+          for price in api_response.stock_prices:
+            fetched_prices[intrinio_util.date_to_string(price.date)] = price.close
+
+          next_page = api_response.next_page
+          if not next_page:
+            return fetched_prices
+
       price_dict = {}
 
-      cache_key = "%s-%s-%s-%s-%s" % (INTRINIO_CACHE_PREFIX, ticker, start_date_str, end_date_str, "closing-prices")
-      api_response = cache.read(cache_key)
+      try:
+        # index updates for the same ticker are serialized, which also
+        # prevents concurrent callers from fetching the same prices
+        with __price_index_lock__(ticker):
+          (price_index, fetch_ranges, price_dict) = __plan_price_fetch__(ticker, start_date_str, end_date_str)
 
-      if api_response == None:
-        try:
-          api_response = security_api.get_security_stock_prices(ticker, start_date=start_date_str, end_date=end_date_str, frequency='daily', page_size=100)
-          cache.write(cache_key, api_response)
-        except ApiException as ae:
-          raise DataError("API Error while reading price data from Intrinio Security API: ('%s', %s - %s)" %
-                          (ticker, start_date_str, end_date_str), ae)
-        except Exception as e:
-          raise ValidationError("Unknown Error while reading price data from Intrinio Security API: ('%s', %s - %s)" %
-                          (ticker, start_date_str, end_date_str), e)
+          if len(fetch_ranges) > 0:
+            index_dates = set(price_index['dates']) if price_index != None else set()
+
+            for (fetch_start_date, fetch_end_date) in fetch_ranges:
+              fetched_prices = fetch_prices(fetch_start_date, fetch_end_date)
+
+              cache.write_many({__price_cache_key__(ticker, date): price for (date, price) in fetched_prices.items()})
+
+              for (date, price) in fetched_prices.items():
+                index_dates.add(date)
+
+                if start_date_str <= date <= end_date_str:
+                  price_dict[date] = price
+
+            # prices for the current day may not be published yet,
+            # so the index only covers dates up to yesterday
+            yesterday_str = intrinio_util.date_to_string(datetime.date.today() - datetime.timedelta(days=1))
+            covered_end_date = min(end_date_str, yesterday_str)
 
-      price_list = api_response.stock_prices
+            cache.write(__price_index_cache_key__(ticker), {
+              'start_date': min(start_date_str, price_index['start_date']) if price_index != None else start_date_str,
+              'end_date': max(covered_end_date, price_index['end_date']) if price_index != None else covered_end_date,
+              'dates': sorted(index_dates)
+            }, data_class=PRICE_INDEX_DATA_CLASS)
 
-      if len(price_list) == 0:
+            # the more recent dates were fetched too, and are not fetched
+            # again for settings.recent_prices_ttl_seconds
+            if end_date_str > yesterday_str:
+              recent_prices = cache.read(__price_recent_cache_key__(ticker))
+              recent_end_date = max(end_date_str, recent_prices['end_date']) if recent_prices != None else end_date_str
+
+              cache.write(__price_recent_cache_key__(ticker), {'end_date': recent_end_date},
+                          expire=settings.recent_prices_ttl_seconds)
+
+      except ApiException as ae:
+        raise DataError("API Error while reading price data from Intrinio Security API: ('%s', %s - %s)" %
+                        (ticker, start_date_str, end_date_str), ae)
+      except Exception as e:
+        raise ValidationError("Unknown Error while reading price data from Intrinio Security API: ('%s', %s - %s)" %
+                        (ticker, start_date_str, end_date_str), e)
+
+      if len(price_dict) == 0:
         raise DataError("No prices returned from Intrinio Security API: ('%s', %s - %s)" %
                     (ticker, start_date_str, end_date_str), None)
 
-      for price in price_list:  
-        price_dict[intrinio_util.date_to_string(price.date)] = price.close
+      return dict(sorted(price_dict.items()))
+
+
+def __plan_price_fetch__(ticker : str, start_date_str : str, end_date_str : str):
+    """
+      Helper function that determines which prices of a range of dates must be
+      fetched from the API, and reads those that are cached.
+
+      Dates that are covered by the price index are cached, as well as those
+      after it that were fetched less than settings.recent_prices_ttl_seconds ago.
+      Prices of covered dates that are missing from the cache (e.g. because
+      they were evicted or expired) are fetched again.
+
+      Returns
+      -------
+      A tuple of (price index, list of (start date, end date) ranges to fetch,
+      dictionary of date->price of the cached prices)
+    """
+    price_index = cache.read(__price_index_cache_key__(ticker))
+
+    fetch_ranges = []
+    cached_dates = []
+
+    if price_index == None:
+      fetch_ranges.append((start_date_str, end_date_str))
+    else:
+      covered_end_date = price_index['end_date']
+
+      recent_prices = cache.read(__price_recent_cache_key__(ticker))
+      if recent_prices != None:
+        covered_end_date = max(covered_end_date, recent_prices['end_date'])
+
+      # only fetch the dates outside of the range that was already fetched
+      if start_date_str < price_index['start_date']:
+        fetch_ranges.append((start_date_str, __add_days__(price_index['start_date'], -1)))
+      if end_date_str > covered_end_date:
+        fetch_ranges.append((__add_days__(covered_end_date, 1), end_date_str))
+
+      cached_dates = [date for date in price_index['dates'] if start_date_str <= date <= end_date_str]
+
+    # read the cached prices. Those that are missing, for example because
+    # they were evicted, are fetched again
+    missing_dates = []
+    cached_prices = cache.read_many([__price_cache_key__(ticker, date) for date in cached_dates])
+    price_dict = {}
+
+    for date in cached_dates:
+      price = cached_prices[__price_cache_key__(ticker, date)]
+
+      if price == None:
+        missing_dates.append(date)
+      else:
+        price_dict[date] = price
+
+    if len(missing_dates) > 0:
+      fetch_ranges.append((missing_dates[0], missing_dates[-1]))
 
-      return price_dict
+    return (price_index, fetch_ranges, price_dict)
+
+
+def __price_cache_key__(ticker : str, date : str):
+    """
+      Returns the cache key of the closing price of a single trading day, e.g.
+
+      intrinio-price-v1-AAPL-2019-10-01
+    """
+    return "%s-%s-%s-%s-%s" % (INTRINIO_CACHE_PREFIX, "price", PRICE_CACHE_VERSION, ticker.upper(), date)
+
+
+def __price_index_cache_key__(ticker : str):
+    """
+      Returns the cache key of the index of cached prices for a ticker, e.g.
+
+      intrinio-price-v1-AAPL-index
+
+      The index is a dictionary containing the range of dates that were fetched
+      ('start_date' and 'end_date') and the list of trading days within it ('dates')
+    """
+    return "%s-%s-%s-%s-%s" % (INTRINIO_CACHE_PREFIX, "price", PRICE_CACHE_VERSION, ticker.upper(), "index")
+
+
+def __price_recent_cache_key__(ticker : str):
+    """
+      Returns the cache key recording the most recent date fetched after the
+      end of the price index of a ticker (e.g. the current day), which is not
+      fetched again until the entry expires, e.g.
+
+      intrinio-price-v1-AAPL-recent
+    """
+    return "%s-%s-%s-%s-%s" % (INTRINIO_CACHE_PREFIX, "price", PRICE_CACHE_VERSION, ticker.upper(), "recent")
+
+
+def __price_index_lock__(ticker : str):
+    """
+      Returns the lock used to serialize updates to the price index of a ticker
+    """
+    ticker = ticker.upper()
+
+    with price_index_locks_lock:
+      if ticker not in price_index_locks:
+        price_index_locks[ticker] = threading.Lock()
+      return price_index_locks[ticker]
+
+
+def __add_days__(date_str : str, days : int):
+    """
+      Adds a number of days to a date formatted as YYYY-MM-DD
+    """
+    date = datetime.datetime.strptime(date_str, "%Y-%m-%d") + datetime.timedelta(days=days)
+    return intrinio_util.date_to_string(date)
 
 
 def get_historical_revenue(ticker: str, year_from: int, year_to: int):
@@ -368,6 +758,9 @@ def __transform_financial_stmt__(std_financials_list: list, tag_filter_list: lis
     """
     results = {}
 
+    if tag_filter_list != None:
+        tag_filter_list = set(tag_filter_list)
+
     for financial in std_financials_list:
 
         if (tag_filter_list == None or
@@ -377,6 +770,30 @@ def __transform_financial_stmt__(std_financials_list: list, tag_filter_list: lis
     return results
 
 
+def __filter_financial_stmt__(statement : dict, tag_filter_list : list):
+    """
+      Helper function that filters a normalized financial statement, as returned
+      by __transform_financial_stmt__, down to the supplied tags.
+
+      Parameters
+      ----------
+      statement : dict
+        A dictionary of tag=>value
+      tag_filter_list : object
+        List or set of data tags used to filter results. If "None", then all
+        tags will be returned.
+
+      Returns
+      -------
+      A new dictionary of tag=>value with the filtered results
+    """
+    if tag_filter_list == None:
+        return dict(statement)
+
+    # look up each of the requested tags, rather than scanning the whole statement
+    return {tag: statement[tag] for tag in tag_filter_list if tag in statement}
+
+
 def __read_historical_financial_statement__(ticker: str, statement_name: str, year_from: int, year_to: int, tag_filter_list: list):
     """
       This helper function will read standardized fiscal year end financials from the Intrinio fundamentals API
@@ -391,6 +808,9 @@ def __read_historical_financial_statement__(ticker: str, statement_name: str, ye
       results may also be filtered based on the tag_filter_list parameter, which may include
       just the tags that should be returned.
 
+      Years that are not already cached are fetched concurrently, using up to
+      STATEMENT_FETCH_WORKERS threads.
+
       Parameters
       ----------
       ticker : str
@@ -428,35 +848,154 @@ def __read_historical_financial_statement__(ticker: str, statement_name: str, ye
 
     statement_type = 'FY'
 
-    try:
-      for i in range(year_from, year_to + 1):
-          satement_name = ticker + "-" + \
-              statement_name + "-" + str(i) + "-" + statement_type
+    def fetch_statement(year : int):
+        def fetch():
+            # statements cached by older versions are migrated
+            # instead of being fetched again
+            legacy_key = __legacy_statement_cache_key__(ticker, statement_name, statement_type, year)
+            statement = cache.read(legacy_key)
+
+            if statement == None:
+                satement_name = ticker + "-" + \
+                    statement_name + "-" + str(year) + "-" + statement_type
+
+                try:
+                    statement = __call_api__(fundamentals_api.get_fundamental_standardized_financials,
+                        satement_name)
+                except ApiException as ae:
+                    __write_no_data__([cache_keys[year]], ae)
+                    raise
+            else:
+                cache.delete(legacy_key)
+
+            return __transform_financial_stmt__(statement.standardized_financials, None)
+
+        return __fetch_once__(cache_keys[year], fetch)
 
-          cache_key = "%s-%s-%s-%s-%s-%d" % (INTRINIO_CACHE_PREFIX, "statement", ticker, statement_name, statement_type, i)
-          statement = cache.read(cache_key)
+    # read everything that is already available from the cache
+    # and keep track of the years that must be fetched from the API
+    cache_keys = {i: __statement_cache_key__(ticker, statement_name, statement_type, i)
+                  for i in range(year_from, year_to + 1)}
+    cached_statements = cache.read_many(list(cache_keys.values()))
 
-          if statement == None:
-            statement = fundamentals_api.get_fundamental_standardized_financials(
-                satement_name)
+    statements = {}
+    missing_years = []
 
-            cache.write(cache_key, statement)
+    for i in range(year_from, year_to + 1):
+        statement = cached_statements[cache_keys[i]]
 
-          hist_statements[i] = __transform_financial_stmt__(
-              statement.standardized_financials, tag_filter_list)
+        if statement == None:
+            missing_years.append(i)
+        else:
+            statements[i] = statement
+
+    def raise_no_data(no_data : NoData):
+        raise DataError(
+            "Error retrieving ('%s', %d - %d) -> '%s' from Intrinio Fundamentals API" % (ticker, year_from, year_to, statement_name), no_data.cause)
+
+    # do not fetch anything when a year is known to be missing
+    for statement in statements.values():
+        if isinstance(statement, NoData):
+            __count_no_data_hit__()
+            raise_no_data(statement)
+
+    try:
+      if len(missing_years) == 1 or STATEMENT_FETCH_WORKERS <= 1:
+          for i in missing_years:
+              statements[i] = fetch_statement(i)
+      elif len(missing_years) > 1:
+          with ThreadPoolExecutor(max_workers=min(STATEMENT_FETCH_WORKERS, len(missing_years))) as executor:
+              futures = {i: executor.submit(fetch_statement, i) for i in missing_years}
+              for i, future in futures.items():
+                  statements[i] = future.result()
 
     except ApiException as ae:
         raise DataError(
             "Error retrieving ('%s', %d - %d) -> '%s' from Intrinio Fundamentals API" % (ticker, year_from, year_to, statement_name), ae)
 
+    if tag_filter_list != None:
+        tag_filter_list = set(tag_filter_list)
+
+    for i in range(year_from, year_to + 1):
+        # concurrent callers may have cached a missing statement
+        if isinstance(statements[i], NoData):
+            raise_no_data(statements[i])
+
+        hist_statements[i] = __filter_financial_stmt__(statements[i], tag_filter_list)
+
     return hist_statements
 
 
+def __statement_cache_key__(ticker : str, statement_name : str, statement_type : str, year : int):
+    """
+      Returns the cache key of a normalized financial statement, e.g.
+
+      intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018
+    """
+    return "%s-%s-%s-%s-%s-%s-%d" % (INTRINIO_CACHE_PREFIX, "statement", STATEMENT_CACHE_VERSION,
+                                     ticker.upper(), statement_name, statement_type, year)
+
+
+def __legacy_statement_cache_key__(ticker : str, statement_name : str, statement_type : str, year : int):
+    """
+      Returns the cache key used by older versions, which cached
+      the complete Intrinio API response, e.g.
+
+      intrinio-statement-AAPL-cash_flow_statement-FY-2018
+    """
+    return "%s-%s-%s-%s-%s-%d" % (INTRINIO_CACHE_PREFIX, "statement", ticker, statement_name, statement_type, year)
+
+
+def migrate_statement_cache():
+    """
+      Converts all the financial statements cached by older versions, which
+      contain the complete Intrinio API response, into normalized statements
+      stored under the current cache key scheme, and removes the original entries.
+
+      Statements are also migrated one by one the first time they are read, so
+      calling this function is not required, but will compact the cache in one pass.
+
+      Parameters
+      ----------
+      None
+
+      Returns
+      -------
+      The number of migrated statements
+    """
+    legacy_prefix = "%s-%s-" % (INTRINIO_CACHE_PREFIX, "statement")
+    current_prefix = "%s%s-" % (legacy_prefix, STATEMENT_CACHE_VERSION)
+
+    legacy_keys = [key for key in cache.iterkeys()
+                   if key.startswith(legacy_prefix) and not key.startswith(current_prefix)]
+
+    migrated = 0
+    for legacy_key in legacy_keys:
+        statement = cache.read(legacy_key)
+
+        if statement == None:
+            continue
+
+        (ticker, statement_name, statement_type, year) = legacy_key[len(legacy_prefix):].rsplit('-', 3)
+
+        cache.write(__statement_cache_key__(ticker, statement_name, statement_type, int(year)),
+                    __transform_financial_stmt__(statement.standardized_financials, None))
+        cache.delete(legacy_key)
+        migrated += 1
+
+    log.info("Migrated %d cached financial statements" % migrated)
+
+    return migrated
+
+
 def __read_financial_metrics__(ticker: str, start_year: int, end_year: int, tag: str):
     """
       Helper function that will read the Intrinio company API for the supplied date range
       and convert the resulting list into a more friendly dictionary.
 
+      Datapoints are cached one year at a time, so that the API is only called
+      for the years that are missing from the cache.
+
       Specifically a result like this
 
       [
@@ -499,21 +1038,62 @@ def __read_financial_metrics__(ticker: str, start_year: int, end_year: int, tag:
         2014: 456,
       }
     """
-    (start_date, x) = intrinio_util.get_fiscal_year_period(start_year, 0)
-    (x, end_date) = intrinio_util.get_fiscal_year_period(end_year, 0)
+    # validate the range
+    intrinio_util.get_fiscal_year_period(start_year, 0)
+    intrinio_util.get_fiscal_year_period(end_year, 0)
 
     frequency = 'yearly'
 
-    # check the cache first
-    cache_key = "%s-%s-%s-%d-%d-%s-%s" % (INTRINIO_CACHE_PREFIX, "metric", ticker, start_year, end_year, frequency, tag)
-    api_response = cache.read(cache_key)
+    def fetch_metrics(fetch_start_year : int, fetch_end_year : int):
+        (start_date, x) = intrinio_util.get_fiscal_year_period(fetch_start_year, 0)
+        (x, end_date) = intrinio_util.get_fiscal_year_period(fetch_end_year, 0)
+
+        try:
+            api_response = __call_api__(company_api.get_company_historical_data,
+                ticker, tag, frequency=frequency, start_date=start_date, end_date=end_date)
+        except ApiException as ae:
+            __write_no_data__([__metric_cache_key__(ticker, frequency, tag, year) for year in missing_years], ae)
+            raise
+
+        fetched_data = {}
+        for datapoint in api_response.historical_data:
+            fetched_data[datapoint.date.year] = datapoint.value
+
+        cache.write_many({__metric_cache_key__(ticker, frequency, tag, year): value
+                          for (year, value) in fetched_data.items()})
+
+        # remember the years for which there is no data
+        __write_no_data__([__metric_cache_key__(ticker, frequency, tag, year)
+                           for year in missing_years if year not in fetched_data], None)
+
+        return fetched_data
+
+    # check the cache first. Each year is cached separately
+    converted_response = {}
+    missing_years = []
+    no_data = None
+
+    cached_values = cache.read_many([__metric_cache_key__(ticker, frequency, tag, year)
+                                     for year in range(start_year, end_year + 1)])
+
+    for year in range(start_year, end_year + 1):
+        value = cached_values[__metric_cache_key__(ticker, frequency, tag, year)]
+
+        if value == None:
+            missing_years.append(year)
+        elif isinstance(value, NoData):
+            __count_no_data_hit__()
+            no_data = value
+        else:
+            converted_response[year] = value
+
+    if len(missing_years) > 0:
+      # else call the API directly, but only for the missing range
+      (fetch_start_year, fetch_end_year) = (missing_years[0], missing_years[-1])
+      fetch_key = "%s-%d-%d" % (__metric_cache_key__(ticker, frequency, tag, fetch_start_year), fetch_start_year, fetch_end_year)
 
-    if api_response == None:
-      # else call the API directly
       try:
-          api_response = company_api.get_company_historical_data(
-              ticker, tag, frequency=frequency, start_date=start_date, end_date=end_date)
-          cache.write(cache_key, api_response)
+          fetched_data = single_flight.do(fetch_key, lambda: fetch_metrics(fetch_start_year, fetch_end_year))
       except ApiException as ae:
           raise DataError(
               "Error retrieving ('%s', %d - %d) -> '%s' from Intrinio Company API" % (ticker, start_year, end_year, tag), ae)
@@ -521,17 +1101,29 @@ def __read_financial_metrics__(ticker: str, start_year: int, end_year: int, tag:
           raise ValidationError(
               "Error parsing ('%s', %d - %d) -> '%s' from Intrinio Company API" % (ticker, start_year, end_year, tag), e)
 
-    if len(api_response.historical_data) == 0:
+      for year in missing_years:
+          if year in fetched_data:
+              converted_response[year] = fetched_data[year]
+
+    if len(converted_response) == 0:
+        if no_data != None and no_data.cause != None:
+            raise DataError(
+                "Error retrieving ('%s', %d - %d) -> '%s' from Intrinio Company API" % (ticker, start_year, end_year, tag), no_data.cause)
+
         raise DataError("No Data returned for ('%s', %d - %d) -> '%s' from Intrinio Company API" %
                         (ticker, start_year, end_year, tag), None)
 
-    historical_data = api_response.historical_data
-    converted_response = {}
+    return dict(sorted(converted_response.items()))
 
-    for datapoint in historical_data:
-        converted_response[datapoint.date.year] = datapoint.value
 
-    return converted_response
+def __metric_cache_key__(ticker : str, frequency : str, tag : str, year : int):
+    """
+      Returns the cache key of a single financial metric datapoint, e.g.
+
+      intrinio-metric-v2-AAPL-yearly-totalrevenue-2018
+    """
+    return "%s-%s-%s-%s-%s-%s-%d" % (INTRINIO_CACHE_PREFIX, "metric", METRIC_CACHE_VERSION,
+                                     ticker.upper(), frequency, tag, year)
 
 
 def __read_financial_metric__(ticker: str, year: int, tag: str):
@@ -541,3 +1133,52 @@ def __read_financial_metric__(ticker: str, year: int, tag: str):
     metrics = __read_financial_metrics__(ticker, year, year, tag)
     return metrics[year]
 
+
+def __refresh_metric__(cache_key : str, value : object):
+    """
+      Cache refresh handler that fetches the current value of a
+      single financial metric datapoint. Missing data is not refreshed.
+    """
+    if isinstance(value, NoData):
+        return None
+
+    (ticker, frequency, tag, year) = cache_key.split('-', 3)[3].rsplit('-', 3)
+    (start_date, end_date) = intrinio_util.get_fiscal_year_period(int(year), 0)
+
+    api_response = __call_api__(company_api.get_company_historical_data,
+        ticker, tag, frequency=frequency, start_date=start_date, end_date=end_date)
+
+    for datapoint in api_response.historical_data:
+        if datapoint.date.year == int(year):
+            return datapoint.value
+
+    return None
+
+
+def __refresh_price__(cache_key : str, value : object):
+    """
+      Cache refresh handler that fetches the current closing
+      price of a single trading day
+    """
+    (ticker, date) = (cache_key.split('-', 3)[3][:-11], cache_key[-10:])
+
+    try:
+        datetime.datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        # not a price, e.g. the price index
+        return None
+
+    api_response = __call_api__(security_api.get_security_stock_prices,
+        ticker, start_date=date, end_date=date, frequency='daily')
+
+    for price in api_response.stock_prices:
+        if intrinio_util.date_to_string(price.date) == date:
+            return price.close
+
+    return None
+
+
+financial_cache.register_default_refresh_handler(
+    "%s-%s-%s-" % (INTRINIO_CACHE_PREFIX, "metric", METRIC_CACHE_VERSION), __refresh_metric__)
+financial_cache.register_default_refresh_handler(
+    "%s-%s-%s-" % (INTRINIO_CACHE_PREFIX, "price", PRICE_CACHE_VERSION), __refresh_price__)
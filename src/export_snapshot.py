@@ -0,0 +1,58 @@
+"""export_snapshot.py
+
+"""
+import argparse
+import logging
+import time
+from exception.exceptions import BaseError
+from data_provider import fundamentals_snapshot
+from support.financial_cache import cache
+
+#
+# Main script
+#
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+
+description = """ Exports the revenue, net income, operating cash flow and capital
+                  expenditures of every cached ticker into a memory mapped snapshot,
+                  used to screen large lists of tickers.
+
+                  Only cached data is exported. See warm_cache.py and bulk_load.py
+                  to fill the cache.
+              """
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("snapshot_directory", help="Directory where the snapshot is written", type=str)
+parser.add_argument("year_from", help="First year to export", type=int)
+parser.add_argument("year_to", help="Last year to export", type=int)
+parser.add_argument("-ticker-file", help="Ticker Symbol file (default: all cached tickers)", type=str)
+
+log = logging.getLogger()
+
+args = parser.parse_args()
+
+try:
+    if args.ticker_file != None:
+        try:
+            with open(args.ticker_file) as f:
+                ticker_list = [ticker for ticker in f.read().splitlines() if ticker.strip() != ""]
+        except Exception as e:
+            logging.error("Could run script, because, %s" % (str(e)))
+            exit(-1)
+    else:
+        ticker_list = fundamentals_snapshot.list_cached_tickers()
+
+    start_time = time.monotonic()
+
+    exported_values = fundamentals_snapshot.export_snapshot(
+        args.snapshot_directory, ticker_list, args.year_from, args.year_to)
+
+    log.info("Exported %d values for %d tickers to %s in %.1fs" %
+             (exported_values, len(ticker_list), args.snapshot_directory, time.monotonic() - start_time))
+except BaseError as be:
+    print("Could not export the snapshot because: %s" % str(be))
+    exit(-1)
+finally:
+    # close the financial cache
+    cache.close()
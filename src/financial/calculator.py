@@ -13,6 +13,7 @@ import statistics
 from datetime import timedelta
 from exception.exceptions import CalculationError, DataError
 import logging
+import numpy as np
 from support import util
 
 log = logging.getLogger()
@@ -78,6 +79,84 @@ def calc_enterprise_value(fcfe_forecast : dict, long_term_growth_rate : float, d
     return (enterprise_value, intermediate_results)
 
 
+def calc_enterprise_values(fcfe_forecasts : object, long_term_growth_rates : object, discount_rates : object):
+    """
+        Calculates the enterprise values of several securities at once. This is the
+        vectorized version of calc_enterprise_value, and returns the same results
+        within floating point rounding (numpy's power function may differ from python's
+        in the last bit).
+
+        Parameters
+        ----------
+        fcfe_forecasts : object
+            A 2-D array (or nested list) of cash flow forecasts, with one row per security
+            and one column per year, where the first column is the first forecast year
+        long_term_growth_rates : object
+            The long term growth rate of each security, as an array, or a float
+            shared by all securities
+        discount_rates : object
+            The discount rate of each security, as an array, or a float
+            shared by all securities
+
+        Raises
+        -------
+        CalculationError
+            In case the supplied parameters are invalid for any of the securities
+
+        Returns
+        -------
+        A tuple containing an array of enterprise values and dictionary of intermediate
+        results, with the same keys as calc_enterprise_value:
+
+        {
+            'discounted_cashflows': 2-D array (securities x years),
+            'terminal_value': array,
+            'enterprise_value': array
+        }
+    """
+    try:
+        fcfe_forecasts = np.asarray(fcfe_forecasts, dtype=np.float64)
+
+        if fcfe_forecasts.ndim != 2:
+            raise ValueError("forecasts must be a 2-D array")
+
+        (securities, years) = fcfe_forecasts.shape
+
+        long_term_growth_rates = np.broadcast_to(np.asarray(long_term_growth_rates, dtype=np.float64), (securities,))
+        discount_rates = np.broadcast_to(np.asarray(discount_rates, dtype=np.float64), (securities,))
+    except (TypeError, ValueError) as e:
+        raise CalculationError("Could not perform discounted cash flow because the supplied parameters are invalid", e)
+
+    if (securities == 0 or years == 0 or np.any(~(long_term_growth_rates > 0)) or np.any(~(discount_rates > 0))):
+        raise CalculationError("Could not perform discounted cash flow because the supplied parameters are invalid", None)
+
+    invalid_securities = np.flatnonzero(long_term_growth_rates >= discount_rates)
+    if len(invalid_securities) > 0:
+        raise CalculationError("Could not perform discounted cash flow because long test growth rate exceeds discount rate (securities: %s)" %
+                               str(list(invalid_securities)), None)
+
+    # (1 + discount_rate) ** 1, 2, ..., years for each security
+    discount_factors = (1 + discount_rates[:, np.newaxis]) ** np.arange(1, years + 1, dtype=np.float64)
+
+    discounted_cashflows = fcfe_forecasts / discount_factors
+
+    terminal_values = discounted_cashflows[:, -1] / (discount_rates - long_term_growth_rates)
+
+    # the discounted cash flows are added up one year at a time, in the same
+    # order as calc_enterprise_value, rather than using pairwise summation
+    enterprise_values = np.zeros(securities, dtype=np.float64)
+    for year in range(0, years):
+        enterprise_values += discounted_cashflows[:, year]
+    enterprise_values += terminal_values
+
+    intermediate_results = {
+        'discounted_cashflows': discounted_cashflows,
+        'terminal_value': terminal_values,
+        'enterprise_value': enterprise_values
+    }
+
+    return (enterprise_values, intermediate_results)
+
 
 def calc_graham_number(ticker : str, year : int):
     """
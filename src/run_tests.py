@@ -2,10 +2,19 @@ import unittest
 import logging
 from test.test_dataprovider_intrinio_util import TestDataProviderIntrinioUtil
 from test.test_exceptions import TestExceptions
-from test.test_dataprovider_intrinio_data import TestDataProviderIntrinioData
+from test.test_dataprovider_intrinio_data import TestDataProviderIntrinioData, TestDataProviderIntrinioDataCache
+from test.test_dataprovider_intrinio_bulk_loader import TestDataProviderIntrinioBulkLoader
+from test.test_dataprovider_intrinio_cache_warmer import TestDataProviderIntrinioCacheWarmer
+from test.test_dataprovider_fundamentals_snapshot import TestFundamentalsSnapshot
 from test.test_financial_calcularor import TestFinancialCalculator
 from test.test_valuation_models_jimmy_model import TestJimmyModel
+from test.test_valuation_models_valuation_result import TestValuationResult
 from test.test_support_financial_cache import TestFinancialCache
+from test.test_support_cache_codec import TestCacheCodec
+from test.test_support_lazy_object import TestLazyObject
+from test.test_support_single_flight import TestSingleFlight
+from test.test_support_rate_limiter import TestRateLimiter
+from test.test_support_instrumentation import TestInstrumentation
 from test.test_reporting_workbook_report import TestWorkbookReport
 from test.test_reporting_jimmy_report_worksheet import TestJimmyReportWorksheet
 
@@ -0,0 +1,258 @@
+"""Author: Mark Hanegraaff -- 2019
+
+This module encodes the values stored in the financial cache into a compact,
+versioned binary format.
+
+Every encoded value starts with a header:
+
+  magic (2 bytes) | format version (1 byte) | compression (1 byte) | value type (1 byte)
+
+followed by the (optionally compressed) payload. The most common values
+use a schema based encoding:
+
+  TYPE_FLOAT : a single float, e.g. a metric datapoint or a closing price
+  TYPE_FLOAT_DICT : a dictionary of str=>float, e.g. a normalized financial statement
+  TYPE_PRICE_INDEX : the index of the cached prices of a ticker
+
+while anything else is pickled. Values that were cached before this format
+was introduced are not bytes starting with the magic number, and are
+returned unchanged by decode().
+"""
+import datetime
+import pickle
+import struct
+import zlib
+import logging
+from exception.exceptions import ValidationError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger()
+
+MAGIC = b'\xfcF'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<2sBBB')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+TYPE_PICKLE = 0
+TYPE_FLOAT = 1
+TYPE_FLOAT_DICT = 2
+TYPE_PRICE_INDEX = 3
+
+# payloads smaller than this are not worth compressing
+MIN_COMPRESSION_SIZE = 128
+
+PRICE_INDEX_KEYS = {'start_date', 'end_date', 'dates'}
+
+
+class CacheCodec():
+    """
+        Encodes and decodes cache values.
+
+        Attributes:
+            compression : str
+                'zstd', 'zlib' or 'none'. zstd requires the zstandard package
+            level : int
+                The compression level
+    """
+
+    def __init__(self, compression : str = 'zlib', level : int = None):
+        '''
+            Initializes the codec
+
+            Raises
+            ------
+            ValidationError : in case an unknown or unavailable compression is supplied
+        '''
+        if compression == 'zstd' and zstandard is None:
+            raise ValidationError("zstd compression requires the zstandard package", None)
+
+        if compression == 'zstd':
+            self.compression_id = COMPRESSION_ZSTD
+            self.level = level if level is not None else 3
+            self.compressor = zstandard.ZstdCompressor(level=self.level)
+        elif compression == 'zlib':
+            self.compression_id = COMPRESSION_ZLIB
+            self.level = level if level is not None else 6
+        elif compression == 'none':
+            self.compression_id = COMPRESSION_NONE
+            self.level = None
+        else:
+            raise ValidationError("Invalid cache compression: %s" % compression, None)
+
+        self.compression = compression
+
+    def encode(self, value : object):
+        """
+            Encodes a value into bytes
+        """
+        (value_type, payload) = __encode_payload__(value)
+
+        compression_id = COMPRESSION_NONE
+
+        if self.compression_id != COMPRESSION_NONE and len(payload) >= MIN_COMPRESSION_SIZE:
+            if self.compression_id == COMPRESSION_ZSTD:
+                compressed = self.compressor.compress(payload)
+            else:
+                compressed = zlib.compress(payload, self.level)
+
+            if len(compressed) < len(payload):
+                (compression_id, payload) = (self.compression_id, compressed)
+
+        return HEADER.pack(MAGIC, FORMAT_VERSION, compression_id, value_type) + payload
+
+
+def is_encoded(value : object):
+    """
+        Returns True if the supplied value was produced by a codec
+    """
+    return isinstance(value, bytes) and len(value) >= HEADER.size and value[0:2] == MAGIC
+
+
+def decode(value : object):
+    """
+        Decodes a value produced by any codec. Values that are not
+        encoded (e.g. cached by older versions) are returned as is.
+
+        Raises
+        ------
+        ValidationError : in case the value was encoded using an unsupported
+        format version or compression
+    """
+    if not is_encoded(value):
+        return value
+
+    (_, version, compression_id, value_type) = HEADER.unpack_from(value)
+
+    if version != FORMAT_VERSION:
+        raise ValidationError("Unsupported cache format version: %d" % version, None)
+
+    payload = value[HEADER.size:]
+
+    if compression_id == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression_id == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValidationError("zstd compressed values require the zstandard package", None)
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif compression_id != COMPRESSION_NONE:
+        raise ValidationError("Unsupported cache compression: %d" % compression_id, None)
+
+    return __decode_payload__(value_type, payload)
+
+
+def __encode_payload__(value : object):
+    """
+        Helper function that selects the encoding of a value, and returns
+        a (value type, payload) tuple
+    """
+    if type(value) is float:
+        return (TYPE_FLOAT, struct.pack('<d', value))
+
+    if type(value) is dict and len(value) > 0:
+        if all(type(k) is str for k in value.keys()) and all(type(v) is float for v in value.values()):
+            return (TYPE_FLOAT_DICT, __encode_float_dict__(value))
+
+        if value.keys() == PRICE_INDEX_KEYS:
+            try:
+                return (TYPE_PRICE_INDEX, __encode_price_index__(value))
+            except (TypeError, ValueError):
+                # not a well formed price index
+                pass
+
+    return (TYPE_PICKLE, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def __decode_payload__(value_type : int, payload : bytes):
+    """
+        Helper function that decodes a payload of the supplied type
+    """
+    if value_type == TYPE_FLOAT:
+        return struct.unpack('<d', payload)[0]
+    if value_type == TYPE_FLOAT_DICT:
+        return __decode_float_dict__(payload)
+    if value_type == TYPE_PRICE_INDEX:
+        return __decode_price_index__(payload)
+    if value_type == TYPE_PICKLE:
+        return pickle.loads(payload)
+
+    raise ValidationError("Unsupported cache value type: %d" % value_type, None)
+
+
+def __encode_float_dict__(value : dict):
+    """
+        Encodes a dictionary of str=>float as:
+
+        count (uint32) | key lengths (uint16 * count) | keys (utf-8) | values (float64 * count)
+    """
+    keys = [k.encode('utf-8') for k in value.keys()]
+    count = len(keys)
+
+    return b''.join([
+        struct.pack('<I%dH' % count, count, *[len(k) for k in keys]),
+        b''.join(keys),
+        struct.pack('<%dd' % count, *value.values())
+    ])
+
+
+def __decode_float_dict__(payload : bytes):
+    (count,) = struct.unpack_from('<I', payload)
+    offset = 4
+
+    key_lengths = struct.unpack_from('<%dH' % count, payload, offset)
+    offset += 2 * count
+
+    keys = []
+    for key_length in key_lengths:
+        keys.append(payload[offset:offset + key_length].decode('utf-8'))
+        offset += key_length
+
+    return dict(zip(keys, struct.unpack_from('<%dd' % count, payload, offset)))
+
+
+def __encode_price_index__(value : dict):
+    """
+        Encodes a price index, e.g.
+
+        {'start_date': '2019-01-02', 'end_date': '2019-01-03', 'dates': ['2019-01-02', '2019-01-03']}
+
+        as a sequence of proleptic Gregorian ordinals:
+
+        start date (uint32) | end date (uint32) | count (uint32) | dates (uint32 * count)
+    """
+    dates = [__to_ordinal__(d) for d in value['dates']]
+
+    return struct.pack('<III%dI' % len(dates), __to_ordinal__(value['start_date']),
+                       __to_ordinal__(value['end_date']), len(dates), *dates)
+
+
+def __decode_price_index__(payload : bytes):
+    (start_date, end_date, count) = struct.unpack_from('<III', payload)
+    dates = struct.unpack_from('<%dI' % count, payload, 12)
+
+    return {
+        'start_date': __from_ordinal__(start_date),
+        'end_date': __from_ordinal__(end_date),
+        'dates': [__from_ordinal__(d) for d in dates]
+    }
+
+
+def __to_ordinal__(date_str : str):
+    date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+
+    # only encode dates that will decode to the exact same string
+    if date.isoformat() != date_str:
+        raise ValueError("Not a canonical date: %s" % date_str)
+
+    return date.toordinal()
+
+
+def __from_ordinal__(ordinal : int):
+    return datetime.date.fromordinal(ordinal).isoformat()
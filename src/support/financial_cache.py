@@ -1,17 +1,281 @@
 """Author: Mark Hanegraaff -- 2019
 """
 from io import BytesIO
+from collections import OrderedDict
+from contextlib import contextmanager
 from diskcache import Cache
 from support import util
+from support import instrumentation
+from support import cache_codec
+from support.lazy_object import LazyObject
 from exception.exceptions import ValidationError
+from contextlib import ExitStack
+import itertools
+import os
+import pickle
+import threading
+import time
+import zlib
 import logging
 
 log = logging.getLogger()
 
+# the database file of a single file ('disk' backend) cache
+DISK_CACHE_FILE_NAME = 'cache.db'
+
+# default number of seconds after which each class of data expires, where
+# None means never. The data class of a key defaults to its prefix
+# (e.g. 'intrinio-statement'), see instrumentation.key_prefix()
+DEFAULT_EXPIRY_POLICY = {
+    # fiscal year statements are not restated
+    'intrinio-statement': None,
+    # metrics may be restated
+    'intrinio-metric': 30 * 24 * 60 * 60,
+    # closing prices may be adjusted
+    'intrinio-price': 7 * 24 * 60 * 60,
+    # the index of cached price dates. Expired prices are detected
+    # and fetched again, so the index itself never expires
+    'intrinio-price-index': None,
+    # memoized valuation model stages are keyed by a fingerprint of their inputs,
+    # so they are never stale, but those of inputs that changed are never read again
+    'valuation-result': 30 * 24 * 60 * 60
+}
+
+
+# refresh handlers used by every cache, in addition to its own.
+# See FinancialCache.register_refresh_handler
+default_refresh_handlers = {}
+
+
+def register_default_refresh_handler(key_prefix : str, refresh_fn : object):
+    """
+        Registers a refresh handler used by every cache, for example by
+        a data provider that knows how to fetch its own keys.
+        See FinancialCache.register_refresh_handler
+    """
+    default_refresh_handlers[key_prefix] = refresh_fn
+
+
+def parse_expiry_policy(policy_str : str):
+    """
+        Parses an expiry policy formatted as a comma separated list of
+        <data class>=<seconds>, where 'never' can be used instead of
+        a number of seconds, e.g.
+
+        intrinio-price=86400,intrinio-metric=never
+
+        Raises
+        ------
+        ValidationError : in case the policy is malformed
+
+        Returns
+        ------
+        A dictionary of data class=>seconds
+    """
+    policy = {}
+
+    if policy_str is None or policy_str.strip() == "":
+        return policy
+
+    try:
+        for entry in policy_str.split(','):
+            (data_class, expire) = entry.split('=')
+            expire = expire.strip()
+            policy[data_class.strip()] = None if expire == 'never' else float(expire)
+    except Exception as e:
+        raise ValidationError("Invalid cache expiry policy: %s" % policy_str, e)
+
+    return policy
+
+
+def approximate_size(value : object):
+    """
+        Returns the approximate size of a value in bytes, which is the
+        size of its pickled representation, or None if it can't be pickled
+    """
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+
+
+class MemoryCache():
+    """
+        A bounded, thread safe, in memory LRU cache, limited both by the
+        number of entries and by their approximate size in bytes, which is
+        the size of their pickled representation.
+
+        Values are shared with the callers and must be treated as read only.
+    """
+
+    def __init__(self, max_entries : int, max_bytes : int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        # key => (value, size in bytes, expire time)
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+
+    def get(self, key : str):
+        """
+            Returns the value of a key, or None if it's missing or expired
+        """
+        with self.lock:
+            try:
+                (value, size, expire_time) = self.entries[key]
+            except KeyError:
+                return None
+
+            if expire_time is not None and expire_time <= time.time():
+                self.__remove__(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key : str, value : object, expire_time : float, size : int):
+        """
+            Adds a value of the supplied size, evicting the least recently
+            used ones in case the limits are exceeded. Values that
+            can't be sized (size is None) are not added.
+        """
+        with self.lock:
+            self.__remove__(key)
+
+            if size is None or size > self.max_bytes or self.max_entries <= 0:
+                return
+
+            self.entries[key] = (value, size, expire_time)
+            self.size_bytes += size
+
+            while len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                (evicted_key, x) = self.entries.popitem(last=False)
+                self.size_bytes -= x[1]
+
+    def delete(self, key : str):
+        with self.lock:
+            self.__remove__(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_bytes = 0
+
+    def __remove__(self, key : str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+
+
+def ticker_shard_key(key : str):
+    """
+        Returns the part of a cache key used to select its shard. Data provider
+        keys follow the "<source>-<data class>-<version>-<ticker>-..." convention,
+        so that all the data of a ticker is stored in the same shard, e.g.
+
+        intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018 -> AAPL
+
+        Keys that don't follow the convention are sharded by the whole key.
+    """
+    segments = key.split('-')
+    return segments[3] if len(segments) > 4 else key
+
+
+class ShardedDiskCache():
+    """
+        A disk based cache made of several independent diskcache databases
+        (shards), each in its own sub directory, so that writes from several
+        processes don't contend on the same SQLite database.
+
+        Exposes the subset of the diskcache.Cache interface used by FinancialCache.
+    """
+
+    SHARD_DIR_FORMAT = "shard-%03d"
+
+    def __init__(self, path : str, shards : int, size_limit : int, shard_key_fn : object = ticker_shard_key):
+        if shards < 1:
+            raise ValueError("The number of shards must be greater than zero")
+
+        self.shard_key_fn = shard_key_fn
+        self.shards = [Cache(os.path.join(path, self.SHARD_DIR_FORMAT % i), size_limit=int(size_limit / shards))
+                       for i in range(0, shards)]
+
+    @classmethod
+    def count_shards(cls, path : str):
+        """
+            Returns the number of shards found in an existing cache directory
+        """
+        shards = 0
+        while os.path.isdir(os.path.join(path, cls.SHARD_DIR_FORMAT % shards)):
+            shards += 1
+        return shards
+
+    def __shard__(self, key : str):
+        return self.shards[zlib.crc32(self.shard_key_fn(key).encode('utf-8')) % len(self.shards)]
+
+    def get(self, key : str, default=None, expire_time=False):
+        return self.__shard__(key).get(key, default=default, expire_time=expire_time)
+
+    def set(self, key : str, value : object, expire=None):
+        return self.__shard__(key).set(key, value, expire=expire)
+
+    def delete(self, key : str):
+        return self.__shard__(key).delete(key)
+
+    def iterkeys(self):
+        return itertools.chain.from_iterable(shard.iterkeys() for shard in self.shards)
+
+    @contextmanager
+    def transact(self, retry=False, keys=None):
+        '''
+            Opens a transaction on the shards of the supplied keys,
+            or on all the shards if no keys are supplied, so that writes
+            to different shards can proceed concurrently
+        '''
+        if keys is None:
+            shards = self.shards
+        else:
+            shard_ids = {id(self.__shard__(key)) for key in keys}
+            shards = [shard for shard in self.shards if id(shard) in shard_ids]
+
+        # shards are always locked in the same order
+        with ExitStack() as stack:
+            for shard in shards:
+                stack.enter_context(shard.transact(retry=retry))
+            yield
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
 class FinancialCache():
     """
         A Disk based database containing an offline version of financial
         data and used as a cache 
+
+        The underlying diskcache object opens a separate SQLite connection
+        for each thread, so a single instance may be safely shared between
+        threads (and processes using the same path).
+
+        Two disk backends are available:
+
+            disk : a single database (./cache.db)
+            sharded : several databases, keyed by ticker (./shard-000/cache.db, ...)
+                which allows multiple processes to write concurrently
+
+        Values are stored on disk in the compact, compressed format of the
+        cache_codec module. Values cached by older versions (plain pickles)
+        can still be read.
+
+        Objects expire according to the expiry policy of their class of data
+        (see DEFAULT_EXPIRY_POLICY), and those that are frequently used can be
+        renewed before they expire by a background refresher.
+
+        Recently used objects are also kept (decoded) in a bounded in memory LRU tier,
+        so that repeated reads don't need to query and decode them from disk.
+        Writes go to both tiers.
     """
     
     def __init__(self, path, **kwargs):
@@ -26,9 +290,34 @@ class FinancialCache():
             max_cache_size_bytes : int (kwargs)
             (optional) the maximum size of the cache in bytes
 
+            memory_max_entries : int (kwargs)
+            (optional) the maximum number of objects kept in memory.
+            0 disables the memory tier
+
+            memory_max_bytes : int (kwargs)
+            (optional) the maximum approximate size of the objects kept in memory
+
+            backend : str (kwargs)
+            (optional) 'disk' or 'sharded'. By default existing caches are opened
+            with the backend they were created with, and new ones use 'disk'.
+            Opening an existing cache with a different backend is an error
+
+            shards : int (kwargs)
+            (optional) the number of shards of the 'sharded' backend. Defaults to 8,
+            or to the number of shards of an existing cache. Opening an existing
+            cache with a different number of shards is an error
+
+            compression : str (kwargs)
+            (optional) the compression of new values: 'zlib' (default), 'zstd' or 'none'
+
+            expiry_policy : dict (kwargs)
+            (optional) a dictionary of data class=>seconds that overrides
+            the DEFAULT_EXPIRY_POLICY
+
             Raises
             ------
-            ValidationError : in case an invalid cache size is supplied
+            ValidationError : in case an invalid cache size, backend or compression is supplied,
+            or the backend or number of shards don't match those of an existing cache
             FileSystemError : in case the cache directory cannot be created
 
             
@@ -44,15 +333,68 @@ class FinancialCache():
             max_cache_size_bytes = 4e9
 
         util.create_dir(path)
-        
+
+        # the layout of an existing cache always takes precedence, since
+        # keys can't be found using a different backend or number of shards
+        existing_shards = ShardedDiskCache.count_shards(path)
+        if existing_shards > 0:
+            existing_backend = 'sharded'
+        elif os.path.isfile(os.path.join(path, DISK_CACHE_FILE_NAME)):
+            existing_backend = 'disk'
+        else:
+            existing_backend = None
+
+        backend = kwargs.get('backend') or existing_backend or 'disk'
+        shards = kwargs.get('shards') or existing_shards or 8
+
+        if backend not in ['disk', 'sharded']:
+            raise ValidationError('invalid cache backend: %s' % backend, None)
+
+        if existing_backend != None and backend != existing_backend:
+            raise ValidationError("Cache %s was created with the '%s' backend and can't be opened with the '%s' backend" %
+                                  (path, existing_backend, backend), None)
+
+        if existing_shards > 0 and shards != existing_shards:
+            raise ValidationError("Cache %s was created with %d shards and can't be opened with %s shards" %
+                                  (path, existing_shards, str(shards)), None)
+
         try:
-            self.cache = Cache(path, size_limit=int(max_cache_size_bytes))
+            if backend == 'sharded':
+                self.cache = ShardedDiskCache(path, int(shards), int(max_cache_size_bytes))
+            else:
+                self.cache = Cache(path, size_limit=int(max_cache_size_bytes))
         except Exception as e:
-            raise ValidationError('invalid max cache size', e)
+            raise ValidationError('invalid max cache size or number of shards', e)
 
-        log.debug("Cache was initialized: %s" % path)
+        self.backend = backend
+        self.codec = cache_codec.CacheCodec(kwargs.get('compression') or 'zlib')
 
-    def write(self, key : str, value : object):
+        try:
+            # by default keep up to 64MB in memory, but never more than on disk
+            self.memory_cache = MemoryCache(
+                int(kwargs.get('memory_max_entries', 100000)),
+                int(kwargs.get('memory_max_bytes', min(64e6, int(max_cache_size_bytes)))))
+        except Exception as e:
+            raise ValidationError('invalid memory cache size', e)
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'memory_misses': 0,
+            'disk_hits': 0,
+            'disk_misses': 0
+        }
+
+        self.expiry_policy = dict(DEFAULT_EXPIRY_POLICY)
+        self.expiry_policy.update(kwargs.get('expiry_policy') or {})
+
+        self.refresh_handlers = {}
+        self.refresher = None
+        self.refresher_stop = threading.Event()
+
+        log.debug("Cache was initialized: %s (%s backend)" % (path, backend))
+
+    def write(self, key : str, value : object, expire : float = None, data_class : str = None):
         """
             Writes an object to the cache
 
@@ -64,6 +406,14 @@ class FinancialCache():
             value : object
             The cache value
 
+            expire : float
+            (optional) number of seconds after which the object expires.
+            By default it's determined by the expiry policy of its data class
+
+            data_class : str
+            (optional) the class of data of the object, used to look up
+            its expiry policy. Defaults to the prefix of the key
+
             Returns
             ----------
             None
@@ -71,7 +421,19 @@ class FinancialCache():
         if (key == "" or key is None) or (value == "" or value is None):
             return
 
-        self.cache[key] = value
+        prefix = instrumentation.key_prefix(key)
+
+        if expire is None:
+            expire = self.get_expiry(data_class if data_class is not None else prefix)
+
+        with instrumentation.timer('cache_write'):
+            encoded_value = self.codec.encode(value)
+            size = len(encoded_value)
+            self.cache.set(key, encoded_value, expire=expire)
+            self.memory_cache.set(key, value, time.time() + expire if expire is not None else None, size)
+
+        instrumentation.increment(prefix, 'writes')
+        instrumentation.increment(prefix, 'bytes_written', size)
 
     def read(self, key):
         """
@@ -87,14 +449,283 @@ class FinancialCache():
             ----------
             The object in question, or None if they key is not present
         """
-        try:
-            return self.cache[key]
-        except KeyError:
+        prefix = instrumentation.key_prefix(key)
+        start = time.perf_counter()
+
+        value = self.memory_cache.get(key)
+
+        if value is not None:
+            self.__count__('memory_hits')
+            instrumentation.increment(prefix, 'hits')
+            instrumentation.observe('cache_read_memory', time.perf_counter() - start)
+            return value
+
+        self.__count__('memory_misses')
+
+        (value, expire_time) = self.cache.get(key, default=None, expire_time=True)
+
+        if cache_codec.is_encoded(value):
+            size = len(value)
+            try:
+                value = cache_codec.decode(value)
+            except Exception as e:
+                log.warning("Could not decode %s, ignoring it: %s" % (key, str(e)))
+                value = None
+        else:
+            # cached by an older version
+            size = approximate_size(value)
+
+        if value is None:
+            self.__count__('disk_misses')
+            instrumentation.increment(prefix, 'misses')
+            instrumentation.observe('cache_read_disk', time.perf_counter() - start)
             log.debug("%s not found inside cache" % key)
             return None
 
+        self.__count__('disk_hits')
+        instrumentation.observe('cache_read_disk', time.perf_counter() - start)
+
+        self.memory_cache.set(key, value, expire_time, size)
+
+        instrumentation.increment(prefix, 'hits')
+        instrumentation.increment(prefix, 'bytes_read', size or 0)
+
+        return value
+
+    def read_many(self, keys : list):
+        """
+            Reads several objects from the cache
+
+            Unlike write_many(), reads don't use a transaction. The only
+            transactions supported by diskcache take the write lock, which would
+            serialize concurrent readers, while reads are already cheap without one.
+
+            Parameters
+            ----------
+            keys : list
+            The cache keys
+
+            Returns
+            ----------
+            A dictionary of key=>object, where the objects that
+            cannot be found are None
+        """
+        return {key: self.read(key) for key in keys}
+
+    def write_many(self, values : dict, expire : float = None, data_class : str = None):
+        """
+            Writes several objects to the cache in a single transaction,
+            which only locks the shards of the supplied keys
+
+            Parameters
+            ----------
+            values : dict
+            A dictionary of key=>object
+
+            expire : float
+            (optional) number of seconds after which the objects expire.
+            By default it's determined by the expiry policy of their data class
+
+            data_class : str
+            (optional) the class of data of the objects. See write()
+
+            Returns
+            ----------
+            None
+        """
+        if len(values) == 0:
+            return
+
+        with self.transaction(keys=values.keys()):
+            for (key, value) in values.items():
+                self.write(key, value, expire=expire, data_class=data_class)
+
+    def get_expiry(self, data_class : str):
+        """
+            Returns the number of seconds after which objects of
+            the supplied data class expire, or None if they never expire
+        """
+        return self.expiry_policy.get(data_class)
+
+    def set_expiry(self, data_class : str, expire : float):
+        """
+            Sets the number of seconds after which objects of the
+            supplied data class expire. None means never.
+            Only affects objects written afterwards.
+        """
+        self.expiry_policy[data_class] = expire
+
+    def register_refresh_handler(self, key_prefix : str, refresh_fn : object):
+        """
+            Registers the function used by the refresher to renew the keys
+            starting with the supplied prefix, before they expire.
+
+            Parameters
+            ----------
+            key_prefix : str
+            The prefix of the keys, e.g. 'intrinio-metric-v2-'.
+            The handler of the longest matching prefix is used
+
+            refresh_fn : object
+            A function that takes the key and its current value and returns
+            the new value, or None if the key should not be renewed
+        """
+        self.refresh_handlers[key_prefix] = refresh_fn
+
+    def refresh_expiring(self, window_seconds : float):
+        """
+            Renews the objects held in the memory tier (the ones that were
+            recently read or written) that will expire within the supplied
+            number of seconds, using the registered refresh handlers.
+
+            Returns
+            ----------
+            The number of renewed objects
+        """
+        expire_before = time.time() + window_seconds
+
+        with self.memory_cache.lock:
+            expiring = [(key, entry[0]) for (key, entry) in self.memory_cache.entries.items()
+                        if entry[2] is not None and entry[2] <= expire_before]
+
+        refresh_handlers = dict(default_refresh_handlers)
+        refresh_handlers.update(self.refresh_handlers)
+
+        refreshed = 0
+
+        for (key, value) in expiring:
+            matching_prefixes = [prefix for prefix in refresh_handlers.keys() if key.startswith(prefix)]
+            if len(matching_prefixes) == 0:
+                continue
+
+            try:
+                new_value = refresh_handlers[max(matching_prefixes, key=len)](key, value)
+            except Exception as e:
+                log.warning("Could not refresh %s: %s" % (key, str(e)))
+                continue
+
+            if new_value is not None:
+                self.write(key, new_value)
+                refreshed += 1
+
+        if refreshed > 0:
+            log.debug("Refreshed %d expiring cache keys" % refreshed)
+
+        return refreshed
+
+    def start_refresher(self, interval_seconds : float = 60, window_seconds : float = 3600):
+        """
+            Starts a background (daemon) thread that calls refresh_expiring()
+            every interval_seconds, so that frequently used objects are
+            renewed before they expire and are never read cold from the API.
+        """
+        if self.refresher is not None:
+            return
+
+        def refresh():
+            while not self.refresher_stop.wait(interval_seconds):
+                try:
+                    self.refresh_expiring(window_seconds)
+                except Exception as e:
+                    log.warning("Cache refresh failed: %s" % str(e))
+
+        self.refresher_stop.clear()
+        self.refresher = threading.Thread(target=refresh, name='cache-refresher', daemon=True)
+        self.refresher.start()
+
+    def stop_refresher(self):
+        """
+            Stops the background refresher, if running
+        """
+        if self.refresher is None:
+            return
+
+        self.refresher_stop.set()
+        self.refresher.join()
+        self.refresher = None
+
+    def get_stats(self):
+        """
+            Returns a copy of the hit and miss counters of the memory and disk tiers,
+            as a dictionary of 'memory_hits', 'memory_misses', 'disk_hits' and 'disk_misses'
+        """
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def __count__(self, stat : str):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    @contextmanager
+    def transaction(self, keys : list = None):
+        """
+            Returns a context manager that groups all the writes made within it
+            into a single transaction. While the transaction is open, writes
+            from other threads and processes are blocked.
+
+            With the sharded backend, if the keys that will be written are
+            supplied, only their shards are locked, and the writes made within
+            the transaction must be limited to them.
+
+            Example:
+            with cache.transaction():
+                cache.write('key-1', 1)
+                cache.write('key-2', 2)
+        """
+        if keys is not None and isinstance(self.cache, ShardedDiskCache):
+            transact = self.cache.transact(retry=True, keys=keys)
+        else:
+            transact = self.cache.transact(retry=True)
+
+        try:
+            with transact:
+                yield
+        except BaseException:
+            # the writes were rolled back on disk, so they must
+            # not be served from memory either
+            self.memory_cache.clear()
+            raise
+
+    def delete(self, key : str):
+        """
+            Deletes an object from the cache
+
+            Parameters
+            ----------
+            key : str
+            The cache key
+
+            Returns
+            ----------
+            True if the key was found and deleted, False otherwise
+        """
+        self.memory_cache.delete(key)
+        return self.cache.delete(key)
+
+    def iterkeys(self):
+        """
+            Returns an iterator over all the keys in the cache
+        """
+        return self.cache.iterkeys()
+
     def close(self):
+        self.stop_refresher()
         self.cache.close()
 
 
-cache = FinancialCache("./financial-data/")
\ No newline at end of file
+def __create_shared_cache__():
+    """
+        Creates the shared cache. Its path (by default ./financial-data/), backend,
+        compression and expiry policy can be selected using the FINANCIAL_CACHE_PATH,
+        FINANCIAL_CACHE_BACKEND, FINANCIAL_CACHE_SHARDS, FINANCIAL_CACHE_COMPRESSION
+        and FINANCIAL_CACHE_EXPIRY_POLICY environment variables
+    """
+    return FinancialCache(os.environ.get('FINANCIAL_CACHE_PATH', "./financial-data/"),
+                          backend=os.environ.get('FINANCIAL_CACHE_BACKEND'),
+                          shards=int(os.environ.get('FINANCIAL_CACHE_SHARDS', 0)),
+                          compression=os.environ.get('FINANCIAL_CACHE_COMPRESSION'),
+                          expiry_policy=parse_expiry_policy(os.environ.get('FINANCIAL_CACHE_EXPIRY_POLICY')))
+
+
+# the shared cache, which is only created (and its directory opened) when first used
+cache = LazyObject(__create_shared_cache__)
\ No newline at end of file
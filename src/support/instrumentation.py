@@ -0,0 +1,184 @@
+"""Author: Mark Hanegraaff -- 2019
+
+This module collects counters and latency histograms used to understand
+where time goes during a run, for example cache hit rates by key prefix
+and the latency of cache reads and API calls.
+
+Counters are grouped by a name (typically a cache key prefix like
+'intrinio-statement') and histograms are identified by a name
+(like 'cache_read_disk' or 'api_call.get_company_historical_data').
+"""
+import threading
+import time
+import json
+from contextlib import contextmanager
+from exception.exceptions import FileSystemError
+
+# upper bounds of the histogram buckets in seconds: 1us, 2us, 4us ... ~16s
+HISTOGRAM_BUCKETS = [1e-6 * (2 ** i) for i in range(0, 25)]
+
+
+class Histogram():
+    """
+        A latency histogram with exponential buckets.
+        Percentiles are approximated by the upper bound of their bucket.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds : float):
+        bucket = 0
+        while bucket < len(HISTOGRAM_BUCKETS) and seconds > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+
+        self.bucket_counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile : float):
+        """
+            Returns the approximate value (in seconds) below which the
+            supplied percentage of observations fall
+        """
+        if self.count == 0:
+            return 0.0
+
+        threshold = self.count * percentile / 100
+        cumulative = 0
+
+        for (bucket, bucket_count) in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return min(HISTOGRAM_BUCKETS[bucket], self.max) if bucket < len(HISTOGRAM_BUCKETS) else self.max
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count > 0 else 0.0,
+            'p50_seconds': self.percentile(50),
+            'p95_seconds': self.percentile(95),
+            'p99_seconds': self.percentile(99),
+            'max_seconds': self.max
+        }
+
+
+lock = threading.Lock()
+counters = {}
+histograms = {}
+
+
+def key_prefix(key : str):
+    """
+        Returns the prefix of a cache key used to group its counters,
+        made of its first two segments. For example:
+
+        intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018 -> intrinio-statement
+    """
+    return '-'.join(str(key).split('-')[0:2])
+
+
+def increment(group : str, counter : str, amount : int = 1):
+    """
+        Increments a counter of the supplied group
+    """
+    with lock:
+        group_counters = counters.setdefault(group, {})
+        group_counters[counter] = group_counters.get(counter, 0) + amount
+
+
+def observe(name : str, seconds : float):
+    """
+        Records a latency observation in the supplied histogram
+    """
+    with lock:
+        if name not in histograms:
+            histograms[name] = Histogram()
+        histograms[name].observe(seconds)
+
+
+@contextmanager
+def timer(name : str):
+    """
+        Context manager that records the time spent within it
+        in the supplied histogram, e.g.
+
+        with instrumentation.timer('cache_write'):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def get_stats():
+    """
+        Returns a copy of all counters and histograms like this:
+
+        {
+            'counters': {
+                'intrinio-statement': {'hits': 10, 'misses': 2, ...}
+            },
+            'histograms': {
+                'cache_read_disk': {'count': 12, 'mean_seconds': 0.0001, ...}
+            }
+        }
+    """
+    with lock:
+        return {
+            'counters': {group: dict(group_counters) for (group, group_counters) in counters.items()},
+            'histograms': {name: histogram.to_dict() for (name, histogram) in histograms.items()}
+        }
+
+
+def reset():
+    """
+        Clears all counters and histograms
+    """
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+
+def format_summary(stats : dict = None):
+    """
+        Returns a human readable summary of the supplied (or current) stats
+    """
+    if stats is None:
+        stats = get_stats()
+
+    lines = []
+
+    for (group, group_counters) in sorted(stats['counters'].items()):
+        lines.append("%s: %s" % (group, ", ".join(
+            ["%s=%d" % (counter, value) for (counter, value) in sorted(group_counters.items())])))
+
+    for (name, histogram) in sorted(stats['histograms'].items()):
+        lines.append("%s: count=%d, mean=%.3fms, p50=%.3fms, p95=%.3fms, p99=%.3fms, max=%.3fms" % (
+            name, histogram['count'], histogram['mean_seconds'] * 1000, histogram['p50_seconds'] * 1000,
+            histogram['p95_seconds'] * 1000, histogram['p99_seconds'] * 1000, histogram['max_seconds'] * 1000))
+
+    return "\n".join(lines)
+
+
+def dump_json(file_name : str, stats : dict = None):
+    """
+        Writes the supplied (or current) stats to a JSON file
+    """
+    if stats is None:
+        stats = get_stats()
+
+    try:
+        with open(file_name, 'w') as f:
+            json.dump(stats, f, indent=4)
+    except Exception as e:
+        raise FileSystemError("Can't write stats file: %s" % file_name, e)
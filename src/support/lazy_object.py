@@ -0,0 +1,55 @@
+"""Author: Mark Hanegraaff -- 2019
+"""
+import threading
+
+
+class LazyObject():
+    """
+        A proxy that creates the object it stands for on first use, so that
+        expensive objects (API clients, caches) can be declared at module level
+        without being created at import time, e.g.
+
+        cache = LazyObject(lambda: FinancialCache("./financial-data/"))
+        cache.read('key')  # the cache is created here
+
+        The object is created once, even when first used by several threads.
+        Attributes set on the proxy (for example by unittest.mock.patch.object)
+        take precedence over those of the object.
+    """
+
+    def __init__(self, factory_fn : object):
+        '''
+            Initializes the proxy
+
+            Parameters
+            ----------
+            factory_fn : object
+            A function, taking no parameters, that creates the object
+        '''
+        object.__setattr__(self, '_factory_fn', factory_fn)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def get_instance(self):
+        """
+            Returns the object, creating it if necessary
+        """
+        instance = self._instance
+
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, '_instance', self._factory_fn())
+                instance = self._instance
+
+        return instance
+
+    def is_initialized(self):
+        """
+            Returns True if the object was already created
+        """
+        return self._instance is not None
+
+    def __getattr__(self, name : str):
+        # only called for attributes that are not defined by the proxy itself
+        return getattr(self.get_instance(), name)
@@ -0,0 +1,166 @@
+"""Author: Mark Hanegraaff -- 2019
+"""
+import threading
+import random
+import time
+import logging
+from exception.exceptions import ValidationError
+
+log = logging.getLogger()
+
+
+class RateLimiter():
+    """
+        A token bucket rate limiter shared by all the calls made to an API,
+        that also retries failed calls using a jittered exponential backoff.
+
+        Whether a failed call should be retried is determined by the supplied
+        classify_fn, which returns one of:
+
+            RateLimiter.THROTTLED : the call was throttled by the API (e.g. HTTP 429).
+                The bucket is emptied so that other callers slow down as well.
+            RateLimiter.TRANSIENT : the call failed because of a transient error (e.g. HTTP 5xx)
+            None : the error cannot be retried
+
+        Attributes:
+            requests_per_second : float
+                The rate at which tokens are added to the bucket
+            burst : int
+                The maximum number of tokens in the bucket. Defaults to
+                one second worth of requests
+            max_retries : int
+                The maximum number of times a call is retried
+            base_delay : float
+                The initial backoff in seconds. It doubles after each attempt
+            max_delay : float
+                The maximum backoff in seconds
+    """
+
+    THROTTLED = 'throttled'
+    TRANSIENT = 'transient'
+
+    def __init__(self, requests_per_second : float, classify_fn : object, **kwargs):
+        '''
+            Initializes the rate limiter
+
+            Parameters
+            ----------
+            requests_per_second : float
+            The maximum sustained request rate
+
+            classify_fn : object
+            A function that takes an exception and returns THROTTLED,
+            TRANSIENT or None
+
+            burst, max_retries, base_delay, max_delay : (kwargs)
+            (optional) see class attributes
+
+            Raises
+            ------
+            ValidationError : in case an invalid rate is supplied
+        '''
+        self.lock = threading.Lock()
+        self.set_rate(requests_per_second)
+
+        self.classify_fn = classify_fn
+        self.burst = kwargs.get('burst', max(1, int(self.requests_per_second)))
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.base_delay = kwargs.get('base_delay', 0.5)
+        self.max_delay = kwargs.get('max_delay', 30)
+
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+
+        self.stats = {
+            'requests': 0,
+            'throttles': 0,
+            'retries': 0,
+            'rate_limited_waits': 0
+        }
+
+    def set_rate(self, requests_per_second : float):
+        """
+            Changes the maximum sustained request rate
+        """
+        try:
+            if requests_per_second <= 0:
+                raise ValueError("must be greater than zero")
+        except Exception as e:
+            raise ValidationError("Invalid requests per second: %s" % str(requests_per_second), e)
+
+        with self.lock:
+            self.requests_per_second = float(requests_per_second)
+
+    def acquire(self):
+        """
+            Blocks until a token is available, and consumes it
+        """
+        waited = False
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.requests_per_second)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['requests'] += 1
+                    if waited:
+                        self.stats['rate_limited_waits'] += 1
+                    return
+
+                wait_time = (1 - self.tokens) / self.requests_per_second
+
+            waited = True
+            time.sleep(wait_time)
+
+    def call(self, fn : object, *args, **kwargs):
+        """
+            Calls fn with the supplied arguments once a token is available, and
+            retries it in case of a throttling or transient error.
+
+            Raises
+            ----------
+            The exception raised by the last attempt
+
+            Returns
+            ----------
+            The value returned by fn
+        """
+        attempt = 0
+
+        while True:
+            self.acquire()
+
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error_class = self.classify_fn(e)
+
+                if error_class is None:
+                    raise
+
+                with self.lock:
+                    if error_class == self.THROTTLED:
+                        self.stats['throttles'] += 1
+                        # slow down every caller, not just this one
+                        self.tokens = min(self.tokens, 0)
+
+                    if attempt >= self.max_retries:
+                        raise
+
+                    self.stats['retries'] += 1
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                attempt += 1
+
+                log.debug("Retrying API call (%s), attempt %d in %.2f seconds" % (error_class, attempt, delay))
+                time.sleep(delay)
+
+    def get_stats(self):
+        """
+            Returns a copy of the request, throttle and retry counters
+        """
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,86 @@
+"""Author: Mark Hanegraaff -- 2019
+"""
+import threading
+import logging
+from exception.exceptions import DataError
+
+log = logging.getLogger()
+
+
+class SingleFlight():
+    """
+        Coalesces concurrent calls that share the same key, so that only
+        the first caller (the leader) performs the call, while every other
+        caller waits for the leader and receives the same result, or
+        the same exception.
+
+        Once the leader completes, the key is released, and the next call
+        with the same key will be executed again. If the leader is interrupted
+        (e.g. by a KeyboardInterrupt) the waiting callers raise a DataError.
+    """
+
+    class __Call__():
+        """
+            The state of an in-flight call
+        """
+        def __init__(self):
+            self.done = threading.Event()
+            self.completed = False
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key : str, fn : object):
+        """
+            Executes fn, unless a call with the same key is already in flight,
+            in which case it waits for that call to complete and returns its result.
+
+            Parameters
+            ----------
+            key : str
+            The key used to identify duplicate calls
+
+            fn : object
+            A function that takes no parameters
+
+            Raises
+            ----------
+            Any exception raised by fn
+            DataError : in case the leader was interrupted before completing the call
+
+            Returns
+            ----------
+            The value returned by fn
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self.__Call__()
+                self.calls[key] = call
+
+        if not leader:
+            log.debug("Waiting for in-flight call: %s" % key)
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+            if not call.completed:
+                raise DataError("The in-flight call was interrupted: %s" % key, None)
+            return call.result
+
+        try:
+            call.result = fn()
+            call.completed = True
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
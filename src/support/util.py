@@ -17,8 +17,9 @@ def create_dir(dirname):
         None
     """
     try:
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        # exist_ok avoids a race when the directory is created
+        # concurrently by another thread or process
+        os.makedirs(dirname, exist_ok=True)
     except Exception as e:
         raise FileSystemError("Can't create directory: %s" % dirname, e)
 
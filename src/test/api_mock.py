@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+from unittest.mock import Mock, patch
+from intrinio_sdk.rest import ApiException
+from data_provider import intrinio_data
+
+
+@contextmanager
+def patch_api(api_name : str, method_name : str, **kwargs):
+    """
+        Replaces one of the Intrinio API clients of intrinio_data
+        (e.g. 'company_api') with a mock, and yields the mock of the
+        supplied method, configured using kwargs (e.g. side_effect).
+
+        The whole client is replaced, rather than just the method, so that
+        the SDK client is never created and tests run without an API key.
+        Since the SDK isn't loaded, its ApiException is patched in too.
+    """
+    method = Mock(**kwargs)
+
+    with patch.object(intrinio_data, api_name, new=Mock(**{method_name: method})), \
+         patch.object(intrinio_data, 'ApiException', new=ApiException):
+        yield method
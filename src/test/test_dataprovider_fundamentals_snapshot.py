@@ -0,0 +1,125 @@
+import unittest
+import shutil
+import math
+import os
+from unittest.mock import patch
+from data_provider import intrinio_data
+from data_provider import fundamentals_snapshot
+from data_provider.fundamentals_snapshot import FundamentalsSnapshot
+from financial import calculator
+from support.financial_cache import FinancialCache
+from exception.exceptions import DataError, FileSystemError, ValidationError
+
+
+class TestFundamentalsSnapshot(unittest.TestCase):
+
+    test_cache_path = "./test/cache-unittest-snapshot/"
+    test_snapshot_path = "./test/snapshot-unittest/"
+
+    def setUp(self):
+        self.test_cache = FinancialCache(self.test_cache_path)
+
+        for year in [2017, 2018]:
+            self.test_cache.write(intrinio_data.__statement_cache_key__('AAPL', 'cash_flow_statement', 'FY', year), {
+                'netincome': float(year),
+                'netcashfromcontinuingoperatingactivities': 10.0,
+                'purchaseofplantpropertyandequipment': -1.0,
+                'othertag': 1.0
+            })
+            self.test_cache.write(intrinio_data.__metric_cache_key__('AAPL', 'yearly', 'totalrevenue', year), year * 10.0)
+
+        self.test_cache.write(intrinio_data.__metric_cache_key__('MSFT', 'yearly', 'totalrevenue', 2018), 5.0)
+        self.test_cache.write(intrinio_data.__statement_cache_key__('BRK-B', 'cash_flow_statement', 'FY', 2018),
+                              {'netincome': 3.0})
+        self.test_cache.write(intrinio_data.__metric_cache_key__('MSFT', 'yearly', 'totalrevenue', 2017),
+                              intrinio_data.NoData(None))
+
+        with patch.object(intrinio_data, 'cache', new=self.test_cache):
+            self.exported_values = fundamentals_snapshot.export_snapshot(
+                self.test_snapshot_path, fundamentals_snapshot.list_cached_tickers(), 2016, 2018)
+
+        self.snapshot = FundamentalsSnapshot(self.test_snapshot_path)
+
+    def tearDown(self):
+        self.test_cache.close()
+        shutil.rmtree(self.test_cache_path)
+        shutil.rmtree(self.test_snapshot_path)
+
+    def test_layout(self):
+        self.assertEqual(self.snapshot.tickers, ['AAPL', 'BRK-B', 'MSFT'])
+        self.assertEqual(self.snapshot.years, [2016, 2017, 2018])
+        self.assertEqual(self.snapshot.tags, [tag for (tag, source) in fundamentals_snapshot.DEFAULT_SNAPSHOT_TAGS])
+        self.assertEqual(self.snapshot.values.shape, (3, 3, 4))
+        self.assertEqual(self.exported_values, 2 * 4 + 1 + 1)
+
+    def test_get_value(self):
+        self.assertEqual(self.snapshot.get_value('aapl', 'netincome', 2018), 2018.0)
+        self.assertEqual(self.snapshot.get_value('brk-b', 'netincome', 2018), 3.0)
+        self.assertTrue(math.isnan(self.snapshot.get_value('AAPL', 'netincome', 2016)))
+
+        # no data is exported as missing
+        self.assertTrue(math.isnan(self.snapshot.get_value('MSFT', 'totalrevenue', 2017)))
+
+    def test_get_column(self):
+        self.assertEqual(list(self.snapshot.get_column('totalrevenue', 2018))[0::2], [20180.0, 5.0])
+        self.assertEqual(list(self.snapshot.get_column('netincome', 2018))[0:2], [2018.0, 3.0])
+
+    def test_get_series(self):
+        self.assertEqual(self.snapshot.get_series('AAPL', 'totalrevenue', 2016, 2018), {2017: 20170.0, 2018: 20180.0})
+        self.assertEqual(self.snapshot.get_series('MSFT', 'netincome', 2016, 2018), {})
+
+    def test_get_statements(self):
+        statements = self.snapshot.get_statements('AAPL', 2017, 2018, [
+            'netincome', 'netcashfromcontinuingoperatingactivities', 'purchaseofplantpropertyandequipment'])
+
+        self.assertEqual(statements[2018], {'netincome': 2018.0, 'netcashfromcontinuingoperatingactivities': 10.0,
+                                            'purchaseofplantpropertyandequipment': -1.0})
+
+        # the statements can be used by the calculator
+        self.assertEqual(calculator.get_historical_simple_fcfe(statements), {2017: 9.0, 2018: 9.0})
+        self.assertEqual(calculator.get_historical_net_income(statements), {2017: 2017.0, 2018: 2018.0})
+
+    def test_not_part_of_snapshot(self):
+        with self.assertRaises(DataError):
+            self.snapshot.get_value('GE', 'netincome', 2018)
+        with self.assertRaises(DataError):
+            self.snapshot.get_value('AAPL', 'othertag', 2018)
+        with self.assertRaises(DataError):
+            self.snapshot.get_series('AAPL', 'netincome', 2015, 2018)
+
+    def test_read_only(self):
+        with self.assertRaises(ValueError):
+            self.snapshot.values[0, 0, 0] = 1.0
+
+    def test_invalid_years(self):
+        with self.assertRaises(ValidationError):
+            fundamentals_snapshot.export_snapshot(self.test_snapshot_path, ['AAPL'], 2018, 2017)
+
+    def test_reexport(self):
+        # a new export with a different shape doesn't affect the open snapshot,
+        # while new readers see its index and values together
+        with patch.object(intrinio_data, 'cache', new=self.test_cache):
+            fundamentals_snapshot.export_snapshot(self.test_snapshot_path, ['MSFT'], 2018, 2018)
+
+        self.assertEqual(self.snapshot.get_value('AAPL', 'totalrevenue', 2018), 20180.0)
+
+        snapshot = FundamentalsSnapshot(self.test_snapshot_path)
+        self.assertEqual(snapshot.values.shape, (1, 1, 4))
+        self.assertEqual(snapshot.get_value('MSFT', 'totalrevenue', 2018), 5.0)
+
+        # versions can be read by other users
+        current = fundamentals_snapshot.__read_current__(self.test_snapshot_path)
+        self.assertEqual(os.stat(os.path.join(self.test_snapshot_path, current)).st_mode & 0o755, 0o755)
+
+        # only the current and previous versions are kept
+        with patch.object(intrinio_data, 'cache', new=self.test_cache):
+            fundamentals_snapshot.export_snapshot(self.test_snapshot_path, ['AAPL'], 2018, 2018)
+
+        versions = [name for name in os.listdir(self.test_snapshot_path)
+                    if name.startswith(fundamentals_snapshot.VERSION_DIR_PREFIX)]
+        self.assertEqual(len(versions), 2)
+        self.assertEqual(FundamentalsSnapshot(self.test_snapshot_path).tickers, ['AAPL'])
+
+    def test_missing_snapshot(self):
+        with self.assertRaises(FileSystemError):
+            FundamentalsSnapshot("./test/snapshot-unittest-missing/")
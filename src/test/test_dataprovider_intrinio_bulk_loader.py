@@ -0,0 +1,69 @@
+import unittest
+import shutil
+import os
+import datetime
+from unittest.mock import patch
+from intrinio_sdk.rest import ApiException
+from exception.exceptions import DataError, FileSystemError
+from data_provider import intrinio_data
+from test import api_mock
+from data_provider import intrinio_bulk_loader
+from support.financial_cache import FinancialCache
+
+
+class TestDataProviderIntrinioBulkLoader(unittest.TestCase):
+
+    test_cache_path = "./test/cache-unittest-bulk/"
+    test_dump_path = "./test/bulk-load-unittest/"
+
+    def setUp(self):
+        os.makedirs(self.test_dump_path, exist_ok=True)
+        self.test_cache = FinancialCache(self.test_cache_path)
+
+    def tearDown(self):
+        self.test_cache.close()
+        shutil.rmtree(self.test_cache_path)
+        shutil.rmtree(self.test_dump_path)
+
+    def write_file(self, file_name : str, contents : str):
+        with open(self.test_dump_path + file_name, 'w') as f:
+            f.write(contents)
+
+    def test_load_directory(self):
+        self.write_file('statements.jsonl',
+            '{"ticker": "aapl", "statement": "cash_flow_statement", "year": 2017, "tags": {"netincome": 1}}\n' +
+            '{"ticker": "aapl", "statement": "cash_flow_statement", "year": 2018, "tags": {"netincome": 2}}\n')
+        self.write_file('metrics.csv', 'ticker,tag,year,value\naapl,totalrevenue,2017,10\nAAPL,totalrevenue,2018,20\n')
+        self.write_file('prices.csv', 'ticker,date,close\naapl,2019-10-01,100\nAAPL,2019-10-02,101.5\n')
+
+        with patch.object(intrinio_data, 'cache', new=self.test_cache), \
+             patch.object(intrinio_bulk_loader, 'ROWS_PER_TRANSACTION', new=1):
+            loaded_rows = intrinio_bulk_loader.load_directory(self.test_dump_path)
+
+        self.assertEqual(loaded_rows, {'statements.jsonl': 2, 'metrics.csv': 2, 'prices.csv': 2})
+
+        # everything is read from the cache, regardless of the case of the tickers
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException("Not Found")), \
+             api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=ApiException("Not Found")), \
+             api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=ApiException("Not Found")), \
+             patch.object(intrinio_data, 'cache', new=self.test_cache):
+
+            self.assertEqual(intrinio_data.get_historical_cashflow_stmt('AAPL', 2017, 2018, None),
+                             {2017: {'netincome': 1}, 2018: {'netincome': 2}})
+            self.assertEqual(intrinio_data.get_historical_revenue('AAPL', 2017, 2018), {2017: 10, 2018: 20})
+            self.assertEqual(intrinio_data.get_daily_stock_close_prices('AAPL', datetime.date(2019, 10, 1), datetime.date(2019, 10, 2)),
+                             {'2019-10-01': 100, '2019-10-02': 101.5})
+
+    def test_load_malformed_row(self):
+        self.write_file('metrics.csv', 'ticker,tag,year,value\nAAPL,totalrevenue,XXXX,10\n')
+
+        with patch.object(intrinio_data, 'cache', new=self.test_cache):
+            with self.assertRaises(DataError):
+                intrinio_bulk_loader.load_directory(self.test_dump_path)
+
+    def test_load_invalid_directory(self):
+        with self.assertRaises(FileSystemError):
+            intrinio_bulk_loader.load_directory("./test/non-existent-directory/")
@@ -0,0 +1,152 @@
+import unittest
+import shutil
+import datetime
+from unittest.mock import patch
+from types import SimpleNamespace
+from intrinio_sdk.rest import ApiException
+from data_provider import intrinio_data
+from test import api_mock
+from data_provider import intrinio_cache_warmer
+from support.financial_cache import FinancialCache
+
+
+def get_statement(statement_name):
+    if 'MISSING' in statement_name:
+        raise ApiException(status=404, reason="Not Found")
+
+    return SimpleNamespace(standardized_financials=[
+        SimpleNamespace(data_tag=SimpleNamespace(tag='netincome'), value=1.0)
+    ])
+
+
+def get_historical_data(ticker, tag, frequency, start_date, end_date):
+    return SimpleNamespace(historical_data=[
+        SimpleNamespace(date=datetime.date(year, 12, 31), value=float(year))
+        for year in range(int(start_date[0:4]), int(end_date[0:4]) + 1)
+    ])
+
+
+def get_stock_prices(ticker, start_date, end_date, frequency, page_size, next_page):
+    return SimpleNamespace(
+        stock_prices=[SimpleNamespace(date=datetime.datetime.strptime(start_date, "%Y-%m-%d").date(), close=100.0)],
+        next_page=None
+    )
+
+
+class TestDataProviderIntrinioCacheWarmer(unittest.TestCase):
+
+    test_cache_path = "./test/cache-unittest-warmer/"
+
+    price_start_date = datetime.date(2019, 10, 1)
+    price_end_date = datetime.date(2019, 10, 5)
+
+    def setUp(self):
+        self.test_cache = FinancialCache(self.test_cache_path)
+
+    def tearDown(self):
+        self.test_cache.close()
+        shutil.rmtree(self.test_cache_path)
+
+    def test_plan_valuation_data(self):
+        requests = intrinio_cache_warmer.plan_valuation_data(
+            ['aapl'], 2017, 2018, 4, self.price_start_date, self.price_end_date)
+
+        self.assertIn({'type': 'statement', 'ticker': 'aapl', 'name': 'cash_flow_statement',
+                       'years': [2013, 2014, 2015, 2016, 2017, 2018]}, requests)
+        self.assertIn({'type': 'metric', 'ticker': 'aapl', 'name': 'totalrevenue',
+                       'years': [2013, 2014, 2015, 2016, 2017, 2018]}, requests)
+        self.assertIn({'type': 'metric', 'ticker': 'aapl', 'name': 'adjdilutedeps', 'years': [2017, 2018]}, requests)
+        self.assertIn({'type': 'price', 'ticker': 'aapl',
+                       'start_date': self.price_start_date, 'end_date': self.price_end_date}, requests)
+
+        # 6 statements, 6 revenues, 3 * 2 single year metrics and 1 price range
+        self.assertEqual(sum(intrinio_cache_warmer.count_items(request) for request in requests), 19)
+
+    def test_missing_items_lowercase_ticker(self):
+        self.test_cache.write(intrinio_data.__metric_cache_key__('AAPL', 'yearly', 'totalrevenue', 2018), 10.0)
+
+        with patch.object(intrinio_data, 'cache', new=self.test_cache):
+            missing_items = intrinio_cache_warmer.get_missing_items(
+                {'type': 'metric', 'ticker': 'aapl', 'name': 'totalrevenue', 'years': [2017, 2018]})
+
+        self.assertEqual(missing_items, [2017])
+
+    def test_warm(self):
+        requests = intrinio_cache_warmer.plan_valuation_data(
+            ['AAPL', 'MISSING'], 2018, 2018, 4, self.price_start_date, self.price_end_date)
+
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=get_statement) as statement_api, \
+             api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=get_historical_data) as metric_api, \
+             api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=get_stock_prices) as price_api, \
+             patch.object(intrinio_data, 'cache', new=self.test_cache):
+
+            stats = intrinio_cache_warmer.warm(requests, 4)
+
+            self.assertEqual(stats['items'], 2 * 14)
+            self.assertEqual(stats['cached_items'], 0)
+            self.assertEqual(stats['failed_items'], 5)
+            self.assertEqual(stats['fetched_items'], 2 * 14 - 5)
+
+            # missing statements are cached as no data
+            self.assertEqual(stats['coverage'], 1.0)
+
+            self.assertEqual(statement_api.call_count, 2 * 5)
+            self.assertEqual(metric_api.call_count, 2 * 4)
+            self.assertEqual(price_api.call_count, 2)
+
+            # everything is skipped the second time
+            stats = intrinio_cache_warmer.warm(requests, 4)
+
+            self.assertEqual(stats['cached_items'], 2 * 14)
+            self.assertEqual(stats['fetched_items'], 0)
+            self.assertEqual(stats['api_requests'], 0)
+            self.assertEqual(statement_api.call_count, 2 * 5)
+            self.assertEqual(metric_api.call_count, 2 * 4)
+            self.assertEqual(price_api.call_count, 2)
+
+            # and the valuation data is read from the cache
+            self.assertEqual(intrinio_data.get_historical_revenue('AAPL', 2014, 2018)[2018], 2018.0)
+            self.assertEqual(intrinio_data.get_diluted_eps('AAPL', 2018), 2018.0)
+            self.assertEqual(metric_api.call_count, 2 * 4)
+
+    def test_expired_prices_are_fetched(self):
+        requests = [{'type': 'price', 'ticker': 'AAPL',
+                     'start_date': self.price_start_date, 'end_date': self.price_end_date}]
+
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=get_stock_prices), \
+             patch.object(intrinio_data, 'cache', new=self.test_cache):
+
+            intrinio_cache_warmer.warm(requests, 1)
+            self.assertEqual(intrinio_cache_warmer.get_missing_items(requests[0]), [])
+
+            self.test_cache.delete('intrinio-price-v1-AAPL-2019-10-01')
+            self.assertEqual(intrinio_cache_warmer.get_missing_items(requests[0]),
+                             [(self.price_start_date, self.price_end_date)])
+
+    def test_current_day_prices(self):
+        """
+            Tests that prices up to the current day are reported as cached
+            only while the valuation would not fetch them again
+        """
+        today = datetime.date.today()
+        requests = [{'type': 'price', 'ticker': 'AAPL',
+                     'start_date': today - datetime.timedelta(days=5), 'end_date': today}]
+
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=get_stock_prices) as price_api, \
+             patch.object(intrinio_data, 'cache', new=self.test_cache):
+
+            stats = intrinio_cache_warmer.warm(requests, 1)
+            self.assertEqual(stats['coverage'], 1.0)
+
+            # the valuation reads the prices from the cache
+            intrinio_data.get_daily_stock_close_prices('AAPL', requests[0]['start_date'], today)
+            self.assertEqual(price_api.call_count, 1)
+
+            self.test_cache.delete('intrinio-price-v1-AAPL-recent')
+            self.assertEqual(intrinio_cache_warmer.get_missing_items(requests[0]),
+                             [(requests[0]['start_date'], today)])
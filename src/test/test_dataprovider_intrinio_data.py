@@ -3,9 +3,25 @@ from unittest.mock import patch
 from intrinio_sdk.rest import ApiException
 from exception.exceptions import ValidationError, DataError
 from data_provider import intrinio_data
-from  support.financial_cache import cache
+from support.rate_limiter import RateLimiter
+from  support.financial_cache import cache, FinancialCache
 from test import nop
+from test import api_mock
+from types import SimpleNamespace
+import threading
 import datetime
+import shutil
+import os
+
+
+def build_statement(tag_dict : dict):
+    """
+        builds an object that resembles the response of
+        fundamentals_api.get_fundamental_standardized_financials
+    """
+    return SimpleNamespace(standardized_financials=[
+        SimpleNamespace(data_tag=SimpleNamespace(tag=tag), value=value) for (tag, value) in tag_dict.items()
+    ])
 
 
 class TestDataProviderIntrinioData(unittest.TestCase):
@@ -16,13 +32,40 @@ class TestDataProviderIntrinioData(unittest.TestCase):
     '''
 
     def test_get_dilutedeps_with_api_exception(self):
-        with patch.object(intrinio_data.company_api, 'get_company_historical_data', \
-                    side_effect=ApiException("Server Error")), \
+        with api_mock.patch_api('company_api', 'get_company_historical_data', \
+                          side_effect=ApiException("Server Error")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
 
             with self.assertRaises(DataError):
                 intrinio_data.get_diluted_eps('NON-EXISTENT-TICKER', 2018)
 
+    def test_missing_api_key(self):
+        environ = {k: v for (k, v) in os.environ.items() if k != 'INTRINIO_API_KEY'}
+
+        with patch.dict(os.environ, environ, clear=True), \
+             patch.object(intrinio_data, 'sdk_loaded', new=False):
+            with self.assertRaises(ValidationError):
+                intrinio_data.__load_sdk__()
+
+    def test_invalid_settings(self):
+        with patch.dict(os.environ, {'INTRINIO_NO_DATA_CACHE_TTL_SECONDS': 'one day'}):
+            with self.assertRaises(ValidationError):
+                intrinio_data.__load_settings__()
+
+    def test_get_dilutedeps_retry_when_throttled(self):
+        response = SimpleNamespace(historical_data=[
+            SimpleNamespace(date=datetime.date(2018, 12, 31), value=1.5)
+        ])
+
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=[ApiException(status=429), ApiException(status=503), response]) as api, \
+             patch.object(intrinio_data, 'rate_limiter',
+                          new=RateLimiter(1000, intrinio_data.__classify_api_error__, base_delay=0)), \
+             patch.object(intrinio_data, 'cache', new=nop.NopCache()):
+
+            self.assertEqual(intrinio_data.get_diluted_eps('AAPL', 2018), 1.5)
+            self.assertEqual(api.call_count, 3)
+
     def test_get_dilutedeps_with_invalid_year(self):
         with self.assertRaises(ValidationError):
             intrinio_data.get_diluted_eps('AAPL', 0)
@@ -30,43 +73,344 @@ class TestDataProviderIntrinioData(unittest.TestCase):
         with self.assertRaises(ValidationError):
             intrinio_data.get_diluted_eps('AAPL', 0)
 
+    def test_get_dilutedeps_concurrent_calls_are_coalesced(self):
+        release = threading.Event()
+        call_count = []
+
+        def get_historical_data(*args, **kwargs):
+            call_count.append(1)
+            release.wait(5)
+            return SimpleNamespace(historical_data=[
+                SimpleNamespace(date=datetime.date(2018, 12, 31), value=1.5)
+            ])
+
+        results = []
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=get_historical_data), \
+             patch.object(intrinio_data, 'cache', new=nop.NopCache()):
+
+            threads = [threading.Thread(target=lambda: results.append(
+                intrinio_data.get_diluted_eps('AAPL', 2018))) for i in range(0, 3)]
+            threading.Timer(0.2, release.set).start()
+            for t in threads: t.start()
+            for t in threads: t.join(5)
+
+        self.assertEqual(len(call_count), 1)
+        self.assertEqual(results, [1.5, 1.5, 1.5])
+
+    def test_refresh_metric(self):
+        historical_data = SimpleNamespace(historical_data=[SimpleNamespace(date=datetime.date(2018, 12, 31), value=10.0)])
+
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                return_value=historical_data) as api:
+            self.assertEqual(intrinio_data.__refresh_metric__('intrinio-metric-v2-AAPL-yearly-totalrevenue-2018', 9.0), 10.0)
+            api.assert_called_with('AAPL', 'totalrevenue', frequency='yearly',
+                                   start_date='2018-01-01', end_date='2018-12-31')
+
+            # missing data is not refreshed
+            self.assertEqual(intrinio_data.__refresh_metric__(
+                'intrinio-metric-v2-AAPL-yearly-totalrevenue-2018', intrinio_data.NoData(None)), None)
+            self.assertEqual(api.call_count, 1)
+
     '''
         Financial statement tests
     '''
     def test_historical_cashflow_stmt_with_api_exception(self):
-        with patch.object(intrinio_data.fundamentals_api, 'get_fundamental_standardized_financials',
-                          side_effect=ApiException("Not Found")), \
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException("Not Found")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
             with self.assertRaises(DataError):
                 intrinio_data.get_historical_cashflow_stmt('NON-EXISTENT-TICKER', 2018, 2018, None) 
 
     def test_historical_income_stmt_with_api_exception(self):
-        with patch.object(intrinio_data.fundamentals_api, 'get_fundamental_standardized_financials',
-                          side_effect=ApiException("Not Found")), \
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException("Not Found")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
             with self.assertRaises(DataError):
                 intrinio_data.get_historical_income_stmt('NON-EXISTENT-TICKER', 2018, 2018, None) 
 
     def test_historical_balacesheet_stmt_with_api_exception(self):
-        with patch.object(intrinio_data.fundamentals_api, 'get_fundamental_standardized_financials',
-                          side_effect=ApiException("Not Found")), \
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException("Not Found")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
             with self.assertRaises(DataError):
                 intrinio_data.get_historical_balance_sheet('NON-EXISTENT-TICKER', 2018, 2018, None) 
 
+    def test_historical_cashflow_stmt_concurrent_fetch(self):
+        # all 5 years must be in flight at the same time for the barrier to release
+        barrier = threading.Barrier(5, timeout=5)
+
+        def get_statement(statement_name):
+            barrier.wait()
+            year = int(statement_name.split('-')[2])
+            return build_statement({'netincome': year, 'revenue': 1})
+
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=get_statement), \
+             patch.object(intrinio_data, 'cache', new=nop.NopCache()):
+            statements = intrinio_data.get_historical_cashflow_stmt('aapl', 2014, 2018, ['netincome'])
+
+        self.assertEqual(list(statements.keys()), [2014, 2015, 2016, 2017, 2018])
+        for year in range(2014, 2019):
+            self.assertEqual(statements[year], {'netincome': year})
+
+    def test_historical_cashflow_stmt_partial_api_exception(self):
+        def get_statement(statement_name):
+            if '2016' in statement_name:
+                raise ApiException("Not Found")
+            return build_statement({'netincome': 1})
+
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=get_statement), \
+             patch.object(intrinio_data, 'cache', new=nop.NopCache()):
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_cashflow_stmt('aapl', 2014, 2018, None)
+
     '''
         Stock Price Tests
     '''
     def test_daily_stock_prices_with_api_exception(self):
-        with patch.object(intrinio_data.security_api, 'get_security_stock_prices',
-                        side_effect=ApiException("Not Found")), \
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                              side_effect=ApiException("Not Found")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
             with self.assertRaises(DataError):
                 intrinio_data.get_daily_stock_close_prices('NON-EXISTENT-TICKER', datetime.date(2018, 1, 1), datetime.date(2019, 1, 1)) 
 
     def test_daily_stock_prices_with_other_exception(self):
-        with patch.object(intrinio_data.security_api, 'get_security_stock_prices',
-                        side_effect=KeyError("xxx")), \
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                              side_effect=KeyError("xxx")), \
              patch('support.financial_cache.cache', new=nop.Nop()):
             with self.assertRaises(ValidationError):
-                intrinio_data.get_daily_stock_close_prices('NON-EXISTENT-TICKER', datetime.date(2018, 1, 1), datetime.date(2019, 1, 1)) 
+                intrinio_data.get_daily_stock_close_prices('NON-EXISTENT-TICKER', datetime.date(2018, 1, 1), datetime.date(2019, 1, 1))
+
+    def test_refresh_price(self):
+        stock_prices = SimpleNamespace(stock_prices=[SimpleNamespace(date=datetime.date(2019, 10, 1), close=101.0)])
+
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                return_value=stock_prices) as api:
+            self.assertEqual(intrinio_data.__refresh_price__('intrinio-price-v1-AAPL-2019-10-01', 100.0), 101.0)
+            api.assert_called_with('AAPL', start_date='2019-10-01', end_date='2019-10-01', frequency='daily')
+
+            # the price index is not refreshed
+            self.assertEqual(intrinio_data.__refresh_price__('intrinio-price-v1-AAPL-index', {}), None)
+            self.assertEqual(api.call_count, 1)
+
+
+class TestDataProviderIntrinioDataCache(unittest.TestCase):
+
+    '''
+        Tests of the data that is read from and written to the financial cache
+    '''
+
+    test_cache_path = "./test/cache-unittest-intrinio/"
+
+    def setUp(self):
+        self.test_cache = FinancialCache(self.test_cache_path)
+        self.cache_patch = patch.object(intrinio_data, 'cache', new=self.test_cache)
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        self.test_cache.close()
+        shutil.rmtree(self.test_cache_path)
+
+    def test_historical_revenue_fetches_missing_years(self):
+        def get_historical_data(ticker, tag, frequency, start_date, end_date):
+            start_year = int(start_date[0:4])
+            end_year = int(end_date[0:4])
+            return SimpleNamespace(historical_data=[
+                SimpleNamespace(date=datetime.date(year, 12, 31), value=year) for year in range(start_year, end_year + 1)
+            ])
+
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=get_historical_data) as api:
+
+            revenue = intrinio_data.get_historical_revenue('AAPL', 2013, 2017)
+            self.assertEqual(revenue, {2013: 2013, 2014: 2014, 2015: 2015, 2016: 2016, 2017: 2017})
+
+            revenue = intrinio_data.get_historical_revenue('AAPL', 2014, 2018)
+            self.assertEqual(revenue, {2014: 2014, 2015: 2015, 2016: 2016, 2017: 2017, 2018: 2018})
+
+            # the second call only fetches the year that was missing
+            self.assertEqual(api.call_count, 2)
+            api.assert_called_with('AAPL', 'totalrevenue', frequency='yearly',
+                                   start_date='2018-01-01', end_date='2018-12-31')
+
+            # single years are read from the same datapoints
+            self.assertEqual(intrinio_data.__read_financial_metric__('AAPL', 2015, 'totalrevenue'), 2015)
+            self.assertEqual(api.call_count, 2)
+
+            # tickers are not case sensitive
+            self.assertEqual(intrinio_data.get_historical_revenue('aapl', 2014, 2018), revenue)
+            self.assertEqual(api.call_count, 2)
+
+    def test_historical_cashflow_stmt_cached_normalized(self):
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                return_value=build_statement({'netincome': 1, 'revenue': 2})) as api:
+
+            intrinio_data.get_historical_cashflow_stmt('aapl', 2018, 2018, None)
+            statements = intrinio_data.get_historical_cashflow_stmt('aapl', 2018, 2018, ['revenue'])
+
+            self.assertEqual(api.call_count, 1)
+            self.assertEqual(statements, {2018: {'revenue': 2}})
+            self.assertEqual(self.test_cache.read('intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018'),
+                             {'netincome': 1, 'revenue': 2})
+
+    def test_migrate_statement_cache(self):
+        legacy_key = 'intrinio-statement-AAPL-cash_flow_statement-FY-2017'
+
+        self.test_cache.write(legacy_key, build_statement({'netincome': 1}))
+        self.test_cache.write('intrinio-statement-AAPL-cash_flow_statement-FY-2018', build_statement({'netincome': 2}))
+
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException("Not Found")):
+
+            # legacy entries are migrated when they are read
+            statements = intrinio_data.get_historical_cashflow_stmt('aapl', 2017, 2017, None)
+            self.assertEqual(statements, {2017: {'netincome': 1}})
+            self.assertEqual(self.test_cache.read(legacy_key), None)
+
+            # or all at once
+            self.assertEqual(intrinio_data.migrate_statement_cache(), 1)
+            self.assertEqual(self.test_cache.read('intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018'),
+                             {'netincome': 2})
+            self.assertEqual(self.test_cache.read('intrinio-statement-AAPL-cash_flow_statement-FY-2018'), None)
+
+    def test_historical_cashflow_stmt_no_data_is_cached(self):
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException(status=404, reason="Not Found")) as api:
+
+            hits = intrinio_data.get_api_stats()['no_data_cache_hits']
+
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_cashflow_stmt('aapl', 2018, 2018, None)
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_cashflow_stmt('aapl', 2017, 2018, None)
+
+            # the second call is answered by the cache
+            self.assertEqual(api.call_count, 1)
+            self.assertEqual(intrinio_data.get_api_stats()['no_data_cache_hits'], hits + 1)
+
+    def test_historical_cashflow_stmt_unauthorized_is_not_cached(self):
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                side_effect=ApiException(status=401, reason="Unauthorized")) as api:
+
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_cashflow_stmt('aapl', 2018, 2018, None)
+
+            self.assertEqual(self.test_cache.read('intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018'), None)
+
+        # once the key is fixed, the statement is fetched
+        with api_mock.patch_api('fundamentals_api', 'get_fundamental_standardized_financials',
+                                return_value=build_statement({'netincome': 1})) as api:
+
+            self.assertEqual(intrinio_data.get_historical_cashflow_stmt('aapl', 2018, 2018, None),
+                             {2018: {'netincome': 1}})
+            self.assertEqual(api.call_count, 1)
+
+    def test_historical_revenue_unauthorized_is_not_cached(self):
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=ApiException(status=401, reason="Unauthorized")):
+
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_revenue('AAPL', 2018, 2018)
+
+            self.assertEqual(self.test_cache.read('intrinio-metric-v2-AAPL-yearly-totalrevenue-2018'), None)
+
+    def test_historical_revenue_no_data_is_cached(self):
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                return_value=SimpleNamespace(historical_data=[])) as api:
+
+            for i in range(0, 2):
+                with self.assertRaises(DataError):
+                    intrinio_data.get_historical_revenue('AAPL', 2017, 2018)
+
+            self.assertEqual(api.call_count, 1)
+
+            # no data entries expire
+            with patch.object(intrinio_data.settings, 'no_data_cache_ttl_seconds', new=0):
+                with self.assertRaises(DataError):
+                    intrinio_data.get_historical_revenue('AAPL', 2019, 2019)
+                with self.assertRaises(DataError):
+                    intrinio_data.get_historical_revenue('AAPL', 2019, 2019)
+
+            self.assertEqual(api.call_count, 3)
+
+    def test_historical_revenue_throttling_is_not_cached(self):
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=ApiException(status=429)), \
+             patch.object(intrinio_data, 'rate_limiter',
+                          new=RateLimiter(1000, intrinio_data.__classify_api_error__, base_delay=0)):
+
+            with self.assertRaises(DataError):
+                intrinio_data.get_historical_revenue('AAPL', 2018, 2018)
+
+            self.assertEqual(self.test_cache.read('intrinio-metric-v2-AAPL-yearly-totalrevenue-2018'), None)
+
+    def test_daily_stock_prices_paginated_and_incremental(self):
+        def get_stock_prices(ticker, start_date, end_date, frequency, page_size, next_page):
+            # returns one price per page, for every day in the range
+            date = datetime.datetime.strptime(next_page if next_page else start_date, "%Y-%m-%d").date()
+            following_date = date + datetime.timedelta(days=1)
+
+            return SimpleNamespace(
+                stock_prices=[SimpleNamespace(date=date, close=float(date.day))],
+                next_page=str(following_date) if str(following_date) <= end_date else None
+            )
+
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=get_stock_prices) as api:
+
+            prices = intrinio_data.get_daily_stock_close_prices('AAPL', datetime.date(2019, 10, 1), datetime.date(2019, 10, 5))
+            self.assertEqual(prices, {'2019-10-01': 1, '2019-10-02': 2, '2019-10-03': 3, '2019-10-04': 4, '2019-10-05': 5})
+            self.assertEqual(api.call_count, 5)
+
+            # cached range is not fetched again
+            prices = intrinio_data.get_daily_stock_close_prices('AAPL', datetime.date(2019, 10, 2), datetime.date(2019, 10, 3))
+            self.assertEqual(prices, {'2019-10-02': 2, '2019-10-03': 3})
+            self.assertEqual(api.call_count, 5)
+
+            # only the dates after the last cached one are fetched
+            prices = intrinio_data.get_daily_stock_close_prices('AAPL', datetime.date(2019, 10, 3), datetime.date(2019, 10, 7))
+            self.assertEqual(prices, {'2019-10-03': 3, '2019-10-04': 4, '2019-10-05': 5, '2019-10-06': 6, '2019-10-07': 7})
+            self.assertEqual(api.call_count, 7)
+            api.assert_any_call('AAPL', start_date='2019-10-06', end_date='2019-10-07', frequency='daily',
+                                page_size=intrinio_data.PRICE_PAGE_SIZE, next_page='')
+
+            # evicted prices are fetched again
+            self.test_cache.delete('intrinio-price-v1-AAPL-2019-10-04')
+            prices = intrinio_data.get_daily_stock_close_prices('AAPL', datetime.date(2019, 10, 1), datetime.date(2019, 10, 7))
+            self.assertEqual(len(prices), 7)
+            self.assertEqual(api.call_count, 8)
+
+    def test_daily_stock_prices_current_day(self):
+        today = datetime.date.today()
+        five_days_ago = today - datetime.timedelta(days=5)
+
+        def get_stock_prices(ticker, start_date, end_date, frequency, page_size, next_page):
+            start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+            end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+
+            return SimpleNamespace(stock_prices=[
+                SimpleNamespace(date=start + datetime.timedelta(days=i), close=100.0)
+                for i in range(0, (end - start).days + 1)
+            ], next_page=None)
+
+        with api_mock.patch_api('security_api', 'get_security_stock_prices',
+                                side_effect=get_stock_prices) as api:
+
+            intrinio_data.get_daily_stock_close_prices('AAPL', five_days_ago, today)
+            self.assertEqual(api.call_count, 1)
+
+            # the current day was fetched recently, and isn't fetched again
+            for i in range(0, 2):
+                prices = intrinio_data.get_daily_stock_close_prices('AAPL', five_days_ago, today)
+                self.assertEqual(len(prices), 6)
+            self.assertEqual(api.call_count, 1)
+
+            # until the recent prices expire
+            self.test_cache.delete('intrinio-price-v1-AAPL-recent')
+            intrinio_data.get_daily_stock_close_prices('AAPL', five_days_ago, today)
+            self.assertEqual(api.call_count, 2)
+            api.assert_called_with('AAPL', start_date=str(today), end_date=str(today), frequency='daily',
+                                   page_size=intrinio_data.PRICE_PAGE_SIZE, next_page='')
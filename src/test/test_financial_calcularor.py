@@ -1,10 +1,12 @@
 import unittest
+import random
 from unittest.mock import patch
 from intrinio_sdk.rest import ApiException
 from exception.exceptions import ValidationError
 from exception.exceptions import DataError
 from exception.exceptions import CalculationError
 from data_provider import intrinio_data
+from test import api_mock
 from financial import calculator
 
 
@@ -15,8 +17,8 @@ class TestFinancialCalculator(unittest.TestCase):
     '''
 
     def test_get_graham_number_with_exception(self):
-        with patch.object(intrinio_data.company_api, 'get_company_historical_data',
-                          side_effect=ApiException("Not Found")):
+        with api_mock.patch_api('company_api', 'get_company_historical_data',
+                                side_effect=ApiException("Not Found")):
             with self.assertRaises(DataError):
                 calculator.calc_graham_number(
                     'NON-EXISTENT-TICKER', 2018)
@@ -139,3 +141,48 @@ class TestFinancialCalculator(unittest.TestCase):
 
     
 
+    def test_dcf_vectorized_matches_scalar(self):
+        random.seed(1)
+
+        fcfe_forecasts = [[random.uniform(-1e10, 1e11) for year in range(0, 5)] for security in range(0, 200)]
+        discount_rates = [random.uniform(0.05, 0.15) for security in range(0, 200)]
+        long_term_growth_rates = [random.uniform(0.001, 0.049) for security in range(0, 200)]
+
+        (enterprise_values, intermediate_results) = calculator.calc_enterprise_values(
+            fcfe_forecasts, long_term_growth_rates, discount_rates)
+
+        for i in range(0, 200):
+            (enterprise_value, scalar_results) = calculator.calc_enterprise_value(
+                dict(zip(range(2019, 2024), fcfe_forecasts[i])), long_term_growth_rates[i], discount_rates[i])
+
+            self.assertAlmostEqual(enterprise_values[i], enterprise_value, delta=abs(enterprise_value) * 1e-12)
+            self.assertAlmostEqual(intermediate_results['terminal_value'][i], scalar_results['terminal_value'],
+                                   delta=abs(scalar_results['terminal_value']) * 1e-12)
+
+            for (value, scalar_value) in zip(intermediate_results['discounted_cashflows'][i],
+                                             scalar_results['discounted_cashflows'].values()):
+                self.assertAlmostEqual(value, scalar_value, delta=abs(scalar_value) * 1e-12)
+
+    def test_dcf_vectorized_shared_rates(self):
+        (enterprise_values, x) = calculator.calc_enterprise_values([[100, 100], [100, 100]], 0.5, 1)
+        self.assertEqual(list(enterprise_values), [125, 125])
+
+    def test_dcf_vectorized_invalid_parameters(self):
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values(None, 0.03, 0.0975)
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([], 0.03, 0.0975)
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([100, 100], 0.03, 0.0975)
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([[100], [100]], [0.03, 0], 0.0975)
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([[100], [100]], 0.03, [0.0975, 0])
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([[100], [100]], 0.03, [0.0975, 0.1, 0.1])
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([[100], [100]], 0.03, float('nan'))
+
+    def test_dcf_vectorized_same_growth_discount(self):
+        with self.assertRaises(CalculationError):
+            calculator.calc_enterprise_values([[100], [100]], [0.03, 1], [0.0975, 1])
@@ -0,0 +1,86 @@
+import unittest
+import pickle
+import struct
+from support import cache_codec
+from support.cache_codec import CacheCodec
+from exception.exceptions import ValidationError
+
+
+class TestCacheCodec(unittest.TestCase):
+
+    statement = {
+        'netincome': 59531000000.0,
+        'netcashfromcontinuingoperatingactivities': 77434000000.0,
+        'purchaseofplantpropertyandequipment': -13313000000.0
+    }
+
+    price_index = {
+        'start_date': '2019-01-02',
+        'end_date': '2019-01-04',
+        'dates': ['2019-01-02', '2019-01-03', '2019-01-04']
+    }
+
+    def assert_round_trip(self, codec, value, value_type):
+        encoded = codec.encode(value)
+
+        self.assertTrue(cache_codec.is_encoded(encoded))
+        self.assertEqual(encoded[4], value_type)
+
+        decoded = cache_codec.decode(encoded)
+        self.assertEqual(decoded, value)
+        self.assertEqual(type(decoded), type(value))
+
+    def test_round_trip(self):
+        for compression in ['zlib', 'none']:
+            codec = CacheCodec(compression)
+
+            self.assert_round_trip(codec, 123.45, cache_codec.TYPE_FLOAT)
+            self.assert_round_trip(codec, self.statement, cache_codec.TYPE_FLOAT_DICT)
+            self.assert_round_trip(codec, self.price_index, cache_codec.TYPE_PRICE_INDEX)
+            self.assert_round_trip(codec, {}, cache_codec.TYPE_PICKLE)
+            self.assert_round_trip(codec, 1234, cache_codec.TYPE_PICKLE)
+            self.assert_round_trip(codec, "value", cache_codec.TYPE_PICKLE)
+            self.assert_round_trip(codec, {'netincome': 1}, cache_codec.TYPE_PICKLE)
+            self.assert_round_trip(codec, b'\xfcF', cache_codec.TYPE_PICKLE)
+
+    def test_non_canonical_price_index(self):
+        price_index = {'start_date': '2019-1-2', 'end_date': '2019-01-02', 'dates': ['2019-01-02']}
+        self.assert_round_trip(CacheCodec(), price_index, cache_codec.TYPE_PICKLE)
+
+    def test_compression(self):
+        statement = {'tag%d' % i: 1.0 for i in range(0, 100)}
+
+        compressed = CacheCodec('zlib').encode(statement)
+        uncompressed = CacheCodec('none').encode(statement)
+
+        self.assertEqual(compressed[3], cache_codec.COMPRESSION_ZLIB)
+        self.assertEqual(uncompressed[3], cache_codec.COMPRESSION_NONE)
+        self.assertLess(len(compressed), len(uncompressed))
+        self.assertEqual(cache_codec.decode(compressed), statement)
+
+    def test_small_values_not_compressed(self):
+        self.assertEqual(CacheCodec('zlib').encode(1.0)[3], cache_codec.COMPRESSION_NONE)
+
+    def test_smaller_than_pickle(self):
+        encoded = CacheCodec().encode(self.statement)
+        self.assertLess(len(encoded), len(pickle.dumps(self.statement, pickle.HIGHEST_PROTOCOL)))
+
+    def test_legacy_value(self):
+        self.assertEqual(cache_codec.decode(self.statement), self.statement)
+        self.assertEqual(cache_codec.decode(b'raw bytes'), b'raw bytes')
+        self.assertEqual(cache_codec.decode(None), None)
+
+    def test_unsupported_version(self):
+        encoded = struct.pack('<2sBBB', cache_codec.MAGIC, cache_codec.FORMAT_VERSION + 1, 0, 0)
+
+        with self.assertRaises(ValidationError):
+            cache_codec.decode(encoded + pickle.dumps(1))
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValidationError):
+            CacheCodec('BAD_VALUE')
+
+    @unittest.skipIf(cache_codec.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        self.assert_round_trip(CacheCodec('zstd'), {'tag%d' % i: 1.0 for i in range(0, 100)},
+                               cache_codec.TYPE_FLOAT_DICT)
@@ -1,6 +1,11 @@
 import unittest
+import os
 import shutil
-from support.financial_cache import FinancialCache
+import threading
+from contextlib import ExitStack
+from unittest.mock import patch
+from support.financial_cache import FinancialCache, MemoryCache, ShardedDiskCache, ticker_shard_key, parse_expiry_policy
+from support import instrumentation
 from exception.exceptions import ValidationError, FileSystemError
 
 
@@ -76,6 +81,152 @@ class TestFinancialCache(unittest.TestCase):
         self.assertEqual(self.test_cache.read(key)["b"], 2)
 
     
+    def test_expire(self):
+        key = 'test-expire'
+
+        self.test_cache.write(key, 1234, expire=60)
+        self.assertEqual(self.test_cache.read(key), 1234)
+
+        self.test_cache.write(key, 1234, expire=0)
+        self.assertEqual(self.test_cache.read(key), None)
+
+    def test_read_write_many(self):
+        values = {'test-many-%d' % i: i for i in range(0, 5)}
+
+        self.test_cache.write_many(values)
+        self.test_cache.memory_cache.clear()
+
+        # read some keys from memory and the others from disk
+        self.assertEqual(self.test_cache.read('test-many-0'), 0)
+
+        read_values = self.test_cache.read_many(list(values.keys()) + ['test-many-missing'])
+
+        expected_values = dict(values)
+        expected_values['test-many-missing'] = None
+        self.assertEqual(read_values, expected_values)
+
+        self.assertEqual(self.test_cache.read_many([]), {})
+        self.test_cache.write_many({})
+
+    def test_write_many_expire(self):
+        self.test_cache.write_many({'test-many-expire-1': 1, 'test-many-expire-2': 2}, expire=0)
+        self.assertEqual(self.test_cache.read_many(['test-many-expire-1', 'test-many-expire-2']),
+                         {'test-many-expire-1': None, 'test-many-expire-2': None})
+
+    def test_write_many_rollback(self):
+        with self.assertRaises(Exception):
+            # a value that can't be encoded fails the whole batch
+            self.test_cache.write_many({'test-many-rollback-1': 1, 'test-many-rollback-2': threading.Lock()})
+
+        self.assertEqual(self.test_cache.read('test-many-rollback-1'), None)
+
+    def test_expiry_policy(self):
+        policy_cache_path = "./test/cache-unittest-policy/"
+
+        policy_cache = FinancialCache(policy_cache_path, expiry_policy={'test-expiring': 0, 'test-class': 0})
+
+        try:
+            policy_cache.write('test-expiring-key', 1234)
+            self.assertEqual(policy_cache.read('test-expiring-key'), None)
+
+            # explicit expiration overrides the policy
+            policy_cache.write('test-expiring-key', 1234, expire=60)
+            self.assertEqual(policy_cache.read('test-expiring-key'), 1234)
+
+            # the data class overrides the prefix of the key
+            policy_cache.write('test-other-key', 1234, data_class='test-class')
+            self.assertEqual(policy_cache.read('test-other-key'), None)
+
+            policy_cache.write('test-other-key', 1234)
+            self.assertEqual(policy_cache.read('test-other-key'), 1234)
+
+            self.assertEqual(policy_cache.get_expiry('intrinio-statement'), None)
+            self.assertEqual(policy_cache.get_expiry('intrinio-price-index'), None)
+            self.assertGreater(policy_cache.get_expiry('intrinio-price'), 0)
+
+            policy_cache.set_expiry('test-class', None)
+            policy_cache.write('test-other-key', 1234, data_class='test-class')
+            self.assertEqual(policy_cache.read('test-other-key'), 1234)
+        finally:
+            policy_cache.close()
+            shutil.rmtree(policy_cache_path)
+
+    def test_parse_expiry_policy(self):
+        self.assertEqual(parse_expiry_policy('intrinio-price=86400, intrinio-metric=never'),
+                         {'intrinio-price': 86400, 'intrinio-metric': None})
+        self.assertEqual(parse_expiry_policy(None), {})
+        self.assertEqual(parse_expiry_policy(''), {})
+
+        with self.assertRaises(ValidationError):
+            parse_expiry_policy('intrinio-price')
+
+        with self.assertRaises(ValidationError):
+            parse_expiry_policy('intrinio-price=BAD_VALUE')
+
+    def test_refresh_expiring(self):
+        refresh_cache_path = "./test/cache-unittest-refresh/"
+
+        refresh_cache = FinancialCache(refresh_cache_path, expiry_policy={'test-refresh': 60})
+        refreshed_keys = []
+
+        def refresh(key, value):
+            refreshed_keys.append(key)
+            return value + 1
+
+        try:
+            refresh_cache.register_refresh_handler('test-refresh-', lambda key, value: None)
+            refresh_cache.register_refresh_handler('test-refresh-hot-', refresh)
+
+            refresh_cache.write('test-refresh-hot-1', 1)
+            refresh_cache.write('test-refresh-cold-1', 1)
+            refresh_cache.write('test-refresh-hot-2', 1, expire=3600)
+            refresh_cache.write('test-never-1', 1, expire=None)
+
+            # nothing expires within 10 seconds
+            self.assertEqual(refresh_cache.refresh_expiring(10), 0)
+
+            # only the keys with a handler returning a value are renewed
+            self.assertEqual(refresh_cache.refresh_expiring(120), 1)
+            self.assertEqual(refreshed_keys, ['test-refresh-hot-1'])
+            self.assertEqual(refresh_cache.read('test-refresh-hot-1'), 2)
+            self.assertEqual(refresh_cache.read('test-refresh-cold-1'), 1)
+        finally:
+            refresh_cache.close()
+            shutil.rmtree(refresh_cache_path)
+
+    def test_refresher_thread(self):
+        refresh_cache_path = "./test/cache-unittest-refresher/"
+
+        refresh_cache = FinancialCache(refresh_cache_path, expiry_policy={'test-refresh': 60})
+        refreshed = threading.Event()
+
+        def refresh(key, value):
+            refreshed.set()
+            return value
+
+        try:
+            refresh_cache.register_refresh_handler('test-refresh-', refresh)
+            refresh_cache.write('test-refresh-1', 1)
+
+            refresh_cache.start_refresher(interval_seconds=0.01, window_seconds=120)
+            self.assertTrue(refreshed.wait(5))
+
+            refresh_cache.stop_refresher()
+            self.assertEqual(refresh_cache.refresher, None)
+        finally:
+            refresh_cache.close()
+            shutil.rmtree(refresh_cache_path)
+
+    def test_delete(self):
+        key = 'test-delete'
+
+        self.test_cache.write(key, 1234)
+        self.assertTrue(key in list(self.test_cache.iterkeys()))
+
+        self.assertTrue(self.test_cache.delete(key))
+        self.assertFalse(self.test_cache.delete(key))
+        self.assertEqual(self.test_cache.read(key), None)
+
     def test_value_not_found(self):
         key = 'not-found'
         self.assertEqual(self.test_cache.read(key), None)
@@ -88,8 +239,8 @@ class TestFinancialCache(unittest.TestCase):
     def test_cache_out_of_space(self):
 
         small_cache_path = "./test/cache-unittest-small/"
-        test_string = "x"
-        for i in range(0, 10 * 1000): test_string += "x"
+        # random content, so that it can't be compressed below the cache size
+        test_string = os.urandom(10 * 1000).hex()
 
         small_test_cache = FinancialCache(small_cache_path, max_cache_size_bytes=100)
 
@@ -99,6 +250,245 @@ class TestFinancialCache(unittest.TestCase):
 
         finally:
             shutil.rmtree(small_cache_path)
-        
-        
 
+    def test_legacy_value(self):
+        key = 'test-legacy'
+        value = {'netincome': 1.0}
+
+        # written by an older version, as a plain pickle
+        self.test_cache.cache.set(key, value)
+        self.test_cache.memory_cache.clear()
+
+        self.assertEqual(self.test_cache.read(key), value)
+
+    def test_encoded_value(self):
+        key = 'test-encoded'
+        value = {'netincome': 1.0}
+
+        self.test_cache.write(key, value)
+        self.assertEqual(self.test_cache.cache.get(key), self.test_cache.codec.encode(value))
+
+        self.test_cache.memory_cache.clear()
+        self.assertEqual(self.test_cache.read(key), value)
+
+    def test_bad_cache_backend(self):
+        bad_cache_path = "./test/cache-unittest-bad/"
+        with self.assertRaises(ValidationError):
+            FinancialCache(bad_cache_path, backend="BAD_VALUE")
+
+    def test_bad_shards(self):
+        bad_cache_path = "./test/cache-unittest-bad/"
+        with self.assertRaises(ValidationError):
+            FinancialCache(bad_cache_path, backend="sharded", shards=-1)
+
+    def test_sharded_backend(self):
+        sharded_cache_path = "./test/cache-unittest-sharded/"
+
+        sharded_cache = FinancialCache(sharded_cache_path, backend="sharded", shards=4, memory_max_entries=0)
+
+        try:
+            self.assertEqual(sharded_cache.backend, 'sharded')
+            self.assertEqual(len(sharded_cache.cache.shards), 4)
+
+            keys = ['intrinio-statement-v2-%s-cash_flow_statement-FY-2018' % ticker
+                    for ticker in ['AAPL', 'MSFT', 'GE', 'IBM', 'T', 'F']]
+
+            with sharded_cache.transaction():
+                for key in keys:
+                    sharded_cache.write(key, {'netincome': 1.0})
+                sharded_cache.write('test-key', 1234)
+
+            for key in keys:
+                self.assertEqual(sharded_cache.read(key), {'netincome': 1.0})
+            self.assertEqual(sharded_cache.read('test-key'), 1234)
+            self.assertEqual(sorted(sharded_cache.iterkeys()), sorted(keys + ['test-key']))
+
+            sharded_cache.delete('test-key')
+            self.assertEqual(sharded_cache.read('test-key'), None)
+        finally:
+            sharded_cache.close()
+
+        # the layout of an existing cache is detected when it's reopened
+        sharded_cache = FinancialCache(sharded_cache_path, memory_max_entries=0)
+
+        try:
+            self.assertEqual(sharded_cache.backend, 'sharded')
+            self.assertEqual(len(sharded_cache.cache.shards), 4)
+            self.assertEqual(sharded_cache.read(keys[0]), {'netincome': 1.0})
+        finally:
+            sharded_cache.close()
+            shutil.rmtree(sharded_cache_path)
+
+    def test_mismatched_layout(self):
+        sharded_cache_path = "./test/cache-unittest-sharded/"
+        disk_cache_path = "./test/cache-unittest-disk/"
+
+        FinancialCache(sharded_cache_path, backend="sharded", shards=4).close()
+        FinancialCache(disk_cache_path, backend="disk").close()
+
+        try:
+            with self.assertRaises(ValidationError):
+                FinancialCache(sharded_cache_path, backend="sharded", shards=2)
+            with self.assertRaises(ValidationError):
+                FinancialCache(sharded_cache_path, backend="disk")
+            with self.assertRaises(ValidationError):
+                FinancialCache(disk_cache_path, backend="sharded")
+
+            # the same layout can be requested explicitly
+            FinancialCache(sharded_cache_path, backend="sharded", shards=4).close()
+            FinancialCache(disk_cache_path, backend="disk").close()
+
+            self.assertEqual(ShardedDiskCache.count_shards(sharded_cache_path), 4)
+        finally:
+            shutil.rmtree(sharded_cache_path)
+            shutil.rmtree(disk_cache_path)
+
+    def test_sharded_transaction_rollback(self):
+        sharded_cache_path = "./test/cache-unittest-sharded-rollback/"
+
+        sharded_cache = FinancialCache(sharded_cache_path, backend="sharded", shards=2, memory_max_entries=0)
+
+        try:
+            with self.assertRaises(Exception):
+                with sharded_cache.transaction():
+                    sharded_cache.write('intrinio-price-v1-AAPL-2019-10-01', 1.0)
+                    sharded_cache.write('intrinio-price-v1-MSFT-2019-10-01', 2.0)
+                    raise Exception("rollback")
+
+            self.assertEqual(sharded_cache.read('intrinio-price-v1-AAPL-2019-10-01'), None)
+            self.assertEqual(sharded_cache.read('intrinio-price-v1-MSFT-2019-10-01'), None)
+        finally:
+            sharded_cache.close()
+            shutil.rmtree(sharded_cache_path)
+
+    def test_sharded_write_many_locks_its_shards(self):
+        sharded_cache_path = "./test/cache-unittest-sharded-write-many/"
+
+        sharded_cache = FinancialCache(sharded_cache_path, backend="sharded", shards=4, memory_max_entries=0)
+
+        try:
+            shards = sharded_cache.cache.shards
+            aapl_shard = sharded_cache.cache.__shard__('intrinio-price-v1-AAPL-2019-10-01')
+
+            with ExitStack() as stack:
+                transacts = [stack.enter_context(patch.object(shard, 'transact', wraps=shard.transact))
+                             for shard in shards]
+
+                sharded_cache.write_many({'intrinio-price-v1-AAPL-2019-10-01': 1.0,
+                                          'intrinio-price-v1-AAPL-2019-10-02': 2.0})
+
+                self.assertEqual([transact.call_count for transact in transacts],
+                                 [1 if shard is aapl_shard else 0 for shard in shards])
+
+                # a transaction without keys locks every shard
+                with sharded_cache.transaction():
+                    pass
+
+                self.assertEqual([transact.call_count for transact in transacts],
+                                 [2 if shard is aapl_shard else 1 for shard in shards])
+
+            self.assertEqual(sharded_cache.read('intrinio-price-v1-AAPL-2019-10-02'), 2.0)
+        finally:
+            sharded_cache.close()
+            shutil.rmtree(sharded_cache_path)
+
+    def test_ticker_shard_key(self):
+        self.assertEqual(ticker_shard_key('intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018'), 'AAPL')
+        self.assertEqual(ticker_shard_key('intrinio-price-v1-AAPL-index'), 'AAPL')
+        self.assertEqual(ticker_shard_key('test-key'), 'test-key')
+
+    def test_memory_tier_stats(self):
+        memory_cache_path = "./test/cache-unittest-memory/"
+        memory_test_cache = FinancialCache(memory_cache_path)
+
+        try:
+            memory_test_cache.write("test-key", 1234)
+            self.assertEqual(memory_test_cache.read("test-key"), 1234)
+            self.assertEqual(memory_test_cache.get_stats(),
+                             {'memory_hits': 1, 'memory_misses': 0, 'disk_hits': 0, 'disk_misses': 0})
+
+            # objects that are only on disk are promoted to memory
+            memory_test_cache.memory_cache.clear()
+            self.assertEqual(memory_test_cache.read("test-key"), 1234)
+            self.assertEqual(memory_test_cache.read("test-key"), 1234)
+            self.assertEqual(memory_test_cache.read("not-found"), None)
+
+            self.assertEqual(memory_test_cache.get_stats(),
+                             {'memory_hits': 2, 'memory_misses': 2, 'disk_hits': 1, 'disk_misses': 1})
+        finally:
+            memory_test_cache.close()
+            shutil.rmtree(memory_cache_path)
+
+    def test_prefix_counters(self):
+        instrumentation.reset()
+
+        self.test_cache.write("prefix-test-1", 1234)
+        self.test_cache.read("prefix-test-1")
+        self.test_cache.read("prefix-test-2")
+
+        counters = instrumentation.get_stats()['counters']['prefix-test']
+        self.assertEqual(counters['writes'], 1)
+        self.assertEqual(counters['hits'], 1)
+        self.assertEqual(counters['misses'], 1)
+        self.assertGreater(counters['bytes_written'], 0)
+
+        instrumentation.reset()
+
+    def test_memory_tier_disabled(self):
+        memory_cache_path = "./test/cache-unittest-memory/"
+        memory_test_cache = FinancialCache(memory_cache_path, memory_max_entries=0)
+
+        try:
+            memory_test_cache.write("test-key", 1234)
+            self.assertEqual(memory_test_cache.read("test-key"), 1234)
+            self.assertEqual(memory_test_cache.get_stats()['disk_hits'], 1)
+        finally:
+            memory_test_cache.close()
+            shutil.rmtree(memory_cache_path)
+
+    def test_memory_cache_entry_limit(self):
+        memory_cache = MemoryCache(2, 1e6)
+
+        memory_cache.set('a', 1, None, 10)
+        memory_cache.set('b', 2, None, 10)
+        memory_cache.get('a')
+        memory_cache.set('c', 3, None, 10)
+
+        # 'b' is the least recently used
+        self.assertEqual(memory_cache.get('a'), 1)
+        self.assertEqual(memory_cache.get('b'), None)
+        self.assertEqual(memory_cache.get('c'), 3)
+
+    def test_memory_cache_byte_limit(self):
+        memory_cache = MemoryCache(100, 250)
+
+        memory_cache.set('a', 'x' * 100, None, 100)
+        memory_cache.set('b', 'x' * 100, None, 100)
+        memory_cache.set('c', 'x' * 1000, None, 1000)
+
+        self.assertEqual(memory_cache.get('c'), None)
+        self.assertEqual(len(memory_cache.entries), 2)
+
+        memory_cache.set('c', 'x' * 100, None, 100)
+        self.assertEqual(memory_cache.get('a'), None)
+        self.assertLessEqual(memory_cache.size_bytes, 250)
+
+    def test_memory_cache_concurrent_access(self):
+        memory_cache = MemoryCache(50, 1e6)
+        errors = []
+
+        def access(thread_id):
+            try:
+                for i in range(0, 1000):
+                    memory_cache.set('key-%d' % (i % 100), thread_id, None, 8)
+                    memory_cache.get('key-%d' % ((i + 50) % 100))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=access, args=(i,)) for i in range(0, 8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(memory_cache.entries), 50)
+        self.assertEqual(memory_cache.size_bytes, sum(entry[1] for entry in memory_cache.entries.values()))
@@ -0,0 +1,63 @@
+import unittest
+import json
+import os
+from support import instrumentation
+from support.instrumentation import Histogram
+from exception.exceptions import FileSystemError
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.reset()
+
+    def test_key_prefix(self):
+        self.assertEqual(instrumentation.key_prefix('intrinio-statement-v2-AAPL-cash_flow_statement-FY-2018'), 'intrinio-statement')
+        self.assertEqual(instrumentation.key_prefix('intrinio-price-v1-AAPL-2019-10-01'), 'intrinio-price')
+        self.assertEqual(instrumentation.key_prefix('test'), 'test')
+
+    def test_counters(self):
+        instrumentation.increment('intrinio-metric', 'hits')
+        instrumentation.increment('intrinio-metric', 'hits')
+        instrumentation.increment('intrinio-metric', 'bytes_read', 100)
+
+        self.assertEqual(instrumentation.get_stats()['counters'],
+                         {'intrinio-metric': {'hits': 2, 'bytes_read': 100}})
+
+    def test_histogram(self):
+        histogram = Histogram()
+
+        for i in range(0, 99):
+            histogram.observe(0.001)
+        histogram.observe(1)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertLessEqual(histogram.percentile(50), 0.002)
+        self.assertGreaterEqual(histogram.percentile(50), 0.001)
+        self.assertEqual(histogram.percentile(100), 1)
+        self.assertAlmostEqual(histogram.to_dict()['mean_seconds'], (0.099 + 1) / 100)
+
+    def test_timer_and_summary(self):
+        with instrumentation.timer('api_call.test'):
+            pass
+
+        stats = instrumentation.get_stats()
+        self.assertEqual(stats['histograms']['api_call.test']['count'], 1)
+        self.assertTrue(instrumentation.format_summary().startswith('api_call.test: count=1'))
+
+    def test_dump_json(self):
+        file_name = './test/stats-unittest.json'
+        instrumentation.increment('intrinio-price', 'misses')
+
+        try:
+            instrumentation.dump_json(file_name)
+            with open(file_name) as f:
+                self.assertEqual(json.load(f)['counters'], {'intrinio-price': {'misses': 1}})
+        finally:
+            os.remove(file_name)
+
+        with self.assertRaises(FileSystemError):
+            instrumentation.dump_json('./test/non-existent-directory/stats.json')
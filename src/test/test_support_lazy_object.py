@@ -0,0 +1,58 @@
+import unittest
+import threading
+from unittest.mock import patch
+from types import SimpleNamespace
+from support.lazy_object import LazyObject
+
+
+class TestLazyObject(unittest.TestCase):
+
+    def test_created_on_first_use(self):
+        created = []
+
+        def create():
+            created.append(1)
+            return SimpleNamespace(value=1234, read=lambda key: key)
+
+        lazy_object = LazyObject(create)
+
+        self.assertFalse(lazy_object.is_initialized())
+        self.assertEqual(created, [])
+
+        self.assertEqual(lazy_object.value, 1234)
+        self.assertEqual(lazy_object.read('key'), 'key')
+        self.assertTrue(lazy_object.is_initialized())
+        self.assertEqual(created, [1])
+
+    def test_created_once(self):
+        created = []
+        lock = threading.Lock()
+
+        def create():
+            with lock:
+                created.append(1)
+            return SimpleNamespace(value=1234)
+
+        lazy_object = LazyObject(create)
+
+        threads = [threading.Thread(target=lambda: lazy_object.value) for i in range(0, 8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(created, [1])
+
+    def test_creation_error(self):
+        lazy_object = LazyObject(lambda: 1 / 0)
+
+        with self.assertRaises(ZeroDivisionError):
+            lazy_object.value
+
+        self.assertFalse(lazy_object.is_initialized())
+
+    def test_patch(self):
+        lazy_object = LazyObject(lambda: SimpleNamespace(read=lambda key: key))
+
+        with patch.object(lazy_object, 'read', return_value='patched'):
+            self.assertEqual(lazy_object.read('key'), 'patched')
+
+        self.assertEqual(lazy_object.read('key'), 'key')
@@ -0,0 +1,67 @@
+import unittest
+import time
+from unittest.mock import Mock
+from support.rate_limiter import RateLimiter
+from exception.exceptions import ValidationError
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    @staticmethod
+    def classify(e):
+        if isinstance(e, TimeoutError):
+            return RateLimiter.THROTTLED
+        if isinstance(e, ConnectionError):
+            return RateLimiter.TRANSIENT
+        return None
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValidationError):
+            RateLimiter(0, self.classify)
+
+        with self.assertRaises(ValidationError):
+            RateLimiter("BAD_VALUE", self.classify)
+
+    def test_retry_until_success(self):
+        rate_limiter = RateLimiter(1000, self.classify, base_delay=0)
+        fn = Mock(side_effect=[TimeoutError(), ConnectionError(), 'value'])
+
+        self.assertEqual(rate_limiter.call(fn, 'a', b='b'), 'value')
+        self.assertEqual(fn.call_count, 3)
+        fn.assert_called_with('a', b='b')
+
+        stats = rate_limiter.get_stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['throttles'], 1)
+        self.assertEqual(stats['retries'], 2)
+
+    def test_retries_exhausted(self):
+        rate_limiter = RateLimiter(1000, self.classify, base_delay=0, max_retries=2)
+        fn = Mock(side_effect=TimeoutError())
+
+        with self.assertRaises(TimeoutError):
+            rate_limiter.call(fn)
+
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(rate_limiter.get_stats()['throttles'], 3)
+
+    def test_no_retry(self):
+        rate_limiter = RateLimiter(1000, self.classify, base_delay=0)
+        fn = Mock(side_effect=KeyError())
+
+        with self.assertRaises(KeyError):
+            rate_limiter.call(fn)
+
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(rate_limiter.get_stats()['retries'], 0)
+
+    def test_rate_is_limited(self):
+        rate_limiter = RateLimiter(50, self.classify, burst=1)
+
+        start = time.monotonic()
+        for i in range(0, 6):
+            rate_limiter.call(lambda: None)
+
+        # the first call uses the available token, the next 5 wait 1/50 seconds each
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(rate_limiter.get_stats()['rate_limited_waits'], 5)
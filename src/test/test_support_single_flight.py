@@ -0,0 +1,108 @@
+import unittest
+import threading
+from support.single_flight import SingleFlight
+from exception.exceptions import DataError
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, single_flight, key, fn, callers):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(single_flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for i in range(0, callers)]
+        for t in threads: t.start()
+        for t in threads: t.join(5)
+
+        return (results, errors)
+
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        call_count = []
+
+        def fn():
+            call_count.append(1)
+            release.wait(5)
+            return 'value'
+
+        # hold the leader until all the callers are waiting on it
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+
+        (results, errors) = self.run_concurrently(single_flight, 'key', fn, 5)
+
+        self.assertEqual(len(call_count), 1)
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(errors, [])
+
+    def test_exception_is_shared(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise DataError("test error", None)
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+
+        (results, errors) = self.run_concurrently(single_flight, 'key', fn, 3)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        for e in errors:
+            self.assertIsInstance(e, DataError)
+
+    def test_interrupted_leader(self):
+        single_flight = SingleFlight()
+        leader_started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        class Interrupted(BaseException):
+            pass
+
+        def fn():
+            leader_started.set()
+            release.wait(5)
+            raise Interrupted()
+
+        def leader():
+            try:
+                single_flight.do('key', fn)
+            except BaseException as e:
+                errors.append(e)
+
+        def waiter():
+            try:
+                single_flight.do('key', lambda: 'value')
+            except Exception as e:
+                errors.append(e)
+
+        leader_thread = threading.Thread(target=leader)
+        leader_thread.start()
+        leader_started.wait(5)
+
+        waiter_thread = threading.Thread(target=waiter)
+        waiter_thread.start()
+
+        threading.Timer(0.2, release.set).start()
+        for t in [leader_thread, waiter_thread]: t.join(5)
+
+        # the waiter doesn't receive None, as if the call had succeeded
+        self.assertEqual(sorted(type(e).__name__ for e in errors), ['DataError', 'Interrupted'])
+        self.assertEqual(single_flight.calls, {})
+
+    def test_key_is_released(self):
+        single_flight = SingleFlight()
+
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+        self.assertEqual(single_flight.do('key', lambda: 2), 2)
+        self.assertEqual(single_flight.calls, {})
@@ -1,9 +1,15 @@
 import unittest
+import math
+import shutil
 from exception.exceptions import ValidationError, CalculationError, ReportError
+from valuation_models import base_model
 from valuation_models.jimmy_model import JimmyValuationModel
 from data_provider import intrinio_data
+from financial import calculator
 from unittest.mock import patch
 from support import util
+from support.financial_cache import FinancialCache
+from test.nop import NopCache
 
  
 class TestJimmyModel(unittest.TestCase):
@@ -44,6 +50,16 @@ class TestJimmyModel(unittest.TestCase):
         2018: 500
     }
 
+    test_cache_path = "./test/cache-unittest-model/"
+
+    def setUp(self):
+        # results are not memoized, unless a test says otherwise
+        self.cache_patch = patch.object(base_model, 'cache', new=NopCache())
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
     def test_dcf_no_symbol(self):
         with self.assertRaises(ValidationError):
             dcf_model = JimmyValuationModel(None, 2018)
@@ -74,6 +90,8 @@ class TestJimmyModel(unittest.TestCase):
                 price = dcf_model.calculate_dcf_price()
 
                 self.assertEqual(round(price, 3), 4.618)
+                intrinio_data.get_historical_cashflow_stmt.assert_called_with(
+                    'aapl', 2014, 2018, JimmyValuationModel.CASHFLOW_STATEMENT_TAGS)
             
                 dcf_model.discount_rate = .08
                 price = dcf_model.calculate_dcf_price()
@@ -122,6 +140,293 @@ class TestJimmyModel(unittest.TestCase):
                     dcf_model.calculate_dcf_price()
                 
 
+    def test_sensitivity(self):
+        """
+            Tests that each value of the sensitivity grid matches the
+            DCF price calculated with the same rates, and that the
+            financial data is only read once
+        """
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        with patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                          return_value=self.cashflow_statement), \
+             patch.object(intrinio_data, 'get_historical_revenue',
+                          return_value=self.historical_revenue), \
+             patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                          return_value=1000):
+
+            discount_rates = [0.0975, 0.08, 1]
+            growth_rates = [0.025, 0.05, 0.0975]
+
+            grid = dcf_model.calculate_sensitivity(discount_rates, growth_rates)
+
+            self.assertEqual(grid.shape, (3, 3))
+            intrinio_data.get_historical_cashflow_stmt.assert_called_once()
+
+            for (i, discount_rate) in enumerate(discount_rates):
+                for (j, growth_rate) in enumerate(growth_rates):
+                    if growth_rate >= discount_rate:
+                        self.assertTrue(math.isnan(grid[i, j]))
+                        continue
+
+                    dcf_model.discount_rate = discount_rate
+                    dcf_model.long_term_growth_rate = growth_rate
+
+                    self.assertAlmostEqual(grid[i, j], dcf_model.calculate_dcf_price(), places=9)
+
+            self.assertEqual(round(grid[0, 0], 3), 4.618)
+            self.assertEqual(round(grid[1, 0], 3), 6.208)
+            self.assertEqual(round(grid[2, 0], 3), 0.208)
+
+    def test_sensitivity_invalid_rates(self):
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        with patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                          return_value=self.cashflow_statement), \
+             patch.object(intrinio_data, 'get_historical_revenue',
+                          return_value=self.historical_revenue), \
+             patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                          return_value=1000):
+
+            grid = dcf_model.calculate_sensitivity([0, 0.05], [0, 0.025, 0.05])
+
+            # only 5% discount and 2.5% growth is valid
+            self.assertEqual([math.isnan(value) for value in grid.flatten()],
+                             [True, True, True, True, False, True])
+
+    def patch_consistent_history(self):
+        """
+            Patches intrinio_data with a history whose revenue growth,
+            profit margin and fcfe/ni ratio never change
+        """
+        revenue = {year: 100 * 2 ** (year - 2014) for year in range(2014, 2019)}
+        cashflow_statement = {year: {
+            'netcashfromcontinuingoperatingactivities': revenue[year] * 0.1,
+            'purchaseofplantpropertyandequipment': 0,
+            'netincome': revenue[year] * 0.1
+        } for year in range(2014, 2019)}
+
+        return (patch.object(intrinio_data, 'get_historical_cashflow_stmt', return_value=cashflow_statement),
+                patch.object(intrinio_data, 'get_historical_revenue', return_value=revenue),
+                patch.object(intrinio_data, 'get_outstanding_diluted_shares', return_value=1000))
+
+    def test_simulation_consistent_history(self):
+        """
+            Tests that, when the history never changes and the discount rate
+            is fixed, every scenario has the same price as calculate_dcf_price
+        """
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        (cashflow_patch, revenue_patch, shares_patch) = self.patch_consistent_history()
+
+        with cashflow_patch, revenue_patch, shares_patch, \
+             patch.object(JimmyValuationModel, 'SIMULATION_DISCOUNT_RATE_STDEV', 0):
+
+            price = dcf_model.calculate_dcf_price()
+            results = dcf_model.simulate_dcf_price(1000, seed=1, current_price=price / 2)
+
+            self.assertEqual(results['scenarios'], 1000)
+            self.assertEqual(results['valid_scenarios'], 1000)
+            self.assertAlmostEqual(results['mean'], price, delta=price * 1e-9)
+            for percentile in JimmyValuationModel.SIMULATION_PERCENTILES:
+                self.assertAlmostEqual(results['percentiles'][percentile], price, delta=price * 1e-9)
+            self.assertEqual(results['probability_above_price'], 1)
+
+    def test_simulation_seed(self):
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        with patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                          return_value=self.cashflow_statement), \
+             patch.object(intrinio_data, 'get_historical_revenue',
+                          return_value=self.historical_revenue), \
+             patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                          return_value=1000), \
+             patch.object(JimmyValuationModel, 'SIMULATION_BATCH_SIZE', 300):
+
+            results = dcf_model.simulate_dcf_price(1000, seed=1, current_price=4.618)
+
+            self.assertEqual(results, dcf_model.simulate_dcf_price(1000, seed=1, current_price=4.618))
+            self.assertNotEqual(results, dcf_model.simulate_dcf_price(1000, seed=2, current_price=4.618))
+
+            percentiles = [results['percentiles'][percentile] for percentile in JimmyValuationModel.SIMULATION_PERCENTILES]
+            self.assertEqual(percentiles, sorted(percentiles))
+            self.assertTrue(0 < results['probability_above_price'] < 1)
+
+            self.assertIsNone(dcf_model.simulate_dcf_price(10, seed=1)['probability_above_price'])
+
+    def test_simulation_invalid_parameters(self):
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        (cashflow_patch, revenue_patch, shares_patch) = self.patch_consistent_history()
+
+        with cashflow_patch, revenue_patch, shares_patch, \
+             patch.object(JimmyValuationModel, 'SIMULATION_DISCOUNT_RATE_STDEV', 0):
+            with self.assertRaises(ValidationError):
+                dcf_model.simulate_dcf_price(0)
+
+            dcf_model.calculate_dcf_price()
+
+            with self.assertRaises(CalculationError):
+                dcf_model.discount_rate = 0.01
+                dcf_model.simulate_dcf_price(1000, seed=1)
+
+    def test_memoized_estimates(self):
+        """
+            Tests that the estimates of a model with unchanged financial data
+            are memoized, that changing the rates doesn't write to the cache,
+            and that changing the financial data results in new estimates
+        """
+        test_cache = FinancialCache(self.test_cache_path)
+
+        historical_revenue = dict(self.historical_revenue)
+
+        def memoized_keys():
+            return [key for key in test_cache.iterkeys() if key.startswith(base_model.RESULT_CACHE_PREFIX)]
+
+        try:
+            with patch.object(base_model, 'cache', new=test_cache), \
+                 patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                              return_value=self.cashflow_statement), \
+                 patch.object(intrinio_data, 'get_historical_revenue',
+                              return_value=historical_revenue), \
+                 patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                              return_value=1000), \
+                 patch.object(JimmyValuationModel, '__estimate_ratios__', autospec=True,
+                              side_effect=JimmyValuationModel.__estimate_ratios__) as estimate_ratios:
+
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                price = dcf_model.calculate_dcf_price()
+                results = dcf_model.get_itermediate_results()
+
+                # unchanged inputs
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                self.assertEqual(dcf_model.calculate_dcf_price(), price)
+                self.assertEqual(dcf_model.get_itermediate_results(), results)
+                self.assertEqual(estimate_ratios.call_count, 1)
+
+                # the memoized estimates expire
+                self.assertEqual(len(memoized_keys()), 1)
+                (value, expire_time) = test_cache.cache.get(memoized_keys()[0], expire_time=True)
+                self.assertIsNotNone(expire_time)
+
+                # changed rates reuse the estimates, and are not memoized
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                dcf_model.discount_rate = 0.08
+                self.assertEqual(round(dcf_model.calculate_dcf_price(), 3), 6.208)
+                repriced = dcf_model.reprice(discount_rate=0.09)
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                dcf_model.discount_rate = 0.09
+                self.assertEqual(dcf_model.calculate_dcf_price(), repriced)
+                dcf_model.calculate_sensitivity([0.08, 0.09, 0.1], [0.02, 0.025])
+                self.assertEqual(estimate_ratios.call_count, 1)
+                self.assertEqual(len(memoized_keys()), 1)
+
+                # changed financial data
+                historical_revenue[2018] = 600
+                self.assertNotEqual(JimmyValuationModel('aapl', 2018).calculate_dcf_price(), price)
+                self.assertEqual(estimate_ratios.call_count, 2)
+
+                # changed model version
+                historical_revenue[2018] = 500
+                with patch.object(JimmyValuationModel, 'MODEL_VERSION', JimmyValuationModel.MODEL_VERSION + 1):
+                    self.assertEqual(JimmyValuationModel('aapl', 2018).calculate_dcf_price(), price)
+                self.assertEqual(estimate_ratios.call_count, 3)
+        finally:
+            test_cache.close()
+            shutil.rmtree(self.test_cache_path)
+
+    def test_reprice_after_memoized_estimates(self):
+        """
+            Tests that repricing a model whose estimates were restored from
+            the memoized ones calculates the right price
+        """
+        test_cache = FinancialCache(self.test_cache_path)
+
+        try:
+            with patch.object(base_model, 'cache', new=test_cache), \
+                 patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                              return_value=self.cashflow_statement), \
+                 patch.object(intrinio_data, 'get_historical_revenue',
+                              return_value=self.historical_revenue), \
+                 patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                              return_value=1000):
+
+                # memoize the estimates
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                dcf_model.discount_rate = 0.08
+                dcf_model.calculate_dcf_price()
+
+                dcf_model = JimmyValuationModel('aapl', 2018)
+                self.assertEqual(round(dcf_model.calculate_dcf_price(), 3), 4.618)
+                self.assertEqual(round(dcf_model.reprice(discount_rate=0.08), 3), 6.208)
+                self.assertEqual(round(dcf_model.reprice(discount_rate=0.0975), 3), 4.618)
+                self.assertEqual(dcf_model.get_itermediate_results()['discount_rate'], 0.0975)
+        finally:
+            test_cache.close()
+            shutil.rmtree(self.test_cache_path)
+
+    def test_fingerprint(self):
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        fingerprint = dcf_model.get_fingerprint({'outstanding_shares': 1000})
+
+        self.assertEqual(fingerprint, JimmyValuationModel('AAPL', 2018).get_fingerprint({'outstanding_shares': 1000}))
+        self.assertNotEqual(fingerprint, JimmyValuationModel('aapl', 2017).get_fingerprint({'outstanding_shares': 1000}))
+        self.assertNotEqual(fingerprint, dcf_model.get_fingerprint({'outstanding_shares': 1001}))
+
+        # the rates are not part of the fingerprint
+        dcf_model.long_term_growth_rate = 0.03
+        self.assertEqual(fingerprint, dcf_model.get_fingerprint({'outstanding_shares': 1000}))
+
+    def test_reprice(self):
+        """
+            Tests that repricing a model with different rates returns the same
+            prices as a new calculation, and only discounts the cash flows again
+        """
+        dcf_model = JimmyValuationModel('aapl', 2018)
+
+        with patch.object(intrinio_data, 'get_historical_cashflow_stmt',
+                          return_value=self.cashflow_statement), \
+             patch.object(intrinio_data, 'get_historical_revenue',
+                          return_value=self.historical_revenue), \
+             patch.object(intrinio_data, 'get_outstanding_diluted_shares',
+                          return_value=1000), \
+             patch.object(dcf_model, '__estimate_ratios__', wraps=dcf_model.__estimate_ratios__) as estimate_ratios, \
+             patch.object(dcf_model, '__forecast__', wraps=dcf_model.__forecast__) as forecast, \
+             patch.object(calculator, 'calc_enterprise_value',
+                          wraps=calculator.calc_enterprise_value) as calc_enterprise_value:
+
+            self.assertEqual(round(dcf_model.calculate_dcf_price(), 3), 4.618)
+            self.assertEqual(round(dcf_model.reprice(discount_rate=0.08), 3), 6.208)
+            self.assertEqual(round(dcf_model.reprice(discount_rate=1), 3), 0.208)
+
+            self.assertEqual(dcf_model.get_itermediate_results()['discount_rate'], 1)
+            self.assertEqual(dcf_model.get_itermediate_results()['long_term_growth_rate'], 0.025)
+
+            # unchanged rates
+            self.assertEqual(round(dcf_model.reprice(), 3), 0.208)
+
+            intrinio_data.get_historical_cashflow_stmt.assert_called_once()
+            intrinio_data.get_historical_revenue.assert_called_once()
+            estimate_ratios.assert_called_once()
+            forecast.assert_called_once()
+            self.assertEqual(calc_enterprise_value.call_count, 3)
+
+            # a failed stage runs again
+            with self.assertRaises(CalculationError):
+                dcf_model.reprice(discount_rate=0.0975, long_term_growth_rate=0.0975)
+
+            self.assertEqual(round(dcf_model.reprice(long_term_growth_rate=0.025), 3), 4.618)
+            self.assertEqual(calc_enterprise_value.call_count, 5)
+
+            # a longer forecast runs the forecast again, but not the estimates
+            dcf_model.forecast_end_year += 1
+            dcf_model.calculate_dcf_price()
+
+            self.assertEqual(len(dcf_model.get_itermediate_results()['fcfe_forecast']), 5)
+            estimate_ratios.assert_called_once()
+            self.assertEqual(forecast.call_count, 2)
+
     '''def test_generate_invalid_report(self):
 
         dcf_model = JimmyValuationModel('aapl', 2018)
@@ -0,0 +1,110 @@
+import unittest
+import pickle
+import numpy as np
+from valuation_models.valuation_result import ValuationResult, YearSeries
+
+
+class TestValuationResult(unittest.TestCase):
+
+    def test_year_series(self):
+        series = YearSeries.from_dict({2016: 1, 2018: 3.5, 2017: 2})
+
+        self.assertEqual(series[2016], 1.0)
+        self.assertEqual(series[2018], 3.5)
+        self.assertEqual(list(series.keys()), [2016, 2017, 2018])
+        self.assertEqual(list(series.values()), [1.0, 2.0, 3.5])
+        self.assertEqual(series, {2016: 1, 2017: 2, 2018: 3.5})
+        self.assertEqual(len(series), 3)
+
+        for year in [2015, 2019, '2016', None]:
+            with self.assertRaises(KeyError):
+                series[year]
+
+    def test_year_series_numpy_years(self):
+        series = YearSeries.from_dict({np.int64(2016): 1, np.int64(2017): 2})
+
+        self.assertEqual(series[np.int64(2017)], 2.0)
+        self.assertEqual(series[np.int32(2016)], 1.0)
+        self.assertEqual(list(series.keys()), [2016, 2017])
+        self.assertTrue(all(type(year) is int for year in series))
+
+        with self.assertRaises(KeyError):
+            series[np.int64(2018)]
+
+    def test_year_series_missing_years(self):
+        series = YearSeries.from_dict({2016: 1, 2018: 3})
+
+        self.assertEqual(dict(series), {2016: 1, 2018: 3})
+        self.assertEqual(len(series), 2)
+        self.assertFalse(2017 in series)
+
+        with self.assertRaises(KeyError):
+            series[2017]
+
+        self.assertEqual(dict(YearSeries.from_dict({})), {})
+
+    def test_result_fields(self):
+        result = ValuationResult()
+
+        result['ticker'] = 'AAPL'
+        result['historical_revenue'] = {2017: 100, 2018: 200}
+        result.discount_rate = 0.0975
+
+        self.assertEqual(result['ticker'], 'AAPL')
+        self.assertEqual(result['discount_rate'], 0.0975)
+        self.assertTrue(isinstance(result['historical_revenue'], YearSeries))
+        self.assertEqual(result['historical_revenue'][2018], 200)
+        self.assertEqual(dict(result), {
+            'ticker': 'AAPL',
+            'discount_rate': 0.0975,
+            'historical_revenue': {2017: 100, 2018: 200}
+        })
+        self.assertTrue('ticker' in result)
+        self.assertFalse('fcfe_forecast' in result)
+
+        del result['ticker']
+        self.assertFalse('ticker' in result)
+
+    def test_result_missing_and_unknown_fields(self):
+        result = ValuationResult()
+
+        with self.assertRaises(KeyError):
+            result['fcfe_forecast']
+
+        with self.assertRaises(KeyError):
+            result['unknown'] = 1
+
+        with self.assertRaises(KeyError):
+            result['unknown']
+
+        with self.assertRaises(KeyError):
+            del result['fcfe_forecast']
+
+        with self.assertRaises(AttributeError):
+            result.unknown = 1
+
+        self.assertEqual(result.get('fcfe_forecast'), None)
+
+    def test_result_update(self):
+        result = ValuationResult()
+
+        result.update({'terminal_value': 10.0, 'discounted_cashflows': {2019: 1.0, 2020: 2.0}})
+
+        self.assertEqual(sum(result['discounted_cashflows'].values()), 3.0)
+        self.assertEqual(result['terminal_value'], 10.0)
+
+    def test_result_copy_and_pickle(self):
+        result = ValuationResult()
+        result['ticker'] = 'AAPL'
+        result['fcfe_forecast'] = {2019: 1.0, 2020: 2.0}
+
+        result_copy = result.copy()
+        result_copy['ticker'] = 'MSFT'
+
+        self.assertEqual(result['ticker'], 'AAPL')
+        self.assertEqual(result_copy['fcfe_forecast'], result['fcfe_forecast'])
+
+        unpickled_result = pickle.loads(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+
+        self.assertTrue(isinstance(unpickled_result, ValuationResult))
+        self.assertEqual(unpickled_result, result)
@@ -2,17 +2,19 @@
 
 """
 import argparse
+import csv
 import datetime
 from datetime import timedelta
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from support import util
+from support import instrumentation
 from exception.exceptions import BaseError
 from financial import calculator
 from data_provider import intrinio_data
 from valuation_models.jimmy_model import JimmyValuationModel
 from support.financial_cache import cache
-from reporting.workbook_report import WorkbookReport
-from reporting.jimmy_report_worksheet import JimmyReportWorksheet
 
 #
 # Main script
@@ -33,6 +35,13 @@ description = """ Performs a DCF analisys of a stock and returns the intrinsic p
 parser = argparse.ArgumentParser(description=description)
 parser.add_argument("-ticker", help="Ticker Symbol", type=str)
 parser.add_argument("-ticker-file", help="Ticker Symbol file", type=str)
+parser.add_argument("-workers", help="Number of tickers valued concurrently (default: 1)", type=int, default=1)
+parser.add_argument("-stats-json", help="File where the run statistics are saved as JSON", type=str)
+parser.add_argument("-sensitivity-csv", help="File where the discount rate x growth rate sensitivity grid is saved as CSV", type=str)
+parser.add_argument("-discount-rates", help="Discount rates of the sensitivity grid (default: 0.06 0.14 9)",
+                    type=float, nargs=3, metavar=('FROM', 'TO', 'COUNT'), default=[0.06, 0.14, 9])
+parser.add_argument("-growth-rates", help="Long term growth rates of the sensitivity grid (default: 0.01 0.04 7)",
+                    type=float, nargs=3, metavar=('FROM', 'TO', 'COUNT'), default=[0.01, 0.04, 7])
 parser.add_argument(
     "year", help="Year of the most recent year end financial statements", type=int)
 
@@ -43,15 +52,31 @@ args = parser.parse_args()
 ticker = args.ticker.upper() if args.ticker != None else None
 ticker_file = args.ticker_file
 year = args.year
+workers = args.workers
+stats_json = args.stats_json
+sensitivity_csv = args.sensitivity_csv
 
 if ((ticker == None and ticker_file == None) or (ticker != None and ticker_file != None)):
     print("Invalid Parameters. Must supply either 'ticker' or 'ticker-file' parameter")
     exit(-1)
 
+if workers < 1:
+    print("Invalid Parameters. 'workers' must be greater than zero")
+    exit(-1)
+
+if args.discount_rates[2] < 1 or args.growth_rates[2] < 1:
+    print("Invalid Parameters. The number of sensitivity rates must be greater than zero")
+    exit(-1)
+
+discount_rates = np.linspace(args.discount_rates[0], args.discount_rates[1], int(args.discount_rates[2]))
+growth_rates = np.linspace(args.growth_rates[0], args.growth_rates[1], int(args.growth_rates[2]))
+
 log.debug("Parameters:")
 log.debug("Ticker: %s" % ticker)
 log.debug("Ticker File: %s" % ticker_file)
 log.debug("Year: %d" % year)
+log.debug("Workers: %d" % workers)
+log.debug("Sensitivity CSV: %s" % sensitivity_csv)
 
 today = datetime.datetime.now()
 five_days_ago = today - timedelta(days=5)
@@ -69,25 +94,120 @@ else:
         exit(-1)
 
 
-for ticker in ticker_list:
+def valuate_ticker(ticker : str):
+    """
+        Valuates a single ticker and generates its report. Errors are
+        captured and returned rather than raised, so that one ticker cannot
+        affect the others when they are valued concurrently.
+
+        Parameters
+        ----------
+        ticker : str
+            Ticker Symbol
+
+        Returns
+        -------
+        A tuple of (ticker, results, error) where results is a list of
+        (model name, intrinsic price, current price, sensitivity grid) tuples
+        and error is the message of the error that prevented the valuation, or None.
+        The sensitivity grid is None unless a sensitivity CSV was requested.
+    """
+    # the reporting stack (and openpyxl) is only imported when a report is generated
+    from reporting.workbook_report import WorkbookReport
+    from reporting.jimmy_report_worksheet import JimmyReportWorksheet
+
     try:
         price_dict = intrinio_data.get_daily_stock_close_prices(
             ticker, five_days_ago, today)
         latest_price = price_dict[sorted(
             list(price_dict.keys()), reverse=True)[0]]
 
+        models = {"Jimmy DCF": JimmyValuationModel(ticker, year)}
+
         report = WorkbookReport(None)
         report.add_worksheet(JimmyReportWorksheet(
-        ), "Jimmy DCF", JimmyValuationModel(ticker, year))
+        ), "Jimmy DCF", models["Jimmy DCF"])
 
         report.generate_report('%s-%d.xlsx' % (ticker, year))
 
+        results = []
         for worksheet_title in report.price_dict.keys():
+            sensitivity = None
+            if sensitivity_csv != None:
+                sensitivity = models[worksheet_title].calculate_sensitivity(discount_rates, growth_rates)
+
+            results.append((worksheet_title, report.price_dict[worksheet_title], latest_price, sensitivity))
+
+        return (ticker, results, None)
+
+    except BaseError as be:
+        return (ticker, [], str(be))
+    except Exception as e:
+        return (ticker, [], "Unexpected Error: %s" % str(e))
+
+
+valuated_count = 0
+error_count = 0
+
+sensitivity_rows = []
+
+# results are reported in the same order as the ticker list,
+# regardless of the order in which the workers complete them
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    for (ticker, results, error) in executor.map(valuate_ticker, ticker_list):
+        if error != None:
+            error_count += 1
+            print("Could not valuate %s, %d because: %s" % (ticker, year, error))
+            continue
+
+        valuated_count += 1
+        for (worksheet_title, intrinsic_price, latest_price, sensitivity) in results:
             log.info("Ticker: %s, Model %s, Intrinsic Price: %.6f, Current Price: %.6f" %
-                     (ticker, worksheet_title, report.price_dict[worksheet_title], latest_price))
+                     (ticker, worksheet_title, intrinsic_price, latest_price))
+
+            if sensitivity is None:
+                continue
+
+            # undefined combinations (growth rate >= discount rate) are left empty
+            for (i, discount_rate) in enumerate(discount_rates):
+                for (j, growth_rate) in enumerate(growth_rates):
+                    value = sensitivity[i, j]
+                    sensitivity_rows.append([ticker, worksheet_title, '%.6f' % discount_rate, '%.6f' % growth_rate,
+                                             '' if np.isnan(value) else '%.6f' % value])
+
+log.info("Summary: %d tickers, %d valuated, %d errors" %
+         (len(ticker_list), valuated_count, error_count))
+
+api_stats = intrinio_data.get_api_stats()
+log.info("Intrinio API: %d requests, %d throttled, %d retries, %d rate limited, %d skipped (no data)" %
+         (api_stats['requests'], api_stats['throttles'], api_stats['retries'], api_stats['rate_limited_waits'],
+          api_stats['no_data_cache_hits']))
 
+cache_stats = cache.get_stats()
+log.info("Cache: %d memory hits, %d disk hits, %d misses" %
+         (cache_stats['memory_hits'], cache_stats['disk_hits'], cache_stats['disk_misses']))
+
+run_stats = instrumentation.get_stats()
+for line in instrumentation.format_summary(run_stats).splitlines():
+    log.info(line)
+
+if sensitivity_csv != None:
+    try:
+        with open(sensitivity_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ticker', 'model', 'discount_rate', 'long_term_growth_rate', 'intrinsic_value_per_share'])
+            writer.writerows(sensitivity_rows)
+    except Exception as e:
+        print("Could not write the sensitivity grid because: %s" % str(e))
+
+if stats_json != None:
+    run_stats['api'] = api_stats
+    run_stats['cache'] = cache_stats
+
+    try:
+        instrumentation.dump_json(stats_json, run_stats)
     except BaseError as be:
-        print("Could not valuate %s, %d because: %s" % (ticker, year, str(be)))
+        print("Could not write stats because: %s" % str(be))
 
 # close the financial cache
 cache.close()
@@ -2,21 +2,57 @@
 """
 
 from abc import ABC, abstractmethod
+import hashlib
+import json
+import numpy as np
+from financial import calculator
+from support.financial_cache import cache
+from valuation_models.valuation_result import ValuationResult
 from exception.exceptions import ValidationError
- 
+
+# the prefix and version of memoized stage results in the financial cache.
+# Their expiry is determined by the 'valuation-result' data class of
+# the cache's expiry policy
+RESULT_CACHE_PREFIX = "valuation-result"
+RESULT_CACHE_VERSION = "v3"
+
+
+def digest(value : object):
+    '''
+        Returns a hash (hex string) of a value made of dictionaries,
+        lists, strings and numbers. Floats are hashed using their
+        shortest exact representation.
+    '''
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
 class BaseValudationModel(ABC):
     """
         Base class for all Valudation Models.
         The current implementation supports the following features:
         1) A consistent method to compute the DCF price
-        2) A dictionary of intermediate results that can be used
-           for debugging purpose
+        2) The intermediate results (a dictionary like ValuationResult)
+           that can be used for debugging purpose
+        3) Calculations split into stages, which only run again when
+           their inputs change (see run_stage and reprice)
+        4) Memoization of the stages that don't depend on the rates,
+           keyed by a fingerprint of their inputs (see run_memoized_stage)
     """
 
-    intermediate_results = {}
+    # The class of the intermediate results
+    RESULT_CLASS = ValuationResult
+
+    # The version of the calculation, which is part of the fingerprint of
+    # the memoized stages. Must be incremented whenever the calculation
+    # changes, so that results memoized by older versions are not used.
+    MODEL_VERSION = 1
 
     HISTORY_YEARS = 4
     FORECAST_YEARS = 4
+
+    # The cash flow statement tags used by the model, so that
+    # only those are read. "None" reads all of them.
+    CASHFLOW_STATEMENT_TAGS = None
  
     def __init__(self, ticker : str, fiscal_year : str):
         super().__init__()
@@ -36,6 +72,9 @@ class BaseValudationModel(ABC):
         self.forecast_start_year = self.fiscal_year + 1
         self.forecast_end_year = self.fiscal_year + self.FORECAST_YEARS
 
+        # stage name => (stage key, stage result), see run_stage
+        self.stages = {}
+
         self.__reset_intermediate_results__()
     
 
@@ -48,12 +87,209 @@ class BaseValudationModel(ABC):
         pass
 
 
+    def run_stage(self, stage : str, stage_key : object, stage_fn : object):
+        '''
+            Runs a stage of the calculation, unless it already ran with the
+            same key, in which case its previous result is returned.
+            The key must describe all the inputs of the stage, including
+            the keys of the stages it depends on, so that changing an input
+            runs the stage and all the stages that depend on it again.
+
+            Failed stages are not kept, and run again on the next call.
+
+            Parameters
+            ----------
+            stage : str
+                The name of the stage
+            stage_key : object
+                A comparable value describing the inputs of the stage
+            stage_fn : object
+                A function, taking no parameters, that runs the stage
+
+            Returns
+            -------
+            The result of the stage
+        '''
+        if stage in self.stages and self.stages[stage][0] == stage_key:
+            return self.stages[stage][1]
+
+        result = stage_fn()
+        self.stages[stage] = (stage_key, result)
+
+        return result
+
+    def run_memoized_stage(self, stage : str, stage_key : object, fingerprint : str,
+                           stage_fn : object, result_fields : list):
+        '''
+            Runs a stage like run_stage, but also memoizes its result in the
+            financial cache, keyed by the supplied fingerprint, so that other
+            model instances with the same inputs don't run it again. The
+            intermediate results set by the stage (result_fields) are memoized
+            and restored along with it.
+
+            The cache is only read and written when the stage itself runs,
+            so repricing a model doesn't access it. Only stages that don't
+            depend on the rates should be memoized, since every combination
+            of rates would otherwise be written to the cache.
+
+            Parameters
+            ----------
+            stage : str
+                The name of the stage
+            stage_key : object
+                A comparable value describing the inputs of the stage
+            fingerprint : str
+                The fingerprint of the inputs of the stage. See get_fingerprint
+            stage_fn : object
+                A function, taking no parameters, that runs the stage
+            result_fields : list
+                The intermediate results set by the stage
+
+            Returns
+            -------
+            The result of the stage
+        '''
+        def memoized_stage_fn():
+            result_cache_key = self.__result_cache_key__(stage, fingerprint)
+            memoized_stage = cache.read(result_cache_key)
+
+            if memoized_stage is not None:
+                self.intermediate_results.update(memoized_stage['intermediate_results'])
+                return memoized_stage['result']
+
+            result = stage_fn()
+
+            cache.write(result_cache_key, {
+                'result': result,
+                'intermediate_results': {field: self.intermediate_results[field] for field in result_fields
+                                         if field in self.intermediate_results}
+            }, data_class=RESULT_CACHE_PREFIX)
+
+            return result
+
+        return self.run_stage(stage, stage_key, memoized_stage_fn)
+
+    def reprice(self, discount_rate : float = None, long_term_growth_rate : float = None):
+        '''
+            Calculates the DCF price again using different rates. Only the
+            stages of the calculation that depend on the rates run again,
+            the financial data and forecasts of the previous calculation are reused.
+
+            Parameters
+            ----------
+            discount_rate : float
+                (optional) the new discount rate
+            long_term_growth_rate : float
+                (optional) the new long term growth rate
+
+            Raises
+            ----------
+            See calculate_dcf_price
+
+            Returns
+            -------
+            A float with calculated DCF price value
+        '''
+        if discount_rate is not None:
+            self.discount_rate = discount_rate
+
+        if long_term_growth_rate is not None:
+            self.long_term_growth_rate = long_term_growth_rate
+
+        return self.calculate_dcf_price()
+
+    def calculate_sensitivity(self, discount_rates : list, long_term_growth_rates : list):
+        '''
+            Calculates the intrinsic value per share for every combination
+            of the supplied discount and long term growth rates, reusing the
+            cash flow forecast of the last calculate_dcf_price call (which is
+            performed first if needed). All combinations are discounted in a
+            single vectorized calculation.
+
+            Parameters
+            ----------
+            discount_rates : list
+                The discount rates (rows of the grid)
+            long_term_growth_rates : list
+                The long term growth rates (columns of the grid)
+
+            Raises
+            ----------
+            DataError
+                In case of any errors reading financial data
+            CalculationError
+                In case the cash flows cannot be forecast
+
+            Returns
+            -------
+            A 2-D numpy array of intrinsic values per share, with one row per
+            discount rate and one column per growth rate. Combinations for
+            which the DCF is undefined (e.g. growth rate >= discount rate)
+            are NaN.
+        '''
+        if 'fcfe_forecast' not in self.intermediate_results:
+            self.calculate_dcf_price()
+
+        fcfe_forecast = self.intermediate_results['fcfe_forecast']
+        outstanding_shares = self.intermediate_results['outstanding_shares']
+
+        forecast = [fcfe_forecast[year] for year in sorted(fcfe_forecast.keys())]
+
+        (discount_grid, growth_grid) = np.meshgrid(
+            np.asarray(discount_rates, dtype=np.float64),
+            np.asarray(long_term_growth_rates, dtype=np.float64), indexing='ij')
+
+        values = np.full(discount_grid.shape, np.nan, dtype=np.float64)
+        valid = (discount_grid > 0) & (growth_grid > 0) & (growth_grid < discount_grid)
+
+        if np.any(valid):
+            valid_discount_rates = discount_grid[valid]
+            (enterprise_values, x) = calculator.calc_enterprise_values(
+                np.broadcast_to(forecast, (len(valid_discount_rates), len(forecast))),
+                growth_grid[valid], valid_discount_rates)
+
+            values[valid] = enterprise_values / outstanding_shares
+
+        return values
+
+    def get_fingerprint(self, financial_inputs : dict):
+        '''
+            Returns a fingerprint of the inputs of the stages that don't depend
+            on the rates: the model (name and version), the ticker, the fiscal year,
+            the history years, and the supplied financial data. Any change to
+            one of these inputs results in a different fingerprint.
+
+            Parameters
+            ----------
+            financial_inputs : dict
+                The financial data read by the model (or its digest), e.g.
+                {'cashflow_statements': {...}, 'outstanding_shares': 1000}
+
+            Returns
+            -------
+            A hex string
+        '''
+        inputs = {
+            'model': type(self).__name__,
+            'model_version': self.MODEL_VERSION,
+            'ticker': self.ticker.upper(),
+            'fiscal_year': self.fiscal_year,
+            'history_years': [self.history_start_year, self.history_end_year],
+            'financial_inputs': financial_inputs
+        }
+
+        return digest(inputs)
+
+    def __result_cache_key__(self, stage : str, fingerprint : str):
+        return "%s-%s-%s-%s-%s" % (RESULT_CACHE_PREFIX, RESULT_CACHE_VERSION, self.ticker.upper(), stage, fingerprint)
+
     def get_itermediate_results(self):
         '''
             Returns the intermediate and final results of this model's
-            calculation as a dictionary. The contents vary by calculation, 
-            however some basic information like the ticker symbol and the
-            range of history and forecast years stay the same.
+            calculation as a ValuationResult, which can be read like a
+            dictionary. The contents vary by calculation, however some basic
+            information like the ticker symbol and the range of history and
+            forecast years stay the same.
 
             Parameters
             ----------
@@ -61,7 +297,7 @@ class BaseValudationModel(ABC):
 
             Returns
             -------
-            A dictionary containing the results of the calculation. These are
+            A ValuationResult containing the results of the calculation. These are
             used for testing and reporting
         '''
         return self.intermediate_results
@@ -69,7 +305,7 @@ class BaseValudationModel(ABC):
     def __reset_intermediate_results__(self):
 
         '''
-            Resets the dictionary of intermediate results.
+            Resets the intermediate results.
 
             Parameters
             ----------
@@ -80,8 +316,8 @@ class BaseValudationModel(ABC):
             None
         '''
         
-        self.intermediate_results = {}
-        
+        self.intermediate_results = self.RESULT_CLASS()
+
         # populate the intermediate results with basic information
         self.intermediate_results['discount_rate'] = self.discount_rate
         self.intermediate_results['long_term_growth_rate'] = self.long_term_growth_rate
@@ -1,13 +1,14 @@
 """Author: Mark Hanegraaff -- 2019
 """
 
-from valuation_models.base_model import BaseValudationModel
+from valuation_models.base_model import BaseValudationModel, digest
 
 from data_provider import intrinio_data
 from financial import calculator
 import math
 import datetime
 import statistics
+import numpy as np
 from datetime import timedelta
 from exception.exceptions import ValidationError, CalculationError, DataError, ReportError
 import logging
@@ -51,6 +52,31 @@ class JimmyValuationModel(BaseValudationModel):
         3) Inverstor is able to take a control perspective
     """
 
+    CASHFLOW_STATEMENT_TAGS = [
+        'netincome',
+        'netcashfromcontinuingoperatingactivities',
+        'purchaseofplantpropertyandequipment'
+    ]
+
+    # the intermediate results set by the 'estimate' stage, which are memoized with it
+    ESTIMATE_RESULT_FIELDS = [
+        'fcfe_ni_ratio',
+        'calculated_fcfe_ni_ratio',
+        'hist_profit_margin',
+        'calculated_profit_margin',
+        'hist_revenue_growth',
+        'calculated_growth_rate'
+    ]
+
+    # the standard deviation of the discount rate in simulations
+    SIMULATION_DISCOUNT_RATE_STDEV = 0.01
+
+    # the number of scenarios discounted at once in simulations,
+    # which bounds their memory use
+    SIMULATION_BATCH_SIZE = 100000
+
+    SIMULATION_PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+
     def __init__(self, ticker : str, fiscal_year : int):
         super().__init__(ticker, fiscal_year)
 
@@ -60,6 +86,12 @@ class JimmyValuationModel(BaseValudationModel):
         """
             Computes the DCF Price using a variation of the Jimmy method
 
+            The calculation is split into stages: gathering the financial data,
+            estimating the ratios, forecasting the cash flows and discounting them.
+            The results of each stage are kept by the model, and a stage only runs
+            again when its inputs change, so that repricing the model with different
+            rates (see reprice) only discounts the same forecast again.
+
             Parameters
             ----------
             None
@@ -76,12 +108,30 @@ class JimmyValuationModel(BaseValudationModel):
             -------
                 A float with calculated DCF price value
         """
-        #
-        # Gather all necessary data
-        #
-        
+        gather_key = (self.ticker, self.fiscal_year, self.history_start_year, self.history_end_year)
+        financial_data = self.run_stage('gather', gather_key, self.__gather_financial_data__)
+
+        # the estimates don't depend on the rates, so they are memoized
+        # across model instances, keyed by a fingerprint of the financial data
+        fingerprint = self.get_fingerprint({'financial_data': financial_data['digest']})
+        estimates = self.run_memoized_stage('estimate', gather_key, fingerprint,
+                                            lambda: self.__estimate_ratios__(financial_data), self.ESTIMATE_RESULT_FIELDS)
+
+        forecast_key = (gather_key, self.forecast_start_year, self.forecast_end_year)
+        fcfe_forecast = self.run_stage('forecast', forecast_key, lambda: self.__forecast__(financial_data, estimates))
+
+        discount_key = (forecast_key, self.discount_rate, self.long_term_growth_rate)
+        intrinsic_value_per_share = self.run_stage(
+            'discount', discount_key, lambda: self.__discount__(fcfe_forecast, financial_data['outstanding_shares']))
+
+        return intrinsic_value_per_share
+
+    def __gather_financial_data__(self):
+        """
+            Reads the financial data used by the model (the 'gather' stage)
+        """
         cashflow_statements = intrinio_data.get_historical_cashflow_stmt(
-            self.ticker, self.history_start_year, self.history_end_year, None)
+            self.ticker, self.history_start_year, self.history_end_year, self.CASHFLOW_STATEMENT_TAGS)
 
         # get historical fcfe
         historical_fcfe = calculator.get_historical_simple_fcfe(cashflow_statements)
@@ -100,33 +150,167 @@ class JimmyValuationModel(BaseValudationModel):
         outstanding_shares = intrinio_data.get_outstanding_diluted_shares(self.ticker, self.fiscal_year)
         self.intermediate_results['outstanding_shares'] = outstanding_shares
 
-        #
-        # Calculate fcfe_ni_ratio, revenue growth and profit margin
-        # These will be used to estimate the cash flow
-        #
-
-        # get fcfe_ni_ratio
-        fcfe_ni_ratio = self.__calc_fcfe_ni_ratio__(historical_fcfe, historical_net_income)
-        revenue_growth = self.__calc_revenue_growth_rate__(historical_revenue)
+        return {
+            # the financial data is hashed once, rather than each time the fingerprint is calculated
+            'digest': digest({
+                'cashflow_statements': cashflow_statements,
+                'historical_revenue': historical_revenue,
+                'outstanding_shares': outstanding_shares
+            }),
+            'cashflow_statements': cashflow_statements,
+            'historical_fcfe': historical_fcfe,
+            'historical_net_income': historical_net_income,
+            'historical_revenue': historical_revenue,
+            'outstanding_shares': outstanding_shares
+        }
+
+    def __estimate_ratios__(self, financial_data : dict):
+        """
+            Calculates fcfe_ni_ratio, revenue growth and profit margin,
+            which are used to forecast the cash flows (the 'estimate' stage)
+        """
+        return {
+            'fcfe_ni_ratio': self.__calc_fcfe_ni_ratio__(
+                financial_data['historical_fcfe'], financial_data['historical_net_income']),
+            'revenue_growth': self.__calc_revenue_growth_rate__(financial_data['historical_revenue']),
+            'profit_margin': self.__calc_profit_margin__(
+                financial_data['historical_net_income'], financial_data['historical_revenue'])
+        }
+
+    def __forecast__(self, financial_data : dict, estimates : dict):
+        """
+            Forecasts revenue, net income and fcfe (the 'forecast' stage),
+            and returns the fcfe forecast
+        """
+        revenue_forecast = self.__forecast_revenue__(
+            financial_data['historical_revenue'][self.history_end_year], estimates['revenue_growth'])
+        net_income_forecast = self.__forecast_net_income__(revenue_forecast, estimates['profit_margin'])
 
-        # calculate histotical profit margin
-        profit_margin = self.__calc_profit_margin__(historical_net_income, historical_revenue)
-        revenue_forecast = self.__forecast_revenue__(historical_revenue[self.history_end_year], revenue_growth)
-        net_income_forecast = self.__forecast_net_income__(revenue_forecast, profit_margin)
-        fcfe_forecast = self.__forecast_fcfe__(net_income_forecast, fcfe_ni_ratio)
+        return self.__forecast_fcfe__(net_income_forecast, estimates['fcfe_ni_ratio'])
 
-        # Perform DCF Calculation and figure out enterprise value
+    def __discount__(self, fcfe_forecast : dict, outstanding_shares : int):
+        """
+            Performs the DCF Calculation (the 'discount' stage) and
+            returns the intrinsic value per share
+        """
         (enteprise_value, intermediate_results) = calculator.calc_enterprise_value(fcfe_forecast, self.long_term_growth_rate, self.discount_rate)
         
         self.intermediate_results.update(intermediate_results)
 
+        self.intermediate_results['discount_rate'] = self.discount_rate
+        self.intermediate_results['long_term_growth_rate'] = self.long_term_growth_rate
         self.intermediate_results['sum_discounted_cash_flows'] = sum(self.intermediate_results['discounted_cashflows'].values())
         intrinsic_value_per_share = enteprise_value / outstanding_shares
 
         self.intermediate_results['intrinsic_value_per_share'] = intrinsic_value_per_share
+
         return intrinsic_value_per_share
 
-   
+    def simulate_dcf_price(self, scenarios : int = 100000, seed : int = None, current_price : float = None):
+        """
+            Performs a Monte Carlo simulation of the DCF price. Rather than
+            using the median revenue growth, profit margin and fcfe/ni ratio,
+            each scenario samples them from normal distributions fitted to
+            their historical values (the median and the sample standard deviation),
+            and samples the discount rate around the model's discount rate.
+
+            The historical values are those of the last calculate_dcf_price
+            call, which is performed first if needed. Scenarios are evaluated in
+            batches of SIMULATION_BATCH_SIZE using numpy arrays.
+
+            Parameters
+            ----------
+            scenarios : int
+                The number of scenarios
+            seed : int
+                (optional) the seed of the random number generator, so that
+                simulations can be reproduced
+            current_price : float
+                (optional) the current price of the security
+
+            Raises
+            ----------
+            ValidationError
+                In case the number of scenarios is invalid
+            DataError
+                In case of any errors reading financial data
+            CalculationError
+                In case the historical data is not suitable to perform the
+                necessary calculations, or no scenario has a valid DCF price
+
+            Returns
+            -------
+            A dictionary with the distribution of the DCF price, e.g.
+
+            {
+                'scenarios': 100000,
+                'valid_scenarios': 99870,  # scenarios where discount rate > long term growth rate
+                'mean': 215.1,
+                'percentiles': {5: 150.2, 10: 162.9, ..., 95: 290.3},
+                'probability_above_price': 0.42  # None, unless current_price is supplied
+            }
+        """
+        if scenarios == None or scenarios < 1:
+            raise ValidationError("Invalid number of scenarios: %s" % str(scenarios), None)
+
+        if 'fcfe_forecast' not in self.intermediate_results:
+            self.calculate_dcf_price()
+
+        def fit(historical_values : dict, median : float):
+            values = list(historical_values.values())
+            return (median, float(np.std(values, ddof=1)) if len(values) > 1 else 0.0)
+
+        (growth_mean, growth_stdev) = fit(self.intermediate_results['hist_revenue_growth'],
+                                          self.intermediate_results['calculated_growth_rate'])
+        (margin_mean, margin_stdev) = fit(self.intermediate_results['hist_profit_margin'],
+                                          self.intermediate_results['calculated_profit_margin'])
+        (ratio_mean, ratio_stdev) = fit(self.intermediate_results['fcfe_ni_ratio'],
+                                        self.intermediate_results['calculated_fcfe_ni_ratio'])
+
+        latest_revenue = self.intermediate_results['historical_revenue'][self.history_end_year]
+        outstanding_shares = self.intermediate_results['outstanding_shares']
+
+        # 1, 2, ..., forecast years, the exponents of the revenue growth
+        forecast_exponents = np.arange(1, self.forecast_end_year - self.forecast_start_year + 2, dtype=np.float64)
+
+        rng = np.random.default_rng(seed)
+        prices = []
+
+        for batch_start in range(0, scenarios, self.SIMULATION_BATCH_SIZE):
+            batch_size = min(self.SIMULATION_BATCH_SIZE, scenarios - batch_start)
+
+            growth_rates = rng.normal(growth_mean, growth_stdev, batch_size)
+            profit_margins = rng.normal(margin_mean, margin_stdev, batch_size)
+            fcfe_ni_ratios = rng.normal(ratio_mean, ratio_stdev, batch_size)
+            discount_rates = rng.normal(self.discount_rate, self.SIMULATION_DISCOUNT_RATE_STDEV, batch_size)
+
+            # same forecast as __forecast_revenue__, __forecast_net_income__ and __forecast_fcfe__
+            revenue_forecasts = latest_revenue * (1 + growth_rates[:, np.newaxis]) ** forecast_exponents
+            fcfe_forecasts = revenue_forecasts * (profit_margins * fcfe_ni_ratios)[:, np.newaxis]
+
+            valid = discount_rates > self.long_term_growth_rate
+            if not np.any(valid):
+                continue
+
+            (enterprise_values, x) = calculator.calc_enterprise_values(
+                fcfe_forecasts[valid], self.long_term_growth_rate, discount_rates[valid])
+
+            prices.append(enterprise_values / outstanding_shares)
+
+        if len(prices) == 0:
+            raise CalculationError("Could not simulate the DCF price because no scenario had a valid discount rate", None)
+
+        prices = np.concatenate(prices)
+
+        return {
+            'scenarios': scenarios,
+            'valid_scenarios': len(prices),
+            'mean': float(np.mean(prices)),
+            'percentiles': {percentile: float(value) for (percentile, value) in
+                            zip(self.SIMULATION_PERCENTILES, np.percentile(prices, self.SIMULATION_PERCENTILES))},
+            'probability_above_price': float(np.mean(prices > current_price)) if current_price != None else None
+        }
+
     def __calc_fcfe_ni_ratio__(self, hist_fcfe : dict, hist_net_income : dict):
         """
             calculates the fcfe to net income ratio using this formula
@@ -0,0 +1,202 @@
+"""Author: Mark Hanegraaff -- 2019
+
+Compact containers for the intermediate and final results of valuation models.
+
+The results of a model used to be a dictionary holding a few scalars and a
+dozen year=>value dictionaries. When the results of thousands of tickers are
+kept in memory (e.g. to rank them), most of that memory is spent on the
+dictionaries and boxed floats. These classes store the same data using
+fixed fields (__slots__) and float arrays, while still behaving like the
+original dictionaries, e.g.
+
+  results['discount_rate']            -> 0.0975
+  results['historical_revenue'][2018] -> 265595000000.0
+  dict(results['historical_revenue']) -> {2014: ..., 2018: 265595000000.0}
+"""
+from array import array
+from collections.abc import Mapping, MutableMapping
+import math
+import numbers
+
+
+class YearSeries(Mapping):
+    """
+        A read-only year=>value mapping of consecutive years, stored as
+        a float array. Years without a value are stored as NaN and are not
+        part of the mapping, so reading them raises a KeyError, just like
+        a dictionary.
+
+        Attributes:
+            start_year : int
+                The first year of the series
+            data : array
+                The values of the series, as an array of doubles
+    """
+
+    __slots__ = ('start_year', 'data')
+
+    def __init__(self, start_year : int, values : object):
+        '''
+            Initializes the series
+
+            Parameters
+            ----------
+            start_year : int
+            The year of the first value
+            values : object
+            An iterable of values, one per year. None is treated as a missing value
+        '''
+        self.start_year = int(start_year)
+        self.data = array('d', [math.nan if value is None else value for value in values])
+
+    @classmethod
+    def from_dict(cls, year_dict : dict):
+        """
+            Creates a series from a year=>value dictionary, e.g.
+            {2017: 1.0, 2018: 2.0}
+        """
+        if len(year_dict) == 0:
+            return cls(0, [])
+
+        start_year = min(year_dict.keys())
+        end_year = max(year_dict.keys())
+
+        return cls(start_year, [year_dict.get(year) for year in range(start_year, end_year + 1)])
+
+    def __getitem__(self, year : int):
+        # years may also be numpy integers, e.g. those of vectorized calculations
+        i = int(year) - self.start_year if isinstance(year, numbers.Integral) else -1
+
+        if i < 0 or i >= len(self.data) or math.isnan(self.data[i]):
+            raise KeyError(year)
+
+        return self.data[i]
+
+    def __iter__(self):
+        for (i, value) in enumerate(self.data):
+            if not math.isnan(value):
+                yield self.start_year + i
+
+    def __len__(self):
+        return sum(1 for value in self.data if not math.isnan(value))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __getstate__(self):
+        return (self.start_year, self.data)
+
+    def __setstate__(self, state : tuple):
+        (self.start_year, self.data) = state
+
+
+class ValuationResult(MutableMapping):
+    """
+        The intermediate and final results of a valuation model.
+
+        Results are stored in fixed fields, listed by SCALAR_FIELDS and
+        SERIES_FIELDS, and can be read and written using either attributes
+        or dictionary keys. Dictionaries assigned to series fields are
+        stored as YearSeries. Reading a field that was not set raises a KeyError,
+        while writing a field that doesn't exist raises a KeyError too, since
+        results can't hold arbitrary keys. Models with other results should
+        extend this class, adding their fields to SCALAR_FIELDS or SERIES_FIELDS
+        and declaring them in __slots__.
+    """
+
+    SCALAR_FIELDS = (
+        'ticker',
+        'discount_rate',
+        'long_term_growth_rate',
+        'history_start_year',
+        'history_end_year',
+        'forecast_start_year',
+        'forecast_end_year',
+        'outstanding_shares',
+        'calculated_fcfe_ni_ratio',
+        'calculated_profit_margin',
+        'calculated_growth_rate',
+        'terminal_value',
+        'enterprise_value',
+        'sum_discounted_cash_flows',
+        'intrinsic_value_per_share'
+    )
+
+    SERIES_FIELDS = (
+        'historical_fcfe',
+        'historical_net_income',
+        'historical_revenue',
+        'fcfe_ni_ratio',
+        'hist_profit_margin',
+        'hist_revenue_growth',
+        'revenue_forecast',
+        'net_income_forecast',
+        'fcfe_forecast',
+        'discounted_cashflows'
+    )
+
+    __slots__ = SCALAR_FIELDS + SERIES_FIELDS
+
+    def fields(self):
+        """
+            Returns the names of all the fields, including those of subclasses
+        """
+        return self.SCALAR_FIELDS + self.SERIES_FIELDS
+
+    def __getitem__(self, key : str):
+        if key not in self.fields():
+            raise KeyError(key)
+
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key : str, value : object):
+        if key not in self.fields():
+            raise KeyError(key)
+
+        setattr(self, key, value)
+
+    def __setattr__(self, key : str, value : object):
+        if key in self.SERIES_FIELDS and isinstance(value, dict):
+            value = YearSeries.from_dict(value)
+
+        object.__setattr__(self, key, value)
+
+    def __delitem__(self, key : str):
+        if key not in self:
+            raise KeyError(key)
+
+        delattr(self, key)
+
+    def __contains__(self, key : object):
+        return isinstance(key, str) and key in self.fields() and hasattr(self, key)
+
+    def __iter__(self):
+        return (key for key in self.fields() if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state : dict):
+        self.update(state)
+
+    def copy(self):
+        """
+            Returns a shallow copy of the results. Since series are
+            read-only, the copy can be modified independently.
+        """
+        result = type(self)()
+
+        for key in self.fields():
+            if hasattr(self, key):
+                object.__setattr__(result, key, getattr(self, key))
+
+        return result
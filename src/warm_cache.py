@@ -0,0 +1,79 @@
+"""warm_cache.py
+
+"""
+import argparse
+import datetime
+from datetime import timedelta
+import logging
+from exception.exceptions import BaseError
+from data_provider import intrinio_data
+from data_provider import intrinio_cache_warmer
+from valuation_models.jimmy_model import JimmyValuationModel
+from support.financial_cache import cache
+
+#
+# Main script
+#
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+
+description = """ Fetches all the financial statements, metrics and prices needed
+                  to valuate a list of tickers over a range of fiscal years,
+                  so that later valuations run entirely from the cache.
+                  The prices of the current day are only considered cached for
+                  INTRINIO_RECENT_PRICES_TTL_SECONDS (one hour by default).
+
+                  Data that is already cached is skipped.
+              """
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("ticker_file", help="Ticker Symbol file", type=str)
+parser.add_argument("year_from", help="First fiscal year that will be valued", type=int)
+parser.add_argument("year_to", help="Last fiscal year that will be valued", type=int)
+parser.add_argument("-workers", help="Number of concurrent requests (default: 8)", type=int, default=8)
+parser.add_argument("-requests-per-second", help="Maximum Intrinio API request rate", type=float)
+
+log = logging.getLogger()
+
+args = parser.parse_args()
+
+if args.year_from > args.year_to:
+    print("Invalid Parameters. 'year_from' must not be greater than 'year_to'")
+    exit(-1)
+
+if args.workers < 1:
+    print("Invalid Parameters. 'workers' must be greater than zero")
+    exit(-1)
+
+try:
+    with open(args.ticker_file) as f:
+        ticker_list = [ticker for ticker in f.read().splitlines() if ticker.strip() != ""]
+except Exception as e:
+    logging.error("Could run script, because, %s" % (str(e)))
+    exit(-1)
+
+try:
+    if args.requests_per_second != None:
+        intrinio_data.rate_limiter.set_rate(args.requests_per_second)
+
+    # the same range of prices read by valuate_security.py
+    today = datetime.datetime.now()
+    five_days_ago = today - timedelta(days=5)
+
+    requests = intrinio_cache_warmer.plan_valuation_data(
+        ticker_list, args.year_from, args.year_to, JimmyValuationModel.HISTORY_YEARS, five_days_ago, today)
+
+    log.info("Warming %d tickers, %d - %d" % (len(ticker_list), args.year_from, args.year_to))
+
+    stats = intrinio_cache_warmer.warm(requests, args.workers)
+
+    log.info("Items: %d, already cached: %d, fetched: %d, failed: %d" %
+             (stats['items'], stats['cached_items'], stats['fetched_items'], stats['failed_items']))
+    log.info("Coverage: %.1f%%, API requests: %d, elapsed: %.1fs (%.1f items/s)" %
+             (stats['coverage'] * 100, stats['api_requests'], stats['elapsed_seconds'], stats['items_per_second']))
+except BaseError as be:
+    print("Could not warm the cache because: %s" % str(be))
+    exit(-1)
+finally:
+    # close the financial cache
+    cache.close()